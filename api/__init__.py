@@ -1,5 +1,5 @@
 # api/__init__.py
-from . import ichancy_api, captcha_solver
+from . import ichancy_api, captcha_solver, concurrency, circuit_breaker, priority, retry_policy, singleflight, clearance_store, protection_detector, egress_pool, agent_pool
 
-__all__ = ["ichancy_api", "captcha_solver"]
+__all__ = ["ichancy_api", "captcha_solver", "concurrency", "circuit_breaker", "priority", "retry_policy", "singleflight", "clearance_store", "protection_detector", "egress_pool", "agent_pool"]
 
@@ -0,0 +1,120 @@
+# api/agent_pool.py
+import logging
+import threading
+from typing import Dict, List, Optional
+from config import config
+from database import db
+from api.ichancy_api import IchancyAPI, BalanceSnapshot
+
+logger = logging.getLogger(__name__)
+
+class AgentPool:
+    """عدة حسابات وكيل، لكل منها جلسة وكوكيز وحد تزامن مستقل، مع توجيه كل لاعب إلى وكيله"""
+    
+    def __init__(self, accounts: List[Dict[str, str]]):
+        # الحساب الأساسي أولاً: اللاعبون المسجلون قبل دعم عدة حسابات يتبعونه
+        self.agents: List[IchancyAPI] = [IchancyAPI()]
+        for account in accounts:
+            if account['username'] != self.primary.username:
+                self.agents.append(IchancyAPI(account['username'], account['password'], account['parent_id']))
+        
+        self._by_parent: Dict[str, IchancyAPI] = {str(agent.parent_id): agent for agent in self.agents}
+        self._owners: Dict[str, IchancyAPI] = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        
+        if len(self.agents) > 1:
+            logger.info(f"👥 توزيع الطلبات على {len(self.agents)} حسابات وكيل")
+    
+    @property
+    def primary(self) -> IchancyAPI:
+        """حساب الوكيل الأساسي من الإعدادات"""
+        return self.agents[0]
+    
+    def for_player(self, player_id: str) -> IchancyAPI:
+        """وكيل اللاعب: من الذاكرة، ثم حسابه المحفوظ، ثم الحساب الأساسي"""
+        agent = self._owners.get(str(player_id))
+        if agent is not None:
+            return agent
+        
+        found, parent_id = db.get_account_parent_id(player_id=player_id)
+        if not found:
+            # لا حساب محفوظ (أو تعذرت القراءة): الحساب الأساسي دون حفظه، فيُعاد البحث في المرة التالية
+            return self.primary
+        
+        # الحسابات القديمة دون parent_id تتبع الحساب الأساسي دائماً، فتُحفظ كغيرها
+        agent = self._by_parent.get(str(parent_id), self.primary)
+        self._owners[str(player_id)] = agent
+        return agent
+    
+    def for_new_player(self) -> IchancyAPI:
+        """الوكيل الأقل انشغالاً للاعب جديد (بالتناوب عند التساوي)"""
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.agents)
+        
+        rotated = self.agents[start:] + self.agents[:start]
+        return min(rotated, key=_load)
+    
+    def create_player(self, login: str, password: str) -> Dict:
+        """إنشاء لاعب لدى الوكيل الأقل انشغالاً (parent_id في النتيجة لحفظه مع الحساب)"""
+        agent = self.for_new_player()
+        result = agent.create_player(login, password)
+        
+        if result.get('success'):
+            result['parent_id'] = agent.parent_id
+            if result.get('player_id'):
+                self._owners[str(result['player_id'])] = agent
+        
+        return result
+    
+    def deposit(self, player_id: str, amount: float, reference: Optional[str] = None,
+                balance_before: Optional[float] = None) -> Dict:
+        """إيداع رصيد للاعب عبر وكيله"""
+        return self.for_player(player_id).deposit(player_id, amount, reference, balance_before)
+    
+    def withdraw(self, player_id: str, amount: float, reference: Optional[str] = None,
+                 snapshot: Optional[BalanceSnapshot] = None) -> Dict:
+        """سحب رصيد من اللاعب عبر وكيله"""
+        return self.for_player(player_id).withdraw(player_id, amount, reference, snapshot)
+    
+    def get_balance(self, player_id: str) -> Dict:
+        """رصيد اللاعب من وكيله"""
+        return self.for_player(player_id).get_balance(player_id)
+    
+    def write_applied(self, player_id: str, balance_before: float, change: float) -> Optional[bool]:
+        """هل طُبقت كتابة سابقة على رصيد اللاعب لدى وكيله"""
+        return self.for_player(player_id).write_applied(player_id, balance_before, change)
+    
+    def get_player_id(self, login: str) -> Optional[str]:
+        """معرف اللاعب من وكيله المعروف، أو البحث لدى جميع الوكلاء"""
+        for agent in self._agents_for_login(login):
+            player_id = agent.get_player_id(login)
+            if player_id:
+                self._owners[str(player_id)] = agent
+                return player_id
+        return None
+    
+    def check_player_exists(self, login: str) -> bool:
+        """هل اسم اللاعب مستخدم لدى أي من الوكلاء"""
+        return any(agent.check_player_exists(login) for agent in self._agents_for_login(login))
+    
+    def ensure_login(self) -> bool:
+        """التأكد من جلسة الحساب الأساسي"""
+        return self.primary.ensure_login()
+    
+    def _agents_for_login(self, login: str) -> List[IchancyAPI]:
+        # الوكيل المحفوظ مع الحساب أولاً ثم البقية
+        _, parent_id = db.get_account_parent_id(login=login)
+        owner = self._by_parent.get(str(parent_id))
+        if owner is None:
+            return list(self.agents)
+        return [owner] + [agent for agent in self.agents if agent is not owner]
+
+def _load(agent: IchancyAPI) -> float:
+    """انشغال الوكيل: الطلبات الجارية والمنتظرة نسبة إلى حد تزامنه"""
+    snapshot = agent.limiter.snapshot()
+    return (snapshot['in_flight'] + snapshot['waiting']) / max(1, snapshot['limit'])
+
+# إنشاء نسخة وحيدة تستخدمها المعالجات بدلاً من حساب وكيل واحد
+api = AgentPool(config.AGENT_ACCOUNTS)
@@ -0,0 +1,135 @@
+# api/circuit_breaker.py
+import time
+import logging
+import threading
+from typing import Dict
+from config import config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """قاطع دائرة لنقطة نهاية واحدة (مغلق / مفتوح / نصف مفتوح)"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold    # إخفاقات متتالية قبل فتح الدائرة
+        self.recovery_timeout = recovery_timeout      # مدة الانتظار قبل طلب التجربة
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.half_open_calls = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+    
+    def allow_request(self) -> bool:
+        """هل يُسمح بإرسال الطلب الآن"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.recovery_timeout:
+                    return False
+                
+                # انتهت فترة التهدئة: نسمح بطلب تجربة
+                self.state = self.HALF_OPEN
+                self.half_open_calls = 0
+                logger.info(f"🟡 دائرة {self.name} نصف مفتوحة، إرسال طلب تجربة")
+            
+            if self.state == self.HALF_OPEN:
+                if self.half_open_calls >= self.half_open_max_calls:
+                    return False
+                self.half_open_calls += 1
+            
+            return True
+    
+    def record_success(self):
+        """تسجيل طلب ناجح (وصل إلى الخادم ورد بغير 5xx)"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"🟢 تم إغلاق دائرة {self.name} بعد نجاح طلب التجربة")
+            
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self.half_open_calls = 0
+    
+    def record_failure(self, error: str = None):
+        """تسجيل إخفاق (مهلة أو خطأ اتصال أو 5xx)"""
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = error
+            
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        f"🔴 فتح دائرة {self.name} لمدة {self.recovery_timeout} ثانية "
+                        f"بعد {self.consecutive_failures} إخفاقات متتالية"
+                    )
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                self.half_open_calls = 0
+    
+    def release(self):
+        """تحرير مكان طلب التجربة دون نتيجة (لم يُرسل الطلب)"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self.half_open_calls > 0:
+                self.half_open_calls -= 1
+    
+    def retry_in(self) -> float:
+        """الثواني المتبقية قبل السماح بطلب تجربة"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.time() - self.opened_at))
+    
+    def snapshot(self) -> Dict:
+        """حالة القاطع للعرض"""
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'retry_in': self.retry_in(),
+            'last_error': self.last_error
+        }
+
+# تمثيل رقمي لحالة الدائرة في /metrics
+STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+class CircuitBreakerRegistry:
+    """قواطع دائرة مستقلة لكل نقطة نهاية في Ichancy"""
+    
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, endpoint: str) -> CircuitBreaker:
+        """الحصول على قاطع نقطة النهاية (إنشاؤه عند أول استخدام)"""
+        with self._lock:
+            breaker = self.breakers.get(endpoint)
+            
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    endpoint,
+                    failure_threshold=config.APP_CONFIG["circuit_failure_threshold"],
+                    recovery_timeout=config.APP_CONFIG["circuit_recovery_timeout"]
+                )
+                self.breakers[endpoint] = breaker
+            
+            return breaker
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """حالة جميع القواطع"""
+        with self._lock:
+            breakers = dict(self.breakers)
+        return {endpoint: breaker.snapshot() for endpoint, breaker in breakers.items()}
+
+# إنشاء نسخة وحيدة من سجل القواطع
+circuit_breakers = CircuitBreakerRegistry()
+
+metrics.describe('ichancy_circuit_state', 'حالة دائرة نقطة النهاية (0 مغلقة، 1 نصف مفتوحة، 2 مفتوحة)')
+metrics.gauge('ichancy_circuit_state', lambda: {
+    (('endpoint', endpoint),): STATE_VALUES[breaker['state']]
+    for endpoint, breaker in circuit_breakers.snapshot().items()
+})
@@ -0,0 +1,103 @@
+# api/clearance_store.py
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional
+import requests
+from config import config
+from api.egress_pool import DIRECT
+from utils.redis_manager import redis_manager
+
+logger = logging.getLogger(__name__)
+
+class ClearanceStore:
+    """كوكيز تصريح الحماية المشتركة بين محلل الحماية وعميل API (في الذاكرة وRedis)، لكل مخرج تصريحه"""
+    
+    def __init__(self, key: str, default_ttl: float):
+        self.key = key
+        self.default_ttl = default_ttl    # مدة الصلاحية عندما لا تحدد الكوكيز انتهاءها
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+    
+    def save(self, cookies: Dict[str, str], user_agent: Optional[str] = None,
+             expires_at: Optional[float] = None, scope: str = DIRECT) -> Optional[Dict]:
+        """حفظ تصريح جديد (التصريح مرتبط بـ User-Agent وعنوان المخرج الذي حصل عليه)"""
+        if not cookies:
+            return None
+        
+        now = time.time()
+        entry = {
+            'cookies': dict(cookies),
+            'user_agent': user_agent,
+            'obtained_at': now,
+            'expires_at': min(expires_at or now + self.default_ttl, now + self.default_ttl)
+        }
+        
+        with self._lock:
+            self._entries[scope] = entry
+        
+        try:
+            ttl = max(1, int(entry['expires_at'] - now))
+            redis_manager.setex(self._redis_key(scope), ttl, json.dumps(entry))
+        except Exception as e:
+            logger.error(f"❌ فشل حفظ تصريح الحماية في Redis: {str(e)}")
+        
+        logger.info(
+            f"🍪 تم حفظ تصريح الحماية للمخرج {scope} "
+            f"({len(cookies)} كوكي، صالح لمدة {int(entry['expires_at'] - now)} ثانية)"
+        )
+        return entry
+    
+    def save_from_session(self, session: requests.Session, scope: str = DIRECT) -> Optional[Dict]:
+        """حفظ كوكيز جلسة المحلل بعد تخطي الحماية، مع أقرب انتهاء بينها"""
+        expiries = [cookie.expires for cookie in session.cookies if cookie.expires]
+        
+        return self.save(
+            requests.utils.dict_from_cookiejar(session.cookies),
+            session.headers.get('User-Agent'),
+            min(expiries) if expiries else None,
+            scope
+        )
+    
+    def get(self, scope: str = DIRECT) -> Optional[Dict]:
+        """التصريح الصالح الحالي للمخرج (من الذاكرة، أو من Redis إذا حصلت عليه نسخة أخرى)"""
+        with self._lock:
+            entry = self._entries.get(scope)
+        
+        if entry and entry['expires_at'] > time.time():
+            return entry
+        
+        try:
+            data = redis_manager.get(self._redis_key(scope))
+            if data:
+                entry = json.loads(data)
+                if entry['expires_at'] > time.time():
+                    with self._lock:
+                        self._entries[scope] = entry
+                    return entry
+        except Exception as e:
+            logger.error(f"❌ فشل تحميل تصريح الحماية من Redis: {str(e)}")
+        
+        return None
+    
+    def invalidate(self, scope: str = DIRECT):
+        """إلغاء تصريح المخرج الحالي (رُفض رغم استخدامه)"""
+        with self._lock:
+            self._entries.pop(scope, None)
+        
+        try:
+            redis_manager.delete(self._redis_key(scope))
+        except Exception as e:
+            logger.error(f"❌ فشل حذف تصريح الحماية من Redis: {str(e)}")
+        
+        logger.warning(f"🍪 تم إلغاء تصريح الحماية الحالي للمخرج {scope}")
+    
+    def _redis_key(self, scope: str) -> str:
+        return f"{self.key}:{scope}"
+
+# إنشاء نسخة وحيدة مشتركة
+clearance_store = ClearanceStore(
+    key=config.APP_CONFIG["clearance_key"],
+    default_ttl=config.APP_CONFIG["clearance_ttl"]
+)
@@ -0,0 +1,199 @@
+# api/concurrency.py
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from config import config
+from api.priority import RequestPriority
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class AdaptiveConcurrencyLimiter:
+    """محدد تزامن متكيف (AIMD) للطلبات الصادرة إلى Ichancy"""
+    
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 16,
+                 backoff_ratio: float = 0.5, latency_tolerance: float = 2.0,
+                 cooldown: float = 1.0, max_pause: float = 60, acquire_timeout: float = 60,
+                 aging_interval: float = 5):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio            # نسبة التقليص عند الحمل الزائد
+        self.latency_tolerance = latency_tolerance    # تباطؤ مقبول مقارنة بالزمن المعتاد
+        self.cooldown = cooldown                      # أقل فترة بين تقليصين متتاليين
+        self.max_pause = max_pause                    # أقصى مدة توقف نقبلها من Retry-After
+        self.acquire_timeout = acquire_timeout
+        self.aging_interval = aging_interval          # ثوانٍ انتظار ترفع الطلب درجة أولوية
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition = threading.Condition()
+        self._last_decrease = 0.0
+        self._short_latency: Optional[float] = None
+        self._long_latency: Optional[float] = None
+        self._waiters: List[List[float]] = []
+        self.stats = {'acquired': 0, 'timeouts': 0, 'increases': 0, 'decreases': 0}
+    
+    def acquire(self, timeout: float = None, priority: int = RequestPriority.INTERACTIVE) -> bool:
+        """حجز مكان لطلب صادر حسب الأولوية، أو False إذا انتهت مهلة الانتظار"""
+        deadline = time.time() + (self.acquire_timeout if timeout is None else timeout)
+        waiter = [priority, time.time()]
+        
+        with self._condition:
+            self._waiters.append(waiter)
+            
+            try:
+                while True:
+                    now = time.time()
+                    
+                    if (now >= self.paused_until
+                            and self.in_flight < max(self.min_limit, int(self.limit))
+                            and self._next_waiter(now) is waiter):
+                        self.in_flight += 1
+                        self.stats['acquired'] += 1
+                        return True
+                    
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.stats['timeouts'] += 1
+                        return False
+                    
+                    if now < self.paused_until:
+                        remaining = min(remaining, self.paused_until - now)
+                    
+                    self._condition.wait(remaining)
+            finally:
+                self._waiters.remove(waiter)
+                # قد يكون هناك مكان آخر متاح للطلب التالي في الترتيب
+                self._condition.notify_all()
+    
+    def _next_waiter(self, now: float) -> List[float]:
+        """الطلب صاحب الدور: الأعلى أولوية بعد احتساب مدة الانتظار (منعاً للتجويع)"""
+        return min(
+            self._waiters,
+            key=lambda waiter: (waiter[0] - (now - waiter[1]) / self.aging_interval, waiter[1])
+        )
+    
+    def release(self, latency: float, overloaded: bool = False, retry_after: Optional[str] = None):
+        """تحرير المكان وتعديل الحد بناءً على نتيجة الطلب"""
+        with self._condition:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight = max(0, self.in_flight - 1)
+            
+            if overloaded:
+                self._decrease(retry_after)
+            else:
+                self._on_success(latency, saturated)
+            
+            self._condition.notify_all()
+    
+    def record_overload(self, retry_after: Optional[str] = None):
+        """تسجيل إشارة حمل زائد (429/5xx/مهلة) دون تحرير مكان"""
+        with self._condition:
+            self._decrease(retry_after)
+            self._condition.notify_all()
+    
+    def _on_success(self, latency: float, saturated: bool):
+        if self._long_latency is None:
+            self._short_latency = self._long_latency = latency
+        else:
+            self._short_latency = 0.3 * latency + 0.7 * self._short_latency
+            self._long_latency = 0.05 * latency + 0.95 * self._long_latency
+        
+        if self._short_latency > self._long_latency * self.latency_tolerance:
+            # الخادم يتباطأ: نثبت الحد بدلاً من زيادته
+            return
+        
+        # الزيادة فقط عندما يكون الحد الحالي مستغلاً بالكامل
+        if saturated and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.stats['increases'] += 1
+    
+    def _decrease(self, retry_after: Optional[str]):
+        now = time.time()
+        pause = _parse_retry_after(retry_after)
+        
+        if pause:
+            self.paused_until = max(self.paused_until, now + min(pause, self.max_pause))
+            logger.warning(f"⏸️ إيقاف الطلبات الصادرة {min(pause, self.max_pause):.1f} ثانية (Retry-After)")
+        
+        # إشارات الحمل من نفس الدفعة تُحتسب تقليصاً واحداً
+        if now - self._last_decrease < self.cooldown:
+            return
+        
+        self._last_decrease = now
+        previous_limit = int(self.limit)
+        self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+        self.stats['decreases'] += 1
+        
+        if int(self.limit) != previous_limit:
+            logger.warning(f"📉 تقليل حد الطلبات المتزامنة إلى {int(self.limit)}")
+    
+    def snapshot(self) -> Dict:
+        """حالة المحدد الحالية للعرض والمراقبة"""
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'waiting': len(self._waiters),
+                'paused_for': max(0.0, self.paused_until - time.time()),
+                'latency': self._short_latency,
+                **self.stats
+            }
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """تحويل Retry-After (ثوانٍ أو تاريخ HTTP) إلى مدة بالثواني"""
+    if not value:
+        return None
+    
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# محدد مستقل لكل حساب وكيل: حد المعدل والتباطؤ يخصان جلسة الحساب
+# (مفتاحه parent_id وليس اسم المستخدم، لأنه يظهر كتسمية في /metrics)
+_limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def limiter_for(agent: str) -> AdaptiveConcurrencyLimiter:
+    """محدد تزامن حساب الوكيل (إنشاؤه عند أول استخدام)"""
+    with _limiters_lock:
+        limiter = _limiters.get(agent)
+        
+        if limiter is None:
+            limiter = _limiters[agent] = AdaptiveConcurrencyLimiter(
+                initial_limit=config.APP_CONFIG["upstream_initial_concurrency"],
+                min_limit=config.APP_CONFIG["upstream_min_concurrency"],
+                max_limit=config.APP_CONFIG["upstream_max_concurrency"],
+                acquire_timeout=config.APP_CONFIG["upstream_acquire_timeout"],
+                aging_interval=config.APP_CONFIG["request_priority_aging"]
+            )
+        
+        return limiter
+
+def limiter_snapshots() -> Dict[str, Dict]:
+    """حالة محددات جميع حسابات الوكيل"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {agent: limiter.snapshot() for agent, limiter in limiters.items()}
+
+# القيم اللحظية للمحددات في /metrics
+metrics.describe('ichancy_concurrency_limit', 'حد الطلبات المتزامنة الحالي إلى Ichancy لكل حساب وكيل')
+metrics.gauge('ichancy_concurrency_limit', lambda: {
+    (('agent', agent),): snapshot['limit'] for agent, snapshot in limiter_snapshots().items()
+})
+metrics.describe('ichancy_in_flight', 'الطلبات المرسلة إلى Ichancy وتنتظر الرد لكل حساب وكيل')
+metrics.gauge('ichancy_in_flight', lambda: {
+    (('agent', agent),): snapshot['in_flight'] for agent, snapshot in limiter_snapshots().items()
+})
+metrics.describe('ichancy_waiting', 'الطلبات المنتظرة لمكان ضمن حد التزامن لكل حساب وكيل')
+metrics.gauge('ichancy_waiting', lambda: {
+    (('agent', agent),): snapshot['waiting'] for agent, snapshot in limiter_snapshots().items()
+})
@@ -0,0 +1,176 @@
+# api/egress_pool.py
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+from config import config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# الاتصال المباشر بدون بروكسي
+DIRECT = 'direct'
+
+# نتائج الطلب كما يسجلها المستخدمون
+OK = 'ok'
+FAILURE = 'failure'    # مهلة أو خطأ اتصال أو 429 أو 5xx
+BLOCKED = 'blocked'    # حجب لم يتخطاه تصريح جديد
+
+class Egress:
+    """مخرج واحد لحركة Ichancy (بروكسي أو اتصال مباشر) مع درجة صحته وزمن استجابته"""
+    
+    def __init__(self, proxy_url: Optional[str] = None, smoothing: float = 0.2):
+        self.proxy_url = proxy_url
+        self.name = _egress_name(proxy_url)
+        self.smoothing = smoothing          # وزن آخر نتيجة في المتوسط المتحرك
+        self.health = 1.0                   # 1 = جميع الطلبات الأخيرة نجحت
+        self.latency: Optional[float] = None
+        self.consecutive_blocks = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.last_error = None
+        self.stats = {OK: 0, FAILURE: 0, BLOCKED: 0}
+    
+    @property
+    def proxies(self) -> Dict[str, str]:
+        """قاموس proxies لـ requests (فارغ للاتصال المباشر)"""
+        if not self.proxy_url:
+            return {}
+        return {'http': self.proxy_url, 'https': self.proxy_url}
+    
+    def available(self, now: float = None) -> bool:
+        """هل المخرج خارج فترة الاستبعاد"""
+        return (now or time.time()) >= self.ejected_until
+    
+    def score(self) -> float:
+        """درجة المفاضلة بين المخارج: الصحة مقسومة على زمن الاستجابة"""
+        return self.health / (1.0 + (self.latency or 0.0))
+    
+    def snapshot(self) -> Dict:
+        """حالة المخرج للعرض"""
+        return {
+            'health': round(self.health, 3),
+            'latency': self.latency,
+            'available': self.available(),
+            'ejected_for': max(0.0, self.ejected_until - time.time()),
+            'ejections': self.ejections,
+            'last_error': self.last_error,
+            'stats': dict(self.stats)
+        }
+
+class EgressPool:
+    """مجموعة مخارج مع ربط ثابت لكل جلسة وكيل واستبعاد تلقائي للمخارج المحجوبة"""
+    
+    def __init__(self, proxy_urls: List[str], block_threshold: int = 2, min_health: float = 0.2,
+                 eject_seconds: float = 300, max_eject_seconds: float = 3600):
+        self.egresses: List[Egress] = [
+            Egress(None if url == DIRECT else url) for url in (proxy_urls or [DIRECT])
+        ]
+        self.block_threshold = block_threshold      # حجب متتالٍ يستبعد المخرج
+        self.min_health = min_health                # صحة أقل منها تستبعد المخرج
+        self.eject_seconds = eject_seconds          # مدة الاستبعاد الأول (تتضاعف مع التكرار)
+        self.max_eject_seconds = max_eject_seconds
+        self._assignments: Dict[str, Egress] = {}
+        self._lock = threading.Lock()
+    
+    def assign(self, session_key: str) -> Egress:
+        """مخرج جلسة الوكيل: نفس المخرج ما دام متاحاً، وإلا أفضل مخرج متاح"""
+        with self._lock:
+            current = self._assignments.get(session_key)
+            if current is not None and current.available():
+                return current
+            
+            egress = self._pick()
+            self._assignments[session_key] = egress
+        
+        if current is not None and current is not egress:
+            logger.warning(f"🔀 نقل جلسة {session_key} من المخرج {current.name} إلى {egress.name}")
+        return egress
+    
+    def record(self, egress: Egress, outcome: str, latency: Optional[float] = None, error: str = None):
+        """تسجيل نتيجة طلب عبر المخرج وتحديث درجته (واستبعاده إذا لزم)"""
+        with self._lock:
+            egress.stats[outcome] += 1
+            egress.health += egress.smoothing * ((1.0 if outcome == OK else 0.0) - egress.health)
+            
+            if latency is not None and outcome == OK:
+                if egress.latency is None:
+                    egress.latency = latency
+                else:
+                    egress.latency += egress.smoothing * (latency - egress.latency)
+            
+            if outcome == BLOCKED:
+                egress.consecutive_blocks += 1
+            elif outcome == OK:
+                egress.consecutive_blocks = 0
+            
+            if error:
+                egress.last_error = error
+            
+            # مخرج وحيد لا بديل له، فلا فائدة من استبعاده
+            blocked = egress.consecutive_blocks >= self.block_threshold
+            if len(self.egresses) > 1 and (blocked or egress.health < self.min_health) and egress.available():
+                self._eject(egress, 'حجب متكرر' if blocked else f'صحة منخفضة ({egress.health:.2f})')
+    
+    def eject(self, egress: Egress, reason: str):
+        """استبعاد مخرج يدوياً"""
+        with self._lock:
+            self._eject(egress, reason)
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """حالة جميع المخارج"""
+        with self._lock:
+            return {egress.name: egress.snapshot() for egress in self.egresses}
+    
+    def _pick(self) -> Egress:
+        # أفضل درجة بين المتاحة، مع تفضيل الأقل ارتباطاً بالجلسات عند التساوي
+        now = time.time()
+        available = [egress for egress in self.egresses if egress.available(now)]
+        
+        if not available:
+            # لا نترك البوت بلا مخرج: أقربها لانتهاء الاستبعاد
+            return min(self.egresses, key=lambda egress: egress.ejected_until)
+        
+        load = {}
+        for egress in self._assignments.values():
+            load[egress.name] = load.get(egress.name, 0) + 1
+        
+        return max(available, key=lambda egress: (egress.score(), -load.get(egress.name, 0)))
+    
+    def _eject(self, egress: Egress, reason: str):
+        egress.ejections += 1
+        duration = min(self.eject_seconds * 2 ** (egress.ejections - 1), self.max_eject_seconds)
+        egress.ejected_until = time.time() + duration
+        egress.consecutive_blocks = 0
+        
+        # فرصة جديدة بعد انتهاء الاستبعاد بدلاً من البقاء تحت الحد
+        egress.health = max(egress.health, self.min_health * 2)
+        
+        logger.warning(f"🚷 استبعاد المخرج {egress.name} لمدة {int(duration)} ثانية: {reason}")
+
+def _egress_name(proxy_url: Optional[str]) -> str:
+    """اسم المخرج للسجلات والمقاييس (المضيف والمنفذ بدون بيانات الدخول)"""
+    if not proxy_url:
+        return DIRECT
+    
+    parts = urlsplit(proxy_url)
+    return f"{parts.hostname}:{parts.port}" if parts.port else parts.hostname or proxy_url
+
+# إنشاء نسخة وحيدة من مجموعة المخارج
+egress_pool = EgressPool(
+    config.EGRESS_PROXIES,
+    block_threshold=config.APP_CONFIG["egress_block_threshold"],
+    min_health=config.APP_CONFIG["egress_min_health"],
+    eject_seconds=config.APP_CONFIG["egress_eject_seconds"],
+    max_eject_seconds=config.APP_CONFIG["egress_max_eject_seconds"]
+)
+
+metrics.describe('egress_health', 'درجة صحة المخرج (متوسط متحرك لنجاح الطلبات)')
+metrics.gauge('egress_health', lambda: {
+    (('egress', name),): egress['health'] for name, egress in egress_pool.snapshot().items()
+})
+metrics.describe('egress_available', 'هل المخرج متاح (0 أثناء الاستبعاد)')
+metrics.gauge('egress_available', lambda: {
+    (('egress', name),): 1 if egress['available'] else 0 for name, egress in egress_pool.snapshot().items()
+})
@@ -1,45 +1,125 @@
 # api/ichancy_api.py
 import json
 import time
+import asyncio
 import random
 import logging
 import traceback
-from typing import Dict, Optional, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, TimeoutError as FutureTimeout
+from typing import Dict, Optional, Tuple, Any, Callable
 import requests
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 from config import config
 from database import db
+from api.concurrency import limiter_for
+from api.circuit_breaker import circuit_breakers
+from api.priority import priority_for
+from api.retry_policy import policy_for, request_not_sent, retry_budget, hedge_budget, RETRY, VERIFY
+from api.singleflight import SingleFlight, read_flights, request_key, COALESCED_ENDPOINTS
+from api.clearance_store import clearance_store
+from api.egress_pool import egress_pool, Egress, OK, FAILURE, BLOCKED
+from api.captcha_solver import captcha_solver
+from api.protection_detector import protection_detector, PROTECTION_STATUSES
+from utils.metrics import metrics
+from utils.rate_budget import login_budget_for
+from utils.redis_manager import redis_manager
 
 logger = logging.getLogger(__name__)
 
+metrics.describe('ichancy_requests_total', 'طلبات Ichancy حسب نقطة النهاية ورمز الحالة النهائي (none إذا لم يصل رد)')
+metrics.describe('ichancy_errors_total', 'أخطاء طلبات Ichancy حسب نقطة النهاية ونوع الخطأ')
+metrics.describe('ichancy_attempts_total', 'محاولات الإرسال الفعلية حسب نقطة النهاية ورمز الحالة أو نوع الاستثناء')
+metrics.describe('ichancy_retries_total', 'إعادات المحاولة حسب نقطة النهاية')
+metrics.describe('ichancy_hedges_total', 'الطلبات الاحتياطية المرسلة حسب نقطة النهاية')
+metrics.describe('ichancy_request_seconds', 'الزمن الكلي للطلب شاملاً التأخير والانتظار وإعادة المحاولة')
+metrics.describe('ichancy_pacing_seconds', 'زمن التأخير المشابه للسلوك البشري قبل الطلب')
+metrics.describe('ichancy_queue_seconds', 'زمن انتظار مكان ضمن حد التزامن')
+metrics.describe('ichancy_network_seconds', 'زمن الشبكة لكل محاولة (ok أو overloaded)')
+metrics.describe('ichancy_clearance_total', 'محاولات الحصول على تصريح الحماية حسب النتيجة')
+
+# أنواع الحماية التي يمكن تخطيها بتصريح جديد
+CLEARABLE_PROTECTIONS = {'cloudflare', 'js_challenge', 'browser_verification', 'ddos_protection'}
+
+# محاولة تخطي واحدة لكل مخرج مهما كان عدد الطلبات المحجوبة في نفس اللحظة
+_clearance_flights = SingleFlight()
+
+# خيوط الطلبات المتحوطة (الطلب الأصلي والاحتياطي يعملان بالتوازي) لجميع حسابات الوكيل
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=config.APP_CONFIG["upstream_max_concurrency"] * 2 * (1 + len(config.AGENT_ACCOUNTS)),
+    thread_name_prefix="ichancy-hedge"
+)
+
+class BalanceSnapshot:
+    """لقطة من رصيد لاعب مع وقت جلبها"""
+    
+    def __init__(self, player_id: str, balance: float, fetched_at: float = None):
+        self.player_id = str(player_id)
+        self.balance = float(balance)
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+    
+    @property
+    def age(self) -> float:
+        """عمر اللقطة بالثواني"""
+        return time.time() - self.fetched_at
+    
+    def is_fresh(self, max_age: float = None) -> bool:
+        """هل اللقطة حديثة بما يكفي لتجاوز جلب الرصيد من جديد"""
+        if max_age is None:
+            max_age = config.APP_CONFIG["balance_snapshot_max_age"]
+        return self.age <= max_age
+    
+    def to_dict(self) -> Dict:
+        """تحويل اللقطة إلى قاموس (لتمريرها عبر طابور المهام)"""
+        return {
+            'player_id': self.player_id,
+            'balance': self.balance,
+            'fetched_at': self.fetched_at
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Optional[Dict]) -> Optional['BalanceSnapshot']:
+        """إنشاء لقطة من قاموس"""
+        if not data:
+            return None
+        return cls(data['player_id'], data['balance'], data.get('fetched_at'))
+
 class IchancyAPI:
-    """واجهة برمجة تطبيقات Ichancy مع إدارة أخطاء مفصلة"""
+    """واجهة برمجة تطبيقات Ichancy لحساب وكيل واحد مع إدارة أخطاء مفصلة"""
     
-    def __init__(self):
+    def __init__(self, username: str = None, password: str = None, parent_id: str = None):
+        # الحساب الأساسي من الإعدادات ما لم يُحدد حساب آخر
+        self.username = username or config.AGENT_USERNAME
+        self.password = password or config.AGENT_PASSWORD
+        self.parent_id = parent_id or config.PARENT_ID
+        self.cookie_key = f"{config.APP_CONFIG['cookie_key']}:{self.username}"
+        self.limiter = limiter_for(str(self.parent_id))
+        self.login_budget = login_budget_for(self.username)
         self.session = self._create_session()
         self.is_logged_in = False
         self.login_attempts = 0
         self.last_login_time = 0
-        self.redis_client = config.get_redis_client()
+        self.last_success_time = 0
+        self.session_expires_at = 0
+        self.clearance_obtained_at = 0
+        self.egress_key = f"agent:{self.username}"
+        self.egress: Optional[Egress] = None
         self._setup_headers()
         
         # محاولة تحميل الكوكيز المحفوظة
         self._load_cookies()
+        
+        # المخرج الثابت لجلسة الوكيل مع تصريح حماية حصلت عليه نسخة سابقة أو أخرى
+        self._current_egress()
     
     def _create_session(self):
-        """إنشاء جلسة مع إعادة المحاولة"""
+        """إنشاء جلسة (إعادة المحاولة تتم حسب سياسة كل نقطة نهاية)"""
         session = requests.Session()
         
-        # إعداد إعادة المحاولة
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["GET", "POST", "PUT", "DELETE"]
+        # لا إعادة محاولة داخل urllib3: إعادة إرسال الإيداع أو السحب قد تكررهما
+        adapter = HTTPAdapter(
+            max_retries=0,
+            pool_maxsize=config.APP_CONFIG["upstream_max_concurrency"]
         )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
         session.mount("http://", adapter)
         session.mount("https://", adapter)
         
@@ -67,71 +147,106 @@ class IchancyAPI:
         })
     
     def _save_cookies(self):
-        """حفظ الكوكيز في Redis أو قاعدة البيانات"""
+        """حفظ الكوكيز في Redis (أو في الذاكرة أثناء انقطاعه)"""
         try:
-            cookies_dict = requests.utils.dict_from_cookiejar(self.session.cookies)
-            cookies_json = json.dumps(cookies_dict)
-            
-            if self.redis_client:
-                # حفظ في Redis
-                self.redis_client.setex(
-                    config.APP_CONFIG["cookie_key"],
-                    config.APP_CONFIG["session_timeout"],
-                    cookies_json
-                )
-                logger.debug("💾 تم حفظ الكوكيز في Redis")
-            else:
-                # حفظ في قاعدة البيانات
-                from datetime import datetime, timedelta
-                expiry = datetime.now() + timedelta(seconds=config.APP_CONFIG["session_timeout"])
-                db.add_transaction({
-                    'user_id': 'system',
-                    'player_id': 'cookies',
-                    'type': 'cookie_store',
-                    'amount': 0,
-                    'status': 'stored',
-                    'details': f'Cookies saved until {expiry}'
-                })
-                logger.debug("💾 تم حفظ الكوكيز في قاعدة البيانات")
-                
+            cookies_json = json.dumps(requests.utils.dict_from_cookiejar(self.session.cookies))
+            redis_manager.setex(self.cookie_key, config.APP_CONFIG["session_timeout"], cookies_json)
+            logger.debug("💾 تم حفظ الكوكيز")
         except Exception as e:
             logger.error(f"❌ فشل حفظ الكوكيز: {str(e)}")
     
     def _load_cookies(self):
-        """تحميل الكوكيز من Redis أو قاعدة البيانات"""
+        """تحميل الكوكيز المحفوظة مع ما تبقى من صلاحيتها في رحلة واحدة إلى Redis"""
         try:
-            cookies_json = None
-            
-            if self.redis_client:
-                # تحميل من Redis
-                cookies_json = self.redis_client.get(config.APP_CONFIG["cookie_key"])
-            else:
-                # محاولة تحميل من قاعدة البيانات (محاكاة)
-                cookies_json = None  # نستخدم التخزين المؤقت في الذاكرة
+            cookies_json, ttl = redis_manager.execute_many([
+                ('get', self.cookie_key),
+                ('ttl', self.cookie_key)
+            ])
             
             if cookies_json:
                 cookies_dict = json.loads(cookies_json)
                 self.session.cookies.update(cookies_dict)
                 self.is_logged_in = True
-                logger.info("✅ تم تحميل الكوكيز المحفوظة")
+                
+                # الكوكيز محفوظة بمدة الجلسة، فما تبقى منها هو ما تبقى من الجلسة
+                if ttl and ttl > 0:
+                    self.session_expires_at = time.time() + ttl
+                logger.info(f"✅ تم تحميل الكوكيز المحفوظة للوكيل {self.username}")
                 
         except Exception as e:
             logger.error(f"❌ فشل تحميل الكوكيز: {str(e)}")
     
+    def _current_egress(self) -> Egress:
+        """مخرج جلسة الوكيل (يتغير فقط عند استبعاد المخرج الحالي، مع تصريح المخرج الجديد)"""
+        egress = egress_pool.assign(self.egress_key)
+        
+        if egress is not self.egress:
+            self.egress = egress
+            clearance = clearance_store.get(egress.name)
+            if clearance:
+                self._apply_clearance(clearance)
+        
+        return egress
+    
     def _human_delay(self):
         """تأخير يشبه السلوك البشري"""
-        delay = random.uniform(1.5, 3.5)
+        if config.HUMAN_DELAY_MAX <= 0:
+            return
+        delay = random.uniform(config.HUMAN_DELAY_MIN, config.HUMAN_DELAY_MAX)
         time.sleep(delay)
     
-    def _make_request(self, method: str, endpoint: str, **kwargs) -> Tuple[Optional[requests.Response], Dict]:
-        """إجراء طلب آمن مع تسجيل الأخطاء"""
+    def _make_request(self, method: str, endpoint: str, verify_not_applied: Optional[Callable[[], Optional[bool]]] = None,
+                      **kwargs) -> Tuple[Optional[requests.Response], Dict]:
+        """إجراء طلب آمن (القراءات المتطابقة المتزامنة تُدمج في طلب واحد)"""
+        if endpoint not in COALESCED_ENDPOINTS:
+            return self._perform_request(method, endpoint, verify_not_applied, **kwargs)
+        
+        # الطلبات المتطابقة من حسابين مختلفين ليست نفس الطلب
+        key = request_key(endpoint, kwargs.get('json')) + (self.username,)
+        response, data = read_flights.do(key, self._perform_request, method, endpoint, verify_not_applied, **kwargs)
+        
+        # نسخة لكل مستدعٍ حتى لا يؤثر تعديل أحدهم على الآخرين
+        return response, dict(data)
+    
+    def _perform_request(self, method: str, endpoint: str,
+                         verify_not_applied: Optional[Callable[[], Optional[bool]]] = None,
+                         hedge: bool = True, **kwargs) -> Tuple[Optional[requests.Response], Dict]:
+        """إجراء طلب آمن مع تسجيل الأخطاء (ambiguous في الرد إذا ربما وصل الطلب رغم فشله)"""
         url = config.API_ENDPOINTS.get(endpoint, endpoint)
+        breaker = circuit_breakers.get(endpoint)
+        
+        # رفض فوري عندما تكون الدائرة مفتوحة بدلاً من انتظار المهلة
+        if not breaker.allow_request():
+            error_msg = f"🔌 خدمة Ichancy غير متاحة مؤقتاً، يرجى المحاولة بعد {int(breaker.retry_in()) + 1} ثانية"
+            logger.warning(f"⚠️ دائرة {endpoint} مفتوحة، تم رفض الطلب فوراً")
+            metrics.inc('ichancy_requests_total', endpoint=endpoint, status='none')
+            metrics.inc('ichancy_errors_total', endpoint=endpoint, error_type='circuit_open')
+            return None, {'error': error_msg, 'circuit_open': True}
+        
+        started = time.time()
+        status = 'none'
+        error_type = 'unexpected_error'
         
         try:
             self._human_delay()
+            metrics.observe('ichancy_pacing_seconds', time.time() - started, endpoint=endpoint)
             
             logger.debug(f"🌐 إرسال طلب إلى: {endpoint}")
-            response = self.session.request(method, url, timeout=30, **kwargs)
+            response = self._send_with_retries(method, url, endpoint, breaker, verify_not_applied, hedge, **kwargs)
+            
+            if response is not None and self._is_protection_response(response):
+                retried = self._retry_with_clearance(method, url, endpoint, breaker, started,
+                                                     verify_not_applied, hedge, **kwargs)
+                if retried is not None:
+                    # لا حاجة لباقي صفحة الحماية السابقة
+                    response.close()
+                    response = retried
+            
+            if response is None:
+                error_type = 'overloaded'
+                error_msg = "🚦 ضغط مرتفع على خادم Ichancy، يرجى المحاولة بعد قليل"
+                logger.warning(f"⚠️ {error_msg} - {endpoint}")
+                return None, {'error': error_msg}
             
             # تسجيل الطلب والرد
             request_data = {
@@ -141,22 +256,34 @@ class IchancyAPI:
                 'data': kwargs.get('json', {})
             }
             
-            # محاولة تحليل الرد
-            try:
-                response_data = response.json()
-            except:
-                response_data = {'raw_response': response.text[:500]}
+            # محاولة تحليل الرد (صفحة الحماية تكفي بدايتها المفحوصة، ولا يُحمل باقيها)
+            if self._is_protection_response(response):
+                response_data = {'raw_response': protection_detector.inspect(response).text[:500]}
+                response.close()
+            else:
+                try:
+                    response_data = response.json()
+                except:
+                    response_data = {'raw_response': response.text[:500]}
             
             # التحقق من حالة الرد
+            status = str(response.status_code)
             if response.status_code == 200:
+                error_type = None
                 logger.debug(f"✅ طلب {endpoint} ناجح (Status: {response.status_code})")
                 
+                # الطلب الناجح يثبت صلاحية الجلسة
+                self.last_success_time = time.time()
+                
                 # حفظ الكوكيز بعد الطلبات الناجحة
                 if endpoint != "signin":  # لا نحفظ بعد تسجيل الدخول مباشرة
                     self._save_cookies()
                     
                 return response, response_data
             else:
+                # نعيد فحص الجلسة عند الطلب التالي
+                self.last_success_time = 0
+                
                 error_type = self._detect_error_type(response.status_code, response_data)
                 error_msg = self._extract_error_message(response_data, error_type)
                 
@@ -172,9 +299,13 @@ class IchancyAPI:
                     response_data=json.dumps(response_data, ensure_ascii=False, default=str)
                 )
                 
-                return response, {'error': error_msg, 'status_code': response.status_code}
+                # خطأ الخادم بعد وصول الطلب لا يثبت أن العملية لم تُطبق
+                ambiguous = response.status_code >= 500 and not self._is_protection_response(response)
                 
-        except requests.exceptions.Timeout:
+                return response, {'error': error_msg, 'status_code': response.status_code, 'ambiguous': ambiguous}
+        
+        except requests.exceptions.Timeout as e:
+            error_type = 'timeout_error'
             error_msg = "⏱️ انتهت مهلة الاتصال بالخادم (30 ثانية)"
             logger.error(f"❌ {error_msg} - {endpoint}")
             
@@ -185,9 +316,10 @@ class IchancyAPI:
                 api_endpoint=endpoint
             )
             
-            return None, {'error': error_msg}
+            return None, {'error': error_msg, 'ambiguous': not isinstance(e, requests.exceptions.ConnectTimeout)}
             
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.ConnectionError as e:
+            error_type = 'connection_error'
             error_msg = "🔌 فشل الاتصال بالخادم"
             logger.error(f"❌ {error_msg} - {endpoint}")
             
@@ -198,7 +330,7 @@ class IchancyAPI:
                 api_endpoint=endpoint
             )
             
-            return None, {'error': error_msg}
+            return None, {'error': error_msg, 'ambiguous': not request_not_sent(e)}
             
         except Exception as e:
             error_msg = f"❌ خطأ غير متوقع: {str(e)}"
@@ -212,7 +344,219 @@ class IchancyAPI:
                 stack_trace=traceback.format_exc()
             )
             
-            return None, {'error': error_msg}
+            return None, {'error': error_msg, 'ambiguous': True}
+        
+        finally:
+            metrics.inc('ichancy_requests_total', endpoint=endpoint, status=status)
+            if error_type:
+                metrics.inc('ichancy_errors_total', endpoint=endpoint, error_type=error_type)
+            metrics.observe('ichancy_request_seconds', time.time() - started, endpoint=endpoint)
+    
+    def _send_with_retries(self, method: str, url: str, endpoint: str, breaker,
+                           verify_not_applied: Optional[Callable[[], Optional[bool]]] = None,
+                           hedge: bool = True, **kwargs) -> Optional[requests.Response]:
+        """إرسال الطلب مع إعادة المحاولة حسب سياسة نقطة النهاية والميزانية العامة"""
+        policy = policy_for(endpoint)
+        priority = priority_for(endpoint)
+        retry_budget.record_request()
+        attempt = 0
+        
+        while True:
+            attempt += 1
+            response = None
+            error = None
+            
+            try:
+                if hedge and policy.hedge and config.APP_CONFIG["hedge_reads"]:
+                    response = self._send_hedged(method, url, endpoint, breaker, priority, **kwargs)
+                else:
+                    response = self._send_limited(method, url, endpoint, breaker, priority, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                error = e
+            
+            if response is None and error is None:
+                # لم يتوفر مكان للطلب
+                return None
+            
+            decision = policy.decide(attempt, response.status_code if response is not None else None, error)
+            
+            if decision == VERIFY and not config.APP_CONFIG["upstream_dedupes_reference"]:
+                # بدون تجاهل Ichancy لتكرار المرجع لا يثبت أي تحقق أن الكتابة لن تُطبق لاحقاً
+                decision = None
+            
+            if decision in (RETRY, VERIFY) and not retry_budget.try_spend():
+                logger.warning(f"⚠️ نفدت ميزانية إعادة المحاولة، لن يُعاد طلب {endpoint}")
+                decision = None
+            
+            if decision == VERIFY:
+                # الكتابة لا تُعاد إلا إذا تأكدنا بقراءة جديدة أنها لم تُطبق
+                if verify_not_applied is not None and verify_not_applied() is True:
+                    logger.info(f"🔍 تم التأكد من عدم تطبيق طلب {endpoint}، إعادة المحاولة")
+                    decision = RETRY
+                else:
+                    decision = None
+            
+            if decision != RETRY or not breaker.allow_request():
+                if error is not None:
+                    raise error
+                return response
+            
+            if response is not None:
+                response.close()
+            
+            metrics.inc('ichancy_retries_total', endpoint=endpoint)
+            delay = policy.backoff(attempt)
+            logger.warning(f"🔁 إعادة محاولة {endpoint} ({attempt + 1}/{policy.max_attempts}) بعد {delay:.2f} ثانية")
+            time.sleep(delay)
+    
+    def _send_hedged(self, method: str, url: str, endpoint: str, breaker, priority: int,
+                     **kwargs) -> Optional[requests.Response]:
+        """طلب قراءة مع طلب احتياطي إذا تأخر الرد عن p95 المعتاد، ويُعتمد أسرع رد"""
+        hedge_after = metrics.histogram('ichancy_network_seconds', endpoint=endpoint, outcome='ok').percentile(
+            95, min_samples=config.APP_CONFIG["hedge_min_samples"]
+        )
+        
+        if hedge_after is None:
+            # لا توجد بيانات كافية لتقدير التأخر الطبيعي
+            return self._send_limited(method, url, endpoint, breaker, priority, **kwargs)
+        
+        hedge_budget.record_request()
+        primary = _hedge_executor.submit(self._send_limited, method, url, endpoint, breaker, priority, **kwargs)
+        
+        try:
+            return primary.result(timeout=hedge_after)
+        except FutureTimeout:
+            pass
+        
+        if not hedge_budget.try_spend():
+            return primary.result()
+        
+        logger.debug(f"🪃 لا رد من {endpoint} خلال {hedge_after:.2f} ثانية، إرسال طلب احتياطي")
+        
+        metrics.inc('ichancy_hedges_total', endpoint=endpoint)
+        
+        # الطلب الاحتياطي يستخدم اتصالاً آخر من مجمع الجلسة لأن الأول مشغول
+        hedge = _hedge_executor.submit(self._send_limited, method, url, endpoint, breaker, priority, **kwargs)
+        pending = {primary, hedge}
+        last = primary
+        
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                last = future
+                if future.exception() is None and _usable_response(future.result()):
+                    for loser in pending:
+                        loser.add_done_callback(_discard_response)
+                    return future.result()
+        
+        return last.result()
+    
+    def _send_limited(self, method: str, url: str, endpoint: str, breaker, priority: int,
+                      **kwargs) -> Optional[requests.Response]:
+        """إرسال الطلب ضمن حد التزامن المتكيف وحسب أولويته (None إذا لم يتوفر مكان)"""
+        queued_at = time.time()
+        acquired = self.limiter.acquire(priority=priority)
+        metrics.observe('ichancy_queue_seconds', time.time() - queued_at, endpoint=endpoint)
+        
+        if not acquired:
+            breaker.release()
+            return None
+        
+        egress = self._current_egress()
+        started = time.time()
+        overloaded = True
+        failure = None
+        retry_after = None
+        status = 'none'
+        
+        try:
+            response = self.session.request(method, url, timeout=30, proxies=egress.proxies, stream=True, **kwargs)
+            if response.status_code not in PROTECTION_STATUSES:
+                # الجسم يُحمل هنا كما في الطلب العادي، وصفحات الحماية المحتملة يقرأ الكاشف بدايتها فقط
+                response.content
+            status = str(response.status_code)
+            overloaded = response.status_code == 429 or response.status_code >= 500
+            failure = f"HTTP {response.status_code}" if response.status_code >= 500 else None
+            retry_after = response.headers.get('Retry-After')
+            return response
+        except Exception as e:
+            failure = status = type(e).__name__
+            raise
+        finally:
+            # المهلات وأخطاء الاتصال تُحتسب حملاً زائداً وإخفاقاً للدائرة
+            latency = time.time() - started
+            self.limiter.release(latency, overloaded, retry_after)
+            
+            # صفحات الحماية تُحتسب على المخرج فقط إذا لم يتخطها تصريح جديد
+            if overloaded:
+                egress_pool.record(egress, FAILURE, error=f"HTTP {status}" if status.isdigit() else status)
+            elif status != '403':
+                egress_pool.record(egress, OK, latency)
+            
+            metrics.inc('ichancy_attempts_total', endpoint=endpoint, status=status)
+            metrics.observe('ichancy_network_seconds', latency, endpoint=endpoint,
+                            outcome='overloaded' if overloaded else 'ok')
+            
+            if failure:
+                breaker.record_failure(failure)
+            else:
+                breaker.record_success()
+    
+    def _is_protection_response(self, response: requests.Response) -> bool:
+        """هل الرد صفحة حماية (Cloudflare وما شابه) بدلاً من رد API"""
+        if response.status_code not in PROTECTION_STATUSES:
+            return False
+        return protection_detector.inspect(response).type in CLEARABLE_PROTECTIONS
+    
+    def _retry_with_clearance(self, method: str, url: str, endpoint: str, breaker, requested_at: float,
+                              verify_not_applied: Optional[Callable[[], Optional[bool]]] = None,
+                              hedge: bool = True, **kwargs) -> Optional[requests.Response]:
+        """الحصول على تصريح حماية (مرة واحدة للطلبات المتزامنة) وإعادة الطلب مرة واحدة"""
+        egress = self._current_egress()
+        clearance = clearance_store.get(egress.name)
+        
+        # تصريح حصل عليه طلب آخر بعد إرسال هذا الطلب: لا حاجة لتخطٍ جديد
+        if clearance is None or clearance['obtained_at'] < requested_at:
+            clearance = _clearance_flights.do(('clearance', egress.name), self._obtain_clearance, egress)
+        
+        if clearance is None or not breaker.allow_request():
+            return None
+        
+        self._apply_clearance(clearance)
+        logger.info(f"🍪 إعادة طلب {endpoint} بتصريح الحماية")
+        
+        # الطلب المحجوب لم يصل إلى Ichancy أصلاً، فإعادته آمنة حتى للعمليات المالية
+        response = self._send_with_retries(method, url, endpoint, breaker, verify_not_applied, hedge, **kwargs)
+        
+        if response is not None and self._is_protection_response(response):
+            # محجوب رغم التصريح الجديد: المشكلة في عنوان المخرج نفسه
+            clearance_store.invalidate(egress.name)
+            egress_pool.record(egress, BLOCKED, error=f"HTTP {response.status_code}")
+        
+        return response
+    
+    def _obtain_clearance(self, egress: Egress) -> Optional[Dict]:
+        """تشغيل محلل الحماية عبر المخرج وإرجاع التصريح الذي حفظه له"""
+        response, message = captcha_solver.bypass_cloudflare(config.ORIGIN, max_retries=2, egress=egress, fresh=True)
+        return self._clearance_result(egress, response, message)
+    
+    def _clearance_result(self, egress: Egress, response: Optional[requests.Response], message: str) -> Optional[Dict]:
+        """تسجيل نتيجة محاولة التخطي وقراءة التصريح المحفوظ للمخرج"""
+        if response is None:
+            metrics.inc('ichancy_clearance_total', outcome='failed')
+            logger.warning(f"⚠️ تعذر الحصول على تصريح الحماية عبر {egress.name}: {message}")
+            return None
+        
+        metrics.inc('ichancy_clearance_total', outcome='obtained')
+        return clearance_store.get(egress.name)
+    
+    def _apply_clearance(self, clearance: Dict):
+        """استخدام كوكيز التصريح مع User-Agent الذي صدر له"""
+        self.session.cookies.update(clearance['cookies'])
+        if clearance.get('user_agent'):
+            self.session.headers['User-Agent'] = clearance['user_agent']
+        self.clearance_obtained_at = clearance['obtained_at']
     
     def _detect_error_type(self, status_code: int, response_data: Dict) -> str:
         """كشف نوع الخطأ"""
@@ -280,24 +624,27 @@ class IchancyAPI:
         """تسجيل الدخول إلى حساب الوكيل"""
         
         # التحقق من بيانات الاعتماد
-        if not config.AGENT_USERNAME or not config.AGENT_PASSWORD:
+        if not self.username or not self.password:
             error_msg = "❌ بيانات تسجيل الدخول غير مضبوطة في إعدادات التطبيق"
             logger.error(error_msg)
             return {'success': False, 'error': error_msg}
         
-        # التحقق من تكرار محاولات تسجيل الدخول
+        # التحقق من تكرار محاولات تسجيل الدخول (الحد مشترك بين جميع النسخ)
         current_time = time.time()
-        if self.login_attempts >= 3 and current_time - self.last_login_time < 300:  # 5 دقائق
-            error_msg = "🚫 تم تجاوز عدد محاولات تسجيل الدخول المسموح بها، يرجى الانتظار 5 دقائق"
+        if not self.login_budget.try_acquire():
+            error_msg = (
+                f"🚫 تم تجاوز عدد محاولات تسجيل الدخول المسموح بها، "
+                f"يرجى الانتظار {int(self.login_budget.retry_in()) + 1} ثانية"
+            )
             logger.error(error_msg)
             return {'success': False, 'error': error_msg}
         
         payload = {
-            "username": config.AGENT_USERNAME,
-            "password": config.AGENT_PASSWORD
+            "username": self.username,
+            "password": self.password
         }
         
-        logger.info(f"🔐 محاولة تسجيل الدخول باسم: {config.AGENT_USERNAME}")
+        logger.info(f"🔐 محاولة تسجيل الدخول باسم: {self.username}")
         
         response, data = self._make_request("POST", "signin", json=payload)
         
@@ -311,11 +658,13 @@ class IchancyAPI:
         if isinstance(data, dict) and data.get("result") is True:
             self.is_logged_in = True
             self.login_attempts = 0  # إعادة تعيين عداد المحاولات
+            self.login_budget.reset()
+            self.session_expires_at = self._session_expiry(response)
             
             # حفظ الكوكيز الجديدة
             self._save_cookies()
             
-            logger.info("✅ تم تسجيل الدخول بنجاح إلى حساب الوكيل")
+            logger.info(f"✅ تم تسجيل الدخول بنجاح إلى حساب الوكيل {self.username}")
             return {'success': True, 'data': data}
         else:
             error_msg = data.get('error', 'فشل تسجيل الدخول: رد غير متوقع من الخادم')
@@ -324,7 +673,7 @@ class IchancyAPI:
             error_details = {
                 'error': error_msg,
                 'attempt': self.login_attempts,
-                'username': config.AGENT_USERNAME,
+                'username': self.username,
                 'status_code': response.status_code if response else 'N/A'
             }
             
@@ -332,9 +681,53 @@ class IchancyAPI:
             
             return {'success': False, 'error': error_msg, 'details': error_details}
     
+    def _session_expiry(self, response: requests.Response) -> float:
+        """انتهاء الجلسة: أقرب انتهاء في Set-Cookie، وبحد أقصى session_timeout من الآن"""
+        expires_at = time.time() + config.APP_CONFIG["session_timeout"]
+        
+        for cookie in response.cookies:
+            if cookie.expires:
+                expires_at = min(expires_at, cookie.expires)
+        
+        return expires_at
+    
+    def refresh_session(self) -> bool:
+        """تسجيل دخول جديد قبل انتهاء الجلسة الحالية (الجلسة القديمة تبقى صالحة حتى ينجح)"""
+        logger.info(f"🔄 تجديد جلسة الوكيل قبل انتهائها بـ {max(0, int(self.session_expires_at - time.time()))} ثانية")
+        return bool(self.login().get('success'))
+    
+    def refresh_clearance(self) -> bool:
+        """الحصول على تصريح حماية جديد للمخرج الحالي (مشترك مع الطلبات المحجوبة في نفس اللحظة)"""
+        egress = self._current_egress()
+        clearance = _clearance_flights.do(('clearance', egress.name), self._obtain_clearance, egress)
+        
+        if clearance is None:
+            return False
+        
+        self._apply_clearance(clearance)
+        return True
+    
+    async def refresh_clearance_async(self) -> bool:
+        """نفس refresh_clearance لمستدعٍ على حلقة الأحداث: لا تُحجز الحلقة ولا خيط طوال فترات انتظار التخطي"""
+        egress = await asyncio.to_thread(self._current_egress)
+        response, message = await captcha_solver.bypass_cloudflare_async(
+            config.ORIGIN, max_retries=2, egress=egress, fresh=True
+        )
+        clearance = await asyncio.to_thread(self._clearance_result, egress, response, message)
+        
+        if clearance is None:
+            return False
+        
+        self._apply_clearance(clearance)
+        return True
+    
     def ensure_login(self) -> bool:
         """التأكد من تسجيل الدخول مع إعادة المحاولة"""
         if self.is_logged_in:
+            # لا حاجة لطلب اختباري إذا نجح طلب آخر مؤخراً
+            if time.time() - self.last_success_time < config.APP_CONFIG["session_probe_interval"]:
+                return True
+            
             # التحقق من صلاحية الجلسة
             try:
                 # طلب اختباري للتحقق من الجلسة
@@ -368,7 +761,7 @@ class IchancyAPI:
                 'error': '❌ فشل إنشاء الحساب: لا يمكن الوصول إلى واجهة برمجة التطبيقات'
             }
         
-        if not config.PARENT_ID:
+        if not self.parent_id:
             return {
                 'success': False,
                 'error': '❌ فشل إنشاء الحساب: Parent ID غير مضبوط'
@@ -381,7 +774,7 @@ class IchancyAPI:
             "player": {
                 "email": email,
                 "password": password,
-                "parentId": config.PARENT_ID,
+                "parentId": self.parent_id,
                 "login": login
             }
         }
@@ -391,11 +784,15 @@ class IchancyAPI:
         response, data = self._make_request("POST", "create_player", json=payload)
         
         if response is None:
-            return {'success': False, 'error': '❌ فشل الاتصال بخادم إنشاء الحسابات'}
+            return {'success': False, 'error': data.get('error', '❌ فشل الاتصال بخادم إنشاء الحسابات')}
         
-        if isinstance(data, dict) and data.get("result") is True:
-            # الحصول على معرف اللاعب
-            player_id = self.get_player_id(login)
+        # بعض ردود التسجيل تتضمن بيانات اللاعب بدلاً من true
+        response_player_id = self._extract_player_id(data)
+        
+        if isinstance(data, dict) and (data.get("result") is True or response_player_id):
+            # الحصول على معرف اللاعب: من رد التسجيل، وإلا بالبحث في الإحصائيات
+            # (اسم المستخدم جديد، فلا يوجد في الجدول المحلي بعد)
+            player_id = response_player_id or self.get_player_id(login)
             
             logger.info(f"✅ تم إنشاء اللاعب بنجاح: {login} (ID: {player_id})")
             
@@ -419,6 +816,28 @@ class IchancyAPI:
             
             return {'success': False, 'error': error_msg}
     
+    def _extract_player_id(self, data: Any) -> Optional[str]:
+        """استخراج معرف اللاعب من رد التسجيل إن وجد"""
+        if not isinstance(data, dict):
+            return None
+        
+        result = data.get("result")
+        players = [data.get("player")]
+        if isinstance(result, dict):
+            players.append(result.get("player"))
+        
+        # playerId صريح في الرد أو في result
+        for candidate in (data, result):
+            if isinstance(candidate, dict) and candidate.get("playerId"):
+                return str(candidate["playerId"])
+        
+        # كائن اللاعب المُنشأ
+        for player in players:
+            if isinstance(player, dict) and (player.get("playerId") or player.get("id")):
+                return str(player.get("playerId") or player.get("id"))
+        
+        return None
+    
     def get_player_id(self, login: str) -> Optional[str]:
         """الحصول على معرف اللاعب"""
         try:
@@ -452,7 +871,8 @@ class IchancyAPI:
             logger.error(f"❌ فشل الحصول على معرف اللاعب {login}: {str(e)}")
             return None
     
-    def deposit(self, player_id: str, amount: float) -> Dict:
+    def deposit(self, player_id: str, amount: float, reference: Optional[str] = None,
+                balance_before: Optional[float] = None) -> Dict:
         """إيداع رصيد للاعب"""
         
         if not self.ensure_login():
@@ -469,7 +889,7 @@ class IchancyAPI:
         
         payload = {
             "amount": amount,
-            "comment": None,
+            "comment": reference,  # مفتاح العملية للمطابقة لاحقاً
             "playerId": player_id,
             "currencyCode": "NSP",
             "currency": "NSP",
@@ -478,10 +898,19 @@ class IchancyAPI:
         
         logger.info(f"💰 محاولة إيداع {amount} NSP للاعب {player_id}")
         
-        response, data = self._make_request("POST", "deposit", json=payload)
+        # عند فشل غامض لا نعيد الإيداع إلا إذا بقي الرصيد كما كان قبله
+        verify = None
+        if balance_before is not None:
+            verify = lambda: self._balance_unchanged(player_id, balance_before)
+        
+        response, data = self._make_request("POST", "deposit", verify_not_applied=verify, json=payload)
         
         if response is None:
-            return {'success': False, 'error': '❌ فشل الاتصال بخادم الإيداع'}
+            return {
+                'success': False,
+                'error': data.get('error', '❌ فشل الاتصال بخادم الإيداع'),
+                'ambiguous': data.get('ambiguous', False)
+            }
         
         if isinstance(data, dict) and data.get("result") is True:
             logger.info(f"✅ تم الإيداع بنجاح: {amount} NSP للاعب {player_id}")
@@ -497,9 +926,10 @@ class IchancyAPI:
             
             logger.error(f"❌ فشل إيداع {amount} NSP للاعب {player_id}: {error_msg}")
             
-            return {'success': False, 'error': error_msg}
+            return {'success': False, 'error': error_msg, 'ambiguous': _ambiguous_write(response, data)}
     
-    def withdraw(self, player_id: str, amount: float) -> Dict:
+    def withdraw(self, player_id: str, amount: float, reference: Optional[str] = None,
+                 snapshot: Optional[BalanceSnapshot] = None) -> Dict:
         """سحب رصيد من اللاعب"""
         
         if not self.ensure_login():
@@ -514,15 +944,19 @@ class IchancyAPI:
                 'error': f'❌ المبلغ أقل من الحد الأدنى ({config.APP_CONFIG["min_amount"]} NSP)'
             }
         
-        # التحقق من رصيد اللاعب أولاً
-        balance_result = self.get_balance(player_id)
-        if not balance_result.get('success'):
-            return {
-                'success': False,
-                'error': f'❌ فشل التحقق من الرصيد: {balance_result.get("error", "خطأ غير معروف")}'
-            }
-        
-        current_balance = balance_result.get('balance', 0)
+        # التحقق من رصيد اللاعب أولاً (نكتفي باللقطة إذا كانت حديثة)
+        if snapshot is not None and snapshot.player_id == str(player_id) and snapshot.is_fresh():
+            current_balance = snapshot.balance
+            logger.debug(f"⚡ استخدام رصيد محفوظ منذ {snapshot.age:.1f} ثانية للاعب {player_id}")
+        else:
+            balance_result = self.get_balance(player_id)
+            if not balance_result.get('success'):
+                return {
+                    'success': False,
+                    'error': f'❌ فشل التحقق من الرصيد: {balance_result.get("error", "خطأ غير معروف")}'
+                }
+            
+            current_balance = balance_result.get('balance', 0)
         if current_balance < amount:
             return {
                 'success': False,
@@ -531,7 +965,7 @@ class IchancyAPI:
         
         payload = {
             "amount": -amount,  # سالب للسحب
-            "comment": None,
+            "comment": reference,  # مفتاح العملية للمطابقة لاحقاً
             "playerId": player_id,
             "currencyCode": "NSP",
             "currency": "NSP",
@@ -540,14 +974,28 @@ class IchancyAPI:
         
         logger.info(f"💳 محاولة سحب {amount} NSP من اللاعب {player_id}")
         
-        response, data = self._make_request("POST", "withdraw", json=payload)
+        response, data = self._make_request(
+            "POST", "withdraw",
+            verify_not_applied=lambda: self._balance_unchanged(player_id, current_balance),
+            json=payload
+        )
         
         if response is None:
-            return {'success': False, 'error': '❌ فشل الاتصال بخادم السحب'}
+            return {
+                'success': False,
+                'error': data.get('error', '❌ فشل الاتصال بخادم السحب'),
+                'ambiguous': data.get('ambiguous', False)
+            }
         
         if isinstance(data, dict) and data.get("result") is True:
             logger.info(f"✅ تم السحب بنجاح: {amount} NSP من اللاعب {player_id}")
-            return {'success': True, 'data': data}
+            
+            # الرصيد بعد السحب مشتق من الفرق بدلاً من طلب جديد
+            return {
+                'success': True,
+                'data': data,
+                'snapshot': BalanceSnapshot(player_id, current_balance - amount)
+            }
         else:
             error_msg = data.get('error', '❌ فشل السحب: رد غير متوقع من الخادم')
             
@@ -561,10 +1009,10 @@ class IchancyAPI:
             
             logger.error(f"❌ فشل سحب {amount} NSP من اللاعب {player_id}: {error_msg}")
             
-            return {'success': False, 'error': error_msg}
+            return {'success': False, 'error': error_msg, 'ambiguous': _ambiguous_write(response, data)}
     
-    def get_balance(self, player_id: str) -> Dict:
-        """الحصول على رصيد اللاعب"""
+    def get_balance(self, player_id: str, fresh: bool = False) -> Dict:
+        """الحصول على رصيد اللاعب (fresh: طلب مستقل يبدأ الآن، بلا دمج مع طلب جارٍ ولا تحوط)"""
         
         if not self.ensure_login():
             return {
@@ -577,12 +1025,15 @@ class IchancyAPI:
         
         logger.debug(f"📊 محاولة جلب رصيد اللاعب: {player_id}")
         
-        response, data = self._make_request("POST", "balance", json=payload)
+        if fresh:
+            response, data = self._perform_request("POST", "balance", hedge=False, json=payload)
+        else:
+            response, data = self._make_request("POST", "balance", json=payload)
         
         if response is None:
             return {
                 'success': False,
-                'error': '❌ فشل الاتصال بخادم الرصيد',
+                'error': data.get('error', '❌ فشل الاتصال بخادم الرصيد'),
                 'balance': 0
             }
         
@@ -592,13 +1043,49 @@ class IchancyAPI:
                 if isinstance(result[0], dict):
                     balance = result[0].get("balance", 0)
                     logger.debug(f"✅ رصيد اللاعب {player_id}: {balance} NSP")
-                    return {'success': True, 'balance': balance, 'data': data}
+                    return {
+                        'success': True,
+                        'balance': balance,
+                        'data': data,
+                        'snapshot': BalanceSnapshot(player_id, balance)
+                    }
         
         error_msg = data.get('error', '❌ فشل تحليل بيانات الرصيد')
         logger.error(f"❌ فشل جلب رصيد اللاعب {player_id}: {error_msg}")
         
         return {'success': False, 'error': error_msg, 'balance': 0}
     
+    def _balance_unchanged(self, player_id: str, balance_before: float) -> Optional[bool]:
+        """هل بقي رصيد اللاعب كما كان بعد كتابة فاشلة، None إذا تعذر التحقق"""
+        balance = self._fresh_balance(player_id)
+        
+        if balance is None:
+            return None
+        
+        return abs(balance - float(balance_before)) < 0.01
+    
+    def write_applied(self, player_id: str, balance_before: float, change: float) -> Optional[bool]:
+        """هل طُبقت كتابة سابقة حسب رصيد جديد: False إذا بقي كما كان، True إذا تغير بمقدارها بالضبط،
+        None إذا تعذرت القراءة أو تغير بمقدار آخر (نشاط آخر للاعب)"""
+        balance = self._fresh_balance(player_id)
+        
+        if balance is None:
+            return None
+        if abs(balance - float(balance_before)) < 0.01:
+            return False
+        if abs(balance - (float(balance_before) + change)) < 0.01:
+            return True
+        return None
+    
+    def _fresh_balance(self, player_id: str) -> Optional[float]:
+        """رصيد اللاعب بقراءة جديدة (قراءة منضمة إلى طلب سابق أو متحوطة قد تعيد رصيداً من قبل الكتابة)"""
+        balance_result = self.get_balance(player_id, fresh=True)
+        
+        if not balance_result.get('success'):
+            return None
+        
+        return float(balance_result.get('balance', 0))
+    
     def check_player_exists(self, login: str) -> bool:
         """التحقق من وجود اللاعب"""
         try:
@@ -637,19 +1124,32 @@ class IchancyAPI:
         self._setup_headers()
         self.is_logged_in = False
         self.login_attempts = 0
+        self.session_expires_at = 0
         
         # مسح الكوكيز المخزنة
-        if self.redis_client:
-            self.redis_client.delete(config.APP_CONFIG["cookie_key"])
+        redis_manager.delete(self.cookie_key)
         
         logger.info("🔄 تم إعادة تعيين جلسة API")
 
-# إنشاء نسخة وحيدة من API
-api = IchancyAPI()
+def _usable_response(response: Optional[requests.Response]) -> bool:
+    """هل الرد صالح للاعتماد عليه بدلاً من انتظار الطلب الآخر"""
+    return response is not None and response.status_code < 500 and response.status_code != 429
+
+def _ambiguous_write(response: requests.Response, data: Any) -> bool:
+    """هل فشل الكتابة غامض: خطأ خادم بعد وصول الطلب، أو رد ناجح لا يمكن فهمه"""
+    if response.status_code == 200:
+        return not isinstance(data, dict) or 'result' not in data
+    return bool(data.get('ambiguous')) if isinstance(data, dict) else True
+
+def _discard_response(future):
+    """إغلاق رد الطلب الخاسر في سباق التحوط"""
+    if future.exception() is None and future.result() is not None:
+        future.result().close()
 
 if __name__ == "__main__":
-    # اختبار واجهة برمجة التطبيقات
+    # اختبار واجهة برمجة التطبيقات (الحساب الأساسي)
     print("🔍 اختبار واجهة Ichancy API...")
+    api = IchancyAPI()
     
     try:
         # اختبار تسجيل الدخول
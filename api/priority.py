@@ -0,0 +1,49 @@
+# api/priority.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+class RequestPriority:
+    """أولويات الطلبات الصادرة إلى Ichancy (الأصغر أولاً)"""
+    
+    CRITICAL = 0      # تسجيل الدخول: كل الطلبات الأخرى تنتظره
+    MONEY = 1         # تأكيد الإيداع والسحب
+    INTERACTIVE = 2   # عرض الرصيد وفحص الأسماء وإنشاء الحسابات
+    BACKGROUND = 3    # المطابقة والمزامنة في الخلفية
+
+# الأولوية الافتراضية لكل نقطة نهاية عندما لا يحددها المستدعي
+ENDPOINT_PRIORITIES = {
+    'signin': RequestPriority.CRITICAL,
+    'deposit': RequestPriority.MONEY,
+    'withdraw': RequestPriority.MONEY,
+    'create_player': RequestPriority.INTERACTIVE,
+    'balance': RequestPriority.INTERACTIVE,
+    'statistics': RequestPriority.INTERACTIVE
+}
+
+_current_priority: ContextVar[Optional[int]] = ContextVar('request_priority', default=None)
+
+@contextmanager
+def request_priority(level: int):
+    """تحديد أولوية جميع الطلبات الصادرة داخل هذا السياق"""
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def priority_for(endpoint: str) -> int:
+    """أولوية طلب إلى نقطة نهاية معينة في السياق الحالي"""
+    default = ENDPOINT_PRIORITIES.get(endpoint, RequestPriority.INTERACTIVE)
+    
+    # تسجيل الدخول يبقى عاجلاً مهما كان المستدعي
+    if default == RequestPriority.CRITICAL:
+        return default
+    
+    current = _current_priority.get()
+    return default if current is None else current
+
+def run_with_priority(level: int, func: Callable, *args, **kwargs):
+    """تشغيل دالة متزامنة بأولوية معينة (للاستخدام مع run_in_executor)"""
+    with request_priority(level):
+        return func(*args, **kwargs)
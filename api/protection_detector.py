@@ -0,0 +1,189 @@
+# api/protection_detector.py
+import re
+from typing import Optional, Set
+import requests
+from config import config
+
+# علامات أنظمة الحماية في بداية الصفحة، في نمط واحد يُطابق بمرور واحد
+# (عند تطابق علامتين من نفس الموضع تفوز الأطول لأنها مذكورة أولاً)
+_MARKER_PATTERNS = [
+    ('cloudflare', rb'cloudflare'),
+    ('hcaptcha', rb'hcaptcha'),
+    ('recaptcha', rb'recaptcha'),
+    ('captcha', rb'captcha'),
+    ('ddos', rb'ddos'),
+    ('security', rb'security'),
+    ('protection', rb'protection'),
+    ('rate_limit', rb'rate limit|too many requests'),
+    ('access_denied', rb'access denied'),
+    ('browser', rb'browser'),
+    ('verify', rb'verify'),
+    ('script', rb'<script>'),
+    ('challenge_form', rb'challenge-form'),
+    ('challenge', rb'challenge'),
+    ('jschl', rb'jschl-answer'),
+    ('cf_bypass', rb'cf-chl-bypass'),
+    ('sitekey', rb'sitekey\s*[:=]\s*["\'](?P<sitekey_value>[^"\']+)["\']'),
+]
+
+# فحص مسبق للحرف الأول يتخطى بسرعة المواضع التي لا تبدأ بها أي علامة
+_FIRST_BYTES = b''.join(sorted({
+    alternative[:1] for _, pattern in _MARKER_PATTERNS for alternative in pattern.split(b'|')
+}))
+
+_MARKERS = re.compile(
+    b'(?=[' + re.escape(_FIRST_BYTES) + b'])(?:'
+    + b'|'.join(b'(?P<' + name.encode() + b'>' + pattern + b')' for name, pattern in _MARKER_PATTERNS)
+    + b')',
+    re.IGNORECASE
+)
+
+# رموز الحالة التي قد يكون ردها صفحة حماية (جسمها يُقرأ من الاتصال عند الحاجة فقط)
+PROTECTION_STATUSES = (403, 429, 503)
+
+# علامات صفحة تحدٍّ يمكن حلها (وليست مجرد رد API يمر عبر Cloudflare)
+CHALLENGE_MARKERS = {'challenge', 'challenge_form', 'jschl', 'cf_bypass'}
+
+# علامات تتضمن أخرى لا تُطابق منفصلة لأن الأطول استهلكت موضعها
+_IMPLIED = {
+    'hcaptcha': 'captcha',
+    'recaptcha': 'captcha',
+    'challenge_form': 'challenge',
+}
+
+class ProtectionSignal:
+    """نتيجة فحص رد واحد: نوع الحماية والعلامات التي ظهرت في بدايته"""
+    
+    def __init__(self, protection_type: str, status_code: int, markers: Set[str],
+                 prefix: bytes, encoding: Optional[str], sitekey: Optional[str] = None):
+        self.type = protection_type
+        self.status_code = status_code
+        self.markers = markers
+        self.sitekey = sitekey
+        self._prefix = prefix
+        self._encoding = encoding
+        self._text: Optional[str] = None
+    
+    def has(self, *markers: str) -> bool:
+        """هل ظهرت إحدى العلامات"""
+        return any(marker in self.markers for marker in markers)
+    
+    @property
+    def text(self) -> str:
+        """بداية الصفحة كنص (تُفك مرة واحدة عند الحاجة فقط)"""
+        if self._text is None:
+            self._text = self._prefix.decode(self._encoding or 'utf-8', errors='replace')
+        return self._text
+
+class _PrefixedBody:
+    """جسم رد قُرئت بدايته من الاتصال: البداية أولاً ثم الباقي من الاتصال عند طلبه"""
+    
+    def __init__(self, prefix: bytes, raw):
+        self._prefix = prefix
+        self._raw = raw
+    
+    def read(self, amt: Optional[int] = None, *args, **kwargs) -> bytes:
+        if not self._prefix:
+            return self._raw.read(amt, decode_content=True)
+        
+        if amt is None:
+            data, self._prefix = self._prefix + self._raw.read(decode_content=True), b''
+        else:
+            data, self._prefix = self._prefix[:amt], self._prefix[amt:]
+        return data
+    
+    def close(self):
+        self._raw.close()
+    
+    def release_conn(self):
+        self._raw.release_conn()
+
+class ProtectionDetector:
+    """كشف نوع الحماية من رمز الحالة والرؤوس وبداية محدودة من جسم الرد"""
+    
+    def __init__(self, prefix_bytes: int = 16384):
+        self.prefix_bytes = prefix_bytes
+    
+    def inspect(self, response: requests.Response) -> ProtectionSignal:
+        """فحص الرد مرة واحدة (النتيجة محفوظة على الرد لمن يفحصه بعدنا)"""
+        cached = getattr(response, '_protection_signal', None)
+        if cached is not None:
+            return cached
+        
+        prefix = self._read_prefix(response)
+        markers = set()
+        sitekey = None
+        
+        # العلامات تُبحث في صفحات HTML فقط: رد API (JSON) قد يذكر "security" أو "verify" في رسالة خطئه
+        for match in (_MARKERS.finditer(prefix) if _is_html(response, prefix) else ()):
+            name = match.lastgroup
+            markers.add(name)
+            if name == 'sitekey' and sitekey is None:
+                sitekey = match.group('sitekey_value').decode('ascii', errors='replace')
+        
+        for marker, implied in _IMPLIED.items():
+            if marker in markers:
+                markers.add(implied)
+        
+        signal = ProtectionSignal(
+            self._classify(response, markers), response.status_code, markers,
+            prefix, response.encoding, sitekey
+        )
+        response._protection_signal = signal
+        return signal
+    
+    def _read_prefix(self, response: requests.Response) -> bytes:
+        """بداية الجسم: من الاتصال مباشرة إذا لم يُحمل الرد بعد (stream=True) دون تحميل باقيه"""
+        if getattr(response, '_content', None) is not False or response.raw is None:
+            return response.content[:self.prefix_bytes] if response.content else b''
+        
+        prefix = response.raw.read(self.prefix_bytes, decode_content=True) or b''
+        # من يحتاج الجسم كاملاً بعدنا (json أو text) يقرأ البداية ثم الباقي
+        response.raw = _PrefixedBody(prefix, response.raw)
+        return prefix
+    
+    def _classify(self, response: requests.Response, markers: Set[str]) -> str:
+        status_code = response.status_code
+        headers = response.headers
+        
+        # Cloudflare يعلن عن التحدي صراحة في هذا الرأس
+        if headers.get('cf-mitigated', '').lower() == 'challenge':
+            return 'cloudflare'
+        
+        # رأس cf-ray موجود في كل رد يمر عبر Cloudflare، فرفض 403 من الخادم نفسه ليس تحدياً
+        if status_code == 403 and markers & CHALLENGE_MARKERS:
+            return 'cloudflare'
+        
+        if 'captcha' in markers:
+            if 'hcaptcha' in markers:
+                return 'hcaptcha'
+            if 'recaptcha' in markers:
+                return 'recaptcha'
+            return 'basic_captcha'
+        
+        if markers & {'ddos', 'security', 'protection'}:
+            return 'ddos_protection'
+        
+        if status_code == 429 or 'rate_limit' in markers:
+            return 'rate_limit'
+        
+        if status_code == 403:
+            return 'access_denied'
+        
+        if 'browser' in markers and 'verify' in markers:
+            return 'browser_verification'
+        
+        if 'script' in markers and 'challenge' in markers:
+            return 'js_challenge'
+        
+        return 'unknown'
+
+def _is_html(response: requests.Response, prefix: bytes) -> bool:
+    """هل جسم الرد صفحة HTML (من نوع المحتوى، أو من بدايته إذا لم يُحدد)"""
+    content_type = response.headers.get('Content-Type', '').lower()
+    if content_type:
+        return 'html' in content_type
+    return prefix.lstrip()[:1] == b'<'
+
+# إنشاء نسخة وحيدة من كاشف الحماية
+protection_detector = ProtectionDetector(config.APP_CONFIG["protection_scan_bytes"])
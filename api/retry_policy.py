@@ -0,0 +1,124 @@
+# api/retry_policy.py
+import time
+import random
+import logging
+import threading
+from typing import Optional
+import requests
+from urllib3.exceptions import NewConnectionError
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# قرارات سياسة إعادة المحاولة
+RETRY = 'retry'      # إعادة الإرسال مباشرة
+VERIFY = 'verify'    # إعادة الإرسال فقط بعد التأكد من عدم تطبيق العملية
+STOP = 'stop'        # إرجاع النتيجة كما هي
+
+class RetryPolicy:
+    """سياسة إعادة المحاولة لنقطة نهاية واحدة"""
+    
+    def __init__(self, max_attempts: int = 3, backoff_base: float = 0.2, backoff_max: float = 5,
+                 idempotent: bool = True, hedge: bool = False):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idempotent = idempotent      # القراءة آمنة للتكرار، الكتابة ليست كذلك
+        self.hedge = hedge                # إرسال طلب احتياطي عند التأخر (للقراءة فقط)
+    
+    def decide(self, attempt: int, status_code: Optional[int] = None,
+               error: Optional[Exception] = None) -> str:
+        """تحديد ما إذا كان يجب إعادة المحاولة بعد نتيجة المحاولة الحالية"""
+        if attempt >= self.max_attempts:
+            return STOP
+        
+        if error is not None:
+            # الطلب لم يصل إلى الخادم أصلاً: التكرار آمن دائماً
+            if request_not_sent(error):
+                return RETRY
+            return RETRY if self.idempotent else VERIFY
+        
+        if status_code == 429:
+            # رُفض الطلب قبل معالجته
+            return RETRY
+        
+        if status_code in (500, 502, 503, 504):
+            return RETRY if self.idempotent else VERIFY
+        
+        return STOP
+    
+    def backoff(self, attempt: int) -> float:
+        """مدة الانتظار قبل المحاولة التالية (تصاعدية مع عشوائية كاملة)"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+class RetryBudget:
+    """ميزانية عامة لإعادة المحاولة حتى لا تتضاعف الطلبات أثناء الأعطال"""
+    
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 10):
+        self.ratio = ratio                    # إعادات مسموحة لكل طلب أصلي
+        self.min_per_second = min_per_second  # حد أدنى ثابت حتى مع قلة الطلبات
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated_at = time.time()
+        self.exhausted = 0
+        self._lock = threading.Lock()
+    
+    def record_request(self):
+        """كل طلب أصلي يضيف جزءاً من إعادة محاولة إلى الميزانية"""
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+    
+    def try_spend(self) -> bool:
+        """استهلاك إعادة محاولة واحدة إذا سمحت الميزانية"""
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.max_tokens, self.tokens + (now - self.updated_at) * self.min_per_second)
+            self.updated_at = now
+            
+            if self.tokens < 1:
+                self.exhausted += 1
+                return False
+            
+            self.tokens -= 1
+            return True
+
+def request_not_sent(error: Exception) -> bool:
+    """هل فشل الطلب قبل وصوله إلى الخادم (فشل الاتصال نفسه)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        reason = getattr(error.args[0], 'reason', None)
+        return isinstance(reason, NewConnectionError)
+    
+    return False
+
+# سياسات نقاط النهاية: القراءة تُعاد بسخاء، والكتابة المالية لا تُعاد إلا بعد التحقق
+RETRY_POLICIES = {
+    'signin': RetryPolicy(max_attempts=3, backoff_base=0.5),
+    'statistics': RetryPolicy(max_attempts=4, backoff_base=0.2, hedge=True),
+    'balance': RetryPolicy(max_attempts=4, backoff_base=0.2, hedge=True),
+    'create_player': RetryPolicy(max_attempts=2, backoff_base=0.5, idempotent=False),
+    'deposit': RetryPolicy(max_attempts=3, backoff_base=0.5, idempotent=False),
+    'withdraw': RetryPolicy(max_attempts=3, backoff_base=0.5, idempotent=False)
+}
+
+# الطلبات غير المعروفة تعامل ككتابة
+DEFAULT_POLICY = RetryPolicy(max_attempts=2, backoff_base=0.5, idempotent=False)
+
+def policy_for(endpoint: str) -> RetryPolicy:
+    """سياسة إعادة المحاولة لنقطة نهاية معينة"""
+    return RETRY_POLICIES.get(endpoint, DEFAULT_POLICY)
+
+# إنشاء ميزانية وحيدة مشتركة بين جميع نقاط النهاية
+retry_budget = RetryBudget(
+    ratio=config.APP_CONFIG["retry_budget_ratio"],
+    min_per_second=config.APP_CONFIG["retry_budget_min_per_second"]
+)
+
+# ميزانية منفصلة للطلبات المتحوطة حتى لا تضاعف الحمل عندما يتباطأ الخادم كله
+hedge_budget = RetryBudget(
+    ratio=config.APP_CONFIG["hedge_budget_ratio"],
+    min_per_second=0,
+    max_tokens=5
+)
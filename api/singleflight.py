@@ -0,0 +1,63 @@
+# api/singleflight.py
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# نقاط النهاية التي تُدمج طلباتها المتطابقة (قراءة فقط)
+COALESCED_ENDPOINTS = {'balance', 'statistics'}
+
+class _Flight:
+    """طلب قيد التنفيذ ينتظره مستدعون آخرون"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """دمج الطلبات المتطابقة المتزامنة في طلب واحد تتشارك نتيجته"""
+    
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'shared': 0}
+    
+    def do(self, key: Hashable, func: Callable, *args, **kwargs):
+        """تنفيذ الدالة مرة واحدة لكل مفتاح، والمستدعون المتزامنون ينتظرون نتيجتها"""
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats['leaders'] += 1
+            else:
+                self.stats['shared'] += 1
+        
+        if not leader:
+            logger.debug(f"🔗 انضمام إلى طلب مماثل قيد التنفيذ: {key[0] if isinstance(key, tuple) else key}")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        
+        try:
+            flight.result = func(*args, **kwargs)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+def request_key(endpoint: str, payload: Any) -> tuple:
+    """مفتاح الطلب: نقطة النهاية مع محتوى الطلب بترتيب ثابت"""
+    return endpoint, json.dumps(payload, sort_keys=True, default=str)
+
+# إنشاء نسخة وحيدة لطلبات القراءة إلى Ichancy
+read_flights = SingleFlight()
@@ -1,7 +1,16 @@
 # config.py
 import os
-import redis
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List
+
+def _parse_agent_accounts(value: str) -> List[Dict[str, str]]:
+    """حسابات وكيل بصيغة username:password:parent_id مفصولة بفواصل (كلمة المرور قد تحتوي على :)"""
+    accounts = []
+    for entry in value.split(","):
+        credentials, _, parent_id = entry.strip().rpartition(":")
+        username, _, password = credentials.partition(":")
+        if username and password and parent_id:
+            accounts.append({"username": username, "password": password, "parent_id": parent_id})
+    return accounts
 
 class Config:
     """إعدادات التطبيق للـ Railway"""
@@ -20,14 +29,32 @@ class Config:
     AGENT_PASSWORD = os.getenv("AGENT_PASSWORD", "")
     PARENT_ID = os.getenv("PARENT_ID", "")
     
+    # حسابات وكيل إضافية لتوزيع اللاعبين والطلبات عليها (الحساب الأساسي أعلاه يبقى الأول)
+    AGENT_ACCOUNTS = _parse_agent_accounts(os.getenv("AGENT_ACCOUNTS", ""))
+    
+    # نطاق التأخير بين الطلبات بالثواني (يُصفّر عند الاختبار على الخادم المحلي)
+    HUMAN_DELAY_MIN = float(os.getenv("HUMAN_DELAY_MIN", 1.5))
+    HUMAN_DELAY_MAX = float(os.getenv("HUMAN_DELAY_MAX", 3.5))
+    
     # ========== إعدادات قاعدة البيانات ==========
     DATABASE_URL = os.getenv("DATABASE_URL", "")
     
     # ========== إعدادات Redis للتخزين المؤقت ==========
     REDIS_URL = os.getenv("REDIS_URL", "")
     
+    # ========== إعدادات مخارج الاتصال ==========
+    # بروكسيات مفصولة بفواصل (direct للاتصال المباشر)، وبدونها يُستخدم الاتصال المباشر فقط
+    EGRESS_PROXIES = [proxy.strip() for proxy in os.getenv("EGRESS_PROXIES", "").split(",") if proxy.strip()]
+    
+    # ========== إعدادات المراقبة ==========
+    # منفذ /metrics (معطل افتراضياً)، والعنوان المحلي فقط ما لم يُحدد غيره: المقاييس بلا مصادقة،
+    # ومنفذ Railway (PORT) منشور للعامة
+    METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    
     # ========== إعدادات API URLs ==========
-    ORIGIN = "https://agents.ichancy.com"
+    # يمكن توجيهه إلى الخادم المحلي (tools/fake_ichancy_server.py) للاختبار
+    ORIGIN = os.getenv("ICHANCY_ORIGIN", "https://agents.ichancy.com").rstrip("/")
     API_ENDPOINTS = {
         "signin": f"{ORIGIN}/global/api/User/signIn",
         "create_player": f"{ORIGIN}/global/api/Player/registerPlayer",
@@ -46,7 +73,52 @@ class Config:
         "max_retries": 3,
         "session_timeout": 3600,
         "cookie_key": "ichancy:cookies",
-        "cache_ttl": 300  # 5 دقائق
+        "cache_ttl": 300,  # 5 دقائق (صلاحية القيم المؤقتة في Redis)
+        "cache_local_ttl": 30,  # صلاحية النسخة المحلية (أقصى تأخر عن إبطال في نسخة أخرى)
+        "cache_negative_ttl": 30,  # صلاحية نتيجة "غير موجود"
+        "cache_max_entries": 1024,  # قيم محلية لكل مساحة قبل إخراج الأقدم استخداماً
+        "job_workers": 4,  # عدد منفذي المهام الخلفية
+        "job_poll_interval": 2,  # ثوانٍ بين فحوصات طابور المهام
+        "job_lease_seconds": 120,  # مدة حجز المهمة لمنفذها، تُجدد دورياً أثناء التنفيذ
+        "outbox_sweep_interval": 60,  # ثوانٍ بين جولات حسم العمليات المالية المعلقة
+        "outbox_grace_period": 600,  # عمر العملية المعلقة قبل أن يلمسها الحسم (أطول من أي تنفيذ جارٍ)
+        "balance_snapshot_max_age": 30,  # ثوانٍ يبقى فيها الرصيد المجلوب صالحاً
+        "session_probe_interval": 60,  # ثوانٍ بعد آخر طلب ناجح لا نحتاج فيها لفحص الجلسة
+        "upstream_initial_concurrency": 4,  # الطلبات المتزامنة إلى Ichancy عند البدء
+        "upstream_min_concurrency": 1,
+        "upstream_max_concurrency": 16,
+        "upstream_acquire_timeout": 60,  # أقصى انتظار لمكان طلب قبل إرجاع خطأ
+        "circuit_failure_threshold": 5,  # إخفاقات متتالية تفتح دائرة نقطة النهاية
+        "circuit_recovery_timeout": 30,  # ثوانٍ قبل تجربة نقطة النهاية من جديد
+        "request_priority_aging": 5,  # ثوانٍ انتظار ترفع الطلب المؤجل درجة أولوية
+        "retry_budget_ratio": 0.2,  # إعادات محاولة مسموحة لكل طلب أصلي
+        "retry_budget_min_per_second": 1,  # إعادات مسموحة في الثانية مهما قلّت الطلبات
+        "hedge_reads": True,  # طلب احتياطي لقراءات Ichancy المتأخرة عن p95
+        "hedge_min_samples": 20,  # عينات زمن الاستجابة المطلوبة قبل التحوط
+        "hedge_budget_ratio": 0.05,  # طلبات احتياطية مسموحة لكل طلب قراءة
+        "upstream_dedupes_reference": False,  # هل يتجاهل Ichancy تكرار الإيداع/السحب بنفس المرجع (شرط لإعادة الكتابة الغامضة)
+        "health_check_interval": 60,  # ثوانٍ بين فحوصات حالة قاعدة البيانات وRedis وIchancy
+        "clearance_key": "ichancy:clearance",
+        "clearance_ttl": 1800,  # أقصى صلاحية لكوكيز تصريح الحماية (30 دقيقة)
+        "protection_scan_bytes": 16384,  # بايتات بداية الرد التي يفحصها كاشف الحماية
+        "session_refresh_interval": 15,  # ثوانٍ بين فحوصات انتهاء الجلسة وتصريح الحماية
+        "session_refresh_margin": 300,  # تجديد الجلسة والتصريح قبل انتهائهما بهذه المدة
+        "captcha_attempt_limit": 5,  # محاولات تخطي الحماية المتتالية لجميع النسخ...
+        "captcha_attempt_window": 300,  # ...خلال هذه النافذة بالثواني
+        "login_attempt_limit": 3,  # محاولات تسجيل الدخول المتتالية لجميع النسخ...
+        "login_attempt_window": 300,  # ...خلال هذه النافذة بالثواني
+        "egress_block_threshold": 2,  # مرات حجب متتالية تستبعد المخرج
+        "egress_min_health": 0.2,  # صحة المخرج التي يُستبعد دونها
+        "egress_eject_seconds": 300,  # مدة الاستبعاد الأول (تتضاعف مع كل استبعاد)
+        "egress_max_eject_seconds": 3600,
+        "protection_telemetry_window": 60,  # نافذة تجميع محاولات تخطي الحماية بالثواني
+        "protection_telemetry_samples": 3,  # محاولات مفصلة تُكتب لكل نوع حماية في كل نافذة
+        "protection_telemetry_flush_interval": 60,  # ثوانٍ بين كتابات المحاولات المجمّعة
+        "redis_max_connections": 20,  # اتصالات مجمع Redis المشترك بين جميع المكونات
+        "redis_socket_timeout": 2,  # مهلة أوامر Redis بالثواني قبل التحول إلى الذاكرة
+        "redis_connect_timeout": 2,
+        "redis_health_check_interval": 30,  # فحص الاتصال الخامل قبل إعادة استخدامه
+        "redis_retry_interval": 15  # ثوانٍ في الذاكرة قبل تجربة Redis من جديد بعد انقطاعه
     }
     
     # ========== إعدادات User Agents ==========
@@ -76,16 +148,6 @@ class Config:
         
         return validation
     
-    @classmethod
-    def get_redis_client(cls) -> Optional[redis.Redis]:
-        """الحصول على عميل Redis"""
-        if cls.REDIS_URL:
-            try:
-                return redis.from_url(cls.REDIS_URL, decode_responses=True)
-            except Exception:
-                return None
-        return None
-    
     @classmethod
     def get_db_config(cls) -> Dict[str, Any]:
         """الحصول على إعدادات قاعدة البيانات"""
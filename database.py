@@ -2,21 +2,29 @@
 import os
 import logging
 import json
-from datetime import datetime
-from typing import Dict, List, Optional, Any, Union
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any, Union, Tuple
 import psycopg2
 from psycopg2.extras import RealDictCursor, DictCursor
 import sqlite3
 from contextlib import contextmanager
 from config import config
+from utils.cache import cache_for
 
 logger = logging.getLogger(__name__)
 
+# قراءات متكررة تُخزن مؤقتاً وتُبطل بعد نجاح كل معاملة تغيرها
+account_cache = cache_for('ichancy_account')
+balance_cache = cache_for('user_balance')
+stats_cache = cache_for('user_stats')
+
 class DatabaseManager:
     """مدير قاعدة البيانات المتوافق مع Railway"""
     
     def __init__(self):
         self.db_type = "postgresql" if config.DATABASE_URL else "sqlite"
+        self._pending = threading.local()
         self.init_database()
         logger.info(f"✅ Database initialized: {self.db_type}")
     
@@ -52,6 +60,17 @@ class DatabaseManager:
             raise e
         finally:
             cursor.close()
+            invalidations, self._pending.invalidations = getattr(self._pending, 'invalidations', []), []
+        
+        # بعد الحفظ فقط: الإبطال قبله يسمح لقارئ آخر بإعادة تحميل القيمة القديمة
+        for cache, key in invalidations:
+            cache.invalidate(key)
+    
+    def _invalidate_on_commit(self, cache, key: str):
+        """إبطال قيمة مؤقتة عند نجاح المعاملة الجارية (وتجاهله إذا تراجعت)"""
+        if not hasattr(self._pending, 'invalidations'):
+            self._pending.invalidations = []
+        self._pending.invalidations.append((cache, key))
     
     def init_database(self):
         """تهيئة جداول قاعدة البيانات"""
@@ -79,6 +98,7 @@ class DatabaseManager:
                                 id SERIAL PRIMARY KEY,
                                 user_id VARCHAR(50) REFERENCES users(user_id) ON DELETE CASCADE,
                                 player_id VARCHAR(50),
+                                parent_id VARCHAR(50),
                                 login VARCHAR(100) UNIQUE,
                                 password VARCHAR(100),
                                 email VARCHAR(150),
@@ -90,6 +110,11 @@ class DatabaseManager:
                             )
                         ''')
                         
+                        # الحسابات المنشأة قبل دعم عدة حسابات وكيل تتبع الحساب الأساسي
+                        cursor.execute('''
+                            ALTER TABLE ichancy_accounts ADD COLUMN IF NOT EXISTS parent_id VARCHAR(50)
+                        ''')
+                        
                         # جدول المعاملات
                         cursor.execute('''
                             CREATE TABLE IF NOT EXISTS transactions (
@@ -122,6 +147,65 @@ class DatabaseManager:
                             )
                         ''')
                         
+                        # جدول طابور المهام الخلفية
+                        cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS jobs (
+                                id SERIAL PRIMARY KEY,
+                                job_type VARCHAR(50),
+                                user_id VARCHAR(50),
+                                payload TEXT,
+                                status VARCHAR(20) DEFAULT 'pending',
+                                attempts INTEGER DEFAULT 0,
+                                chat_id VARCHAR(50),
+                                message_id VARCHAR(50),
+                                result TEXT,
+                                error_message TEXT,
+                                worker_id VARCHAR(100),
+                                lease_expires_at TIMESTAMP,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )
+                        ''')
+                        
+                        # المهام المنشأة قبل حجز المهام بمهلة لا منفذ لها
+                        cursor.execute('''
+                            ALTER TABLE jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR(100)
+                        ''')
+                        cursor.execute('''
+                            ALTER TABLE jobs ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP
+                        ''')
+                        
+                        # سجل نوايا العمليات المالية (outbox) للاسترداد بعد الأعطال
+                        cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS money_outbox (
+                                id SERIAL PRIMARY KEY,
+                                idempotency_key VARCHAR(100) UNIQUE NOT NULL,
+                                job_id INTEGER,
+                                user_id VARCHAR(50),
+                                player_id VARCHAR(50),
+                                operation VARCHAR(20),
+                                amount DECIMAL(15, 2),
+                                balance_before DECIMAL(15, 2),
+                                status VARCHAR(20) DEFAULT 'pending',
+                                error_message TEXT,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )
+                        ''')
+                        
+                        # حجوزات الرصيد المحلي أثناء العمليات الخارجية
+                        cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS balance_holds (
+                                id SERIAL PRIMARY KEY,
+                                user_id VARCHAR(50) NOT NULL,
+                                amount DECIMAL(15, 2) NOT NULL,
+                                reference VARCHAR(100) UNIQUE NOT NULL,
+                                status VARCHAR(20) DEFAULT 'active',
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )
+                        ''')
+                        
                         # فهارس للأداء
                         cursor.execute('''
                             CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id)
@@ -135,6 +219,15 @@ class DatabaseManager:
                         cursor.execute('''
                             CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions(created_at)
                         ''')
+                        cursor.execute('''
+                            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)
+                        ''')
+                        cursor.execute('''
+                            CREATE INDEX IF NOT EXISTS idx_outbox_status ON money_outbox(status)
+                        ''')
+                        cursor.execute('''
+                            CREATE INDEX IF NOT EXISTS idx_holds_user_status ON balance_holds(user_id, status)
+                        ''')
                         
                     else:
                         # SQLite implementation
@@ -155,6 +248,7 @@ class DatabaseManager:
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                                 user_id TEXT,
                                 player_id TEXT,
+                                parent_id TEXT,
                                 login TEXT UNIQUE,
                                 password TEXT,
                                 email TEXT,
@@ -167,6 +261,11 @@ class DatabaseManager:
                             )
                         ''')
                         
+                        # الحسابات المنشأة قبل دعم عدة حسابات وكيل تتبع الحساب الأساسي
+                        cursor.execute("PRAGMA table_info(ichancy_accounts)")
+                        if 'parent_id' not in [column['name'] for column in cursor.fetchall()]:
+                            cursor.execute("ALTER TABLE ichancy_accounts ADD COLUMN parent_id TEXT")
+                        
                         cursor.execute('''
                             CREATE TABLE IF NOT EXISTS transactions (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -197,6 +296,72 @@ class DatabaseManager:
                                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                             )
                         ''')
+                        
+                        cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                job_type TEXT,
+                                user_id TEXT,
+                                payload TEXT,
+                                status TEXT DEFAULT 'pending',
+                                attempts INTEGER DEFAULT 0,
+                                chat_id TEXT,
+                                message_id TEXT,
+                                result TEXT,
+                                error_message TEXT,
+                                worker_id TEXT,
+                                lease_expires_at TIMESTAMP,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )
+                        ''')
+                        
+                        # المهام المنشأة قبل حجز المهام بمهلة لا منفذ لها
+                        cursor.execute("PRAGMA table_info(jobs)")
+                        job_columns = [column['name'] for column in cursor.fetchall()]
+                        if 'worker_id' not in job_columns:
+                            cursor.execute("ALTER TABLE jobs ADD COLUMN worker_id TEXT")
+                        if 'lease_expires_at' not in job_columns:
+                            cursor.execute("ALTER TABLE jobs ADD COLUMN lease_expires_at TIMESTAMP")
+                        
+                        cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS money_outbox (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                idempotency_key TEXT UNIQUE NOT NULL,
+                                job_id INTEGER,
+                                user_id TEXT,
+                                player_id TEXT,
+                                operation TEXT,
+                                amount REAL,
+                                balance_before REAL,
+                                status TEXT DEFAULT 'pending',
+                                error_message TEXT,
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )
+                        ''')
+                        
+                        cursor.execute('''
+                            CREATE TABLE IF NOT EXISTS balance_holds (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                user_id TEXT NOT NULL,
+                                amount REAL NOT NULL,
+                                reference TEXT UNIQUE NOT NULL,
+                                status TEXT DEFAULT 'active',
+                                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                            )
+                        ''')
+                        
+                        cursor.execute('''
+                            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)
+                        ''')
+                        cursor.execute('''
+                            CREATE INDEX IF NOT EXISTS idx_outbox_status ON money_outbox(status)
+                        ''')
+                        cursor.execute('''
+                            CREATE INDEX IF NOT EXISTS idx_holds_user_status ON balance_holds(user_id, status)
+                        ''')
                     
                     logger.info("✅ Database tables created successfully")
         
@@ -224,6 +389,7 @@ class DatabaseManager:
                             VALUES (?, ?, ?, ?)
                         ''', (user_id, username, datetime.now(), 1 if user_id in config.ADMIN_USER_IDS else 0))
                     
+                    self._invalidate_on_commit(balance_cache, user_id)
                     logger.info(f"✅ تم إضافة/تحديث المستخدم: {user_id}")
                     return True
         
@@ -254,38 +420,109 @@ class DatabaseManager:
             return False
     
     def get_user_balance(self, user_id: str) -> float:
-        """الحصول على رصيد المستخدم"""
+        """الحصول على رصيد المستخدم (من الذاكرة المؤقتة إن وُجد)"""
         try:
-            with self.get_connection() as conn:
-                with self.get_cursor(conn) as cursor:
-                    if self.db_type == "postgresql":
-                        cursor.execute(
-                            "SELECT balance FROM users WHERE user_id = %s",
-                            (user_id,)
-                        )
-                    else:
-                        cursor.execute(
-                            "SELECT balance FROM users WHERE user_id = ?",
-                            (user_id,)
-                        )
-                    
-                    result = cursor.fetchone()
-                    return float(result['balance']) if result else 0.0
-        
+            return balance_cache.get_or_load(user_id, lambda: self._load_user_balance(user_id))
         except Exception as e:
             logger.error(f"❌ فشل جلب رصيد المستخدم {user_id}: {str(e)}")
             return 0.0
     
+    def _load_user_balance(self, user_id: str) -> float:
+        """قراءة رصيد المستخدم من قاعدة البيانات"""
+        with self.get_connection() as conn:
+            with self.get_cursor(conn) as cursor:
+                if self.db_type == "postgresql":
+                    cursor.execute(
+                        "SELECT balance FROM users WHERE user_id = %s",
+                        (user_id,)
+                    )
+                else:
+                    cursor.execute(
+                        "SELECT balance FROM users WHERE user_id = ?",
+                        (user_id,)
+                    )
+                
+                result = cursor.fetchone()
+                return float(result['balance']) if result else 0.0
+    
     def update_user_balance(self, user_id: str, amount: float, operation: str = "add") -> bool:
         """تحديث رصيد المستخدم مع تسجيل الخطأ"""
         try:
             with self.get_connection() as conn:
                 with self.get_cursor(conn) as cursor:
-                    
-                    # جلب الرصيد الحالي
+                    self._change_balance(cursor, user_id, amount, operation)
+                    return True
+        
+        except Exception as e:
+            error_msg = f"❌ فشل تحديث رصيد المستخدم {user_id}: {str(e)}"
+            logger.error(error_msg)
+            self.log_error(
+                user_id=user_id,
+                error_type="update_balance_failed",
+                error_message=error_msg,
+                api_endpoint="database.update_user_balance"
+            )
+            return False
+    
+    def _change_balance(self, cursor, user_id: str, amount: float, operation: str):
+        """تعديل رصيد المستخدم باستخدام مؤشر قائم (ضمن معاملة المستدعي)"""
+        
+        # جلب الرصيد الحالي
+        if self.db_type == "postgresql":
+            cursor.execute(
+                "SELECT balance FROM users WHERE user_id = %s FOR UPDATE",
+                (user_id,)
+            )
+        else:
+            cursor.execute(
+                "SELECT balance FROM users WHERE user_id = ?",
+                (user_id,)
+            )
+        
+        result = cursor.fetchone()
+        if not result:
+            raise Exception(f"المستخدم {user_id} غير موجود")
+        
+        current_balance = float(result['balance'])
+        
+        # حساب الرصيد الجديد
+        if operation == "add":
+            new_balance = current_balance + amount
+        elif operation == "subtract":
+            # المبالغ المحجوزة لعمليات جارية غير متاحة للخصم
+            available_balance = current_balance - self._active_holds_total(cursor, user_id)
+            if available_balance < amount:
+                raise Exception(f"رصيد غير كافي. الرصيد المتاح: {available_balance}، المطلوب: {amount}")
+            new_balance = current_balance - amount
+        elif operation == "set":
+            new_balance = amount
+        else:
+            raise Exception(f"عملية غير صالحة: {operation}")
+        
+        # تحديث الرصيد
+        if self.db_type == "postgresql":
+            cursor.execute(
+                "UPDATE users SET balance = %s WHERE user_id = %s",
+                (new_balance, user_id)
+            )
+        else:
+            cursor.execute(
+                "UPDATE users SET balance = ? WHERE user_id = ?",
+                (new_balance, user_id)
+            )
+        
+        self._invalidate_on_commit(balance_cache, user_id)
+        logger.info(f"✅ تم تحديث رصيد المستخدم {user_id}: {current_balance} → {new_balance}")
+    
+    # ========== حجوزات الرصيد ==========
+    def get_available_balance(self, user_id: str) -> float:
+        """الحصول على الرصيد المتاح (الرصيد ناقص الحجوزات النشطة)"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
                     if self.db_type == "postgresql":
                         cursor.execute(
-                            "SELECT balance FROM users WHERE user_id = %s FOR UPDATE",
+                            "SELECT balance FROM users WHERE user_id = %s",
                             (user_id,)
                         )
                     else:
@@ -296,47 +533,105 @@ class DatabaseManager:
                     
                     result = cursor.fetchone()
                     if not result:
-                        raise Exception(f"المستخدم {user_id} غير موجود")
-                    
-                    current_balance = float(result['balance'])
-                    
-                    # حساب الرصيد الجديد
-                    if operation == "add":
-                        new_balance = current_balance + amount
-                    elif operation == "subtract":
-                        if current_balance < amount:
-                            raise Exception(f"رصيد غير كافي. الرصيد الحالي: {current_balance}، المطلوب: {amount}")
-                        new_balance = current_balance - amount
-                    elif operation == "set":
-                        new_balance = amount
-                    else:
-                        raise Exception(f"عملية غير صالحة: {operation}")
-                    
-                    # تحديث الرصيد
-                    if self.db_type == "postgresql":
-                        cursor.execute(
-                            "UPDATE users SET balance = %s WHERE user_id = %s",
-                            (new_balance, user_id)
-                        )
-                    else:
-                        cursor.execute(
-                            "UPDATE users SET balance = ? WHERE user_id = ?",
-                            (new_balance, user_id)
-                        )
+                        return 0.0
                     
-                    logger.info(f"✅ تم تحديث رصيد المستخدم {user_id}: {current_balance} → {new_balance}")
-                    return True
+                    return float(result['balance']) - self._active_holds_total(cursor, user_id)
         
         except Exception as e:
-            error_msg = f"❌ فشل تحديث رصيد المستخدم {user_id}: {str(e)}"
-            logger.error(error_msg)
-            self.log_error(
-                user_id=user_id,
-                error_type="update_balance_failed",
-                error_message=error_msg,
-                api_endpoint="database.update_user_balance"
+            logger.error(f"❌ فشل جلب الرصيد المتاح للمستخدم {user_id}: {str(e)}")
+            return 0.0
+    
+    def _active_holds_total(self, cursor, user_id: str) -> float:
+        """مجموع الحجوزات النشطة للمستخدم باستخدام مؤشر قائم"""
+        if self.db_type == "postgresql":
+            cursor.execute(
+                "SELECT COALESCE(SUM(amount), 0) AS total FROM balance_holds WHERE user_id = %s AND status = 'active'",
+                (user_id,)
+            )
+        else:
+            cursor.execute(
+                "SELECT COALESCE(SUM(amount), 0) AS total FROM balance_holds WHERE user_id = ? AND status = 'active'",
+                (user_id,)
+            )
+        
+        result = cursor.fetchone()
+        return float(result['total']) if result else 0.0
+    
+    def _create_hold(self, cursor, user_id: str, amount: float, reference: str):
+        """إنشاء حجز باستخدام مؤشر قائم (يفشل إذا كان الرصيد المتاح غير كافٍ)"""
+        
+        # الحجوزات تُنشأ فقط مع نية عملية مالية بنفس المرجع، فلا يبقى حجز لا يحسمه سجل العمليات
+        # الإدراج المشروط يتحقق من الرصيد المتاح ويحجز في خطوة واحدة
+        if self.db_type == "postgresql":
+            cursor.execute(
+                "SELECT balance FROM users WHERE user_id = %s FOR UPDATE",
+                (user_id,)
             )
+            cursor.execute('''
+                INSERT INTO balance_holds (user_id, amount, reference, status, created_at, updated_at)
+                SELECT %s, %s, %s, 'active', %s, %s
+                WHERE (SELECT balance FROM users WHERE user_id = %s)
+                      - COALESCE((SELECT SUM(amount) FROM balance_holds
+                                  WHERE user_id = %s AND status = 'active'), 0) >= %s
+            ''', (user_id, amount, reference, datetime.now(), datetime.now(), user_id, user_id, amount))
+        else:
+            cursor.execute('''
+                INSERT INTO balance_holds (user_id, amount, reference, status, created_at, updated_at)
+                SELECT ?, ?, ?, 'active', ?, ?
+                WHERE (SELECT balance FROM users WHERE user_id = ?)
+                      - COALESCE((SELECT SUM(amount) FROM balance_holds
+                                  WHERE user_id = ? AND status = 'active'), 0) >= ?
+            ''', (user_id, amount, reference, datetime.now(), datetime.now(), user_id, user_id, amount))
+        
+        if cursor.rowcount == 0:
+            raise Exception(f"رصيد غير كافي لحجز {amount} NSP")
+        
+        logger.info(f"🔒 تم حجز {amount} NSP من رصيد المستخدم {user_id} ({reference})")
+    
+    def _capture_hold(self, cursor, reference: str) -> bool:
+        """تنفيذ حجز نشط باستخدام مؤشر قائم"""
+        if self.db_type == "postgresql":
+            cursor.execute('''
+                UPDATE balance_holds SET status = 'captured', updated_at = %s
+                WHERE reference = %s AND status = 'active'
+                RETURNING user_id, amount
+            ''', (datetime.now(), reference))
+            hold = cursor.fetchone()
+        else:
+            cursor.execute('''
+                UPDATE balance_holds SET status = 'captured', updated_at = ?
+                WHERE reference = ? AND status = 'active'
+            ''', (datetime.now(), reference))
+            
+            hold = None
+            if cursor.rowcount > 0:
+                cursor.execute(
+                    "SELECT user_id, amount FROM balance_holds WHERE reference = ?",
+                    (reference,)
+                )
+                hold = cursor.fetchone()
+        
+        if not hold:
             return False
+        
+        # الحجز لم يعد نشطاً، لذا لا يُحسب مرتين عند الخصم
+        self._change_balance(cursor, hold['user_id'], float(hold['amount']), "subtract")
+        return True
+    
+    def _release_hold(self, cursor, reference: str) -> bool:
+        """إلغاء حجز نشط باستخدام مؤشر قائم"""
+        if self.db_type == "postgresql":
+            cursor.execute('''
+                UPDATE balance_holds SET status = 'released', updated_at = %s
+                WHERE reference = %s AND status = 'active'
+            ''', (datetime.now(), reference))
+        else:
+            cursor.execute('''
+                UPDATE balance_holds SET status = 'released', updated_at = ?
+                WHERE reference = ? AND status = 'active'
+            ''', (datetime.now(), reference))
+        
+        return cursor.rowcount > 0
     
     # ========== إدارة حسابات Ichancy ==========
     def add_ichancy_account(self, account_data: Dict) -> bool:
@@ -352,11 +647,12 @@ class DatabaseManager:
                     if self.db_type == "postgresql":
                         cursor.execute('''
                             INSERT INTO ichancy_accounts 
-                            (user_id, player_id, login, password, email, initial_balance, created_at, updated_at)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                            (user_id, player_id, parent_id, login, password, email, initial_balance, created_at, updated_at)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                         ''', (
                             account_data['user_id'],
                             account_data['player_id'],
+                            account_data.get('parent_id'),
                             account_data['login'],
                             account_data['password'],
                             account_data['email'],
@@ -367,11 +663,12 @@ class DatabaseManager:
                     else:
                         cursor.execute('''
                             INSERT INTO ichancy_accounts 
-                            (user_id, player_id, login, password, email, initial_balance, created_at, updated_at)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            (user_id, player_id, parent_id, login, password, email, initial_balance, created_at, updated_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                         ''', (
                             account_data['user_id'],
                             account_data['player_id'],
+                            account_data.get('parent_id'),
                             account_data['login'],
                             account_data['password'],
                             account_data['email'],
@@ -380,6 +677,8 @@ class DatabaseManager:
                             datetime.now()
                         ))
                     
+                    self._invalidate_on_commit(account_cache, account_data['user_id'])
+                    self._invalidate_on_commit(stats_cache, account_data['user_id'])
                     logger.info(f"✅ تم إضافة حساب Ichancy جديد: {account_data['login']}")
                     return True
         
@@ -396,32 +695,35 @@ class DatabaseManager:
             return False
     
     def get_ichancy_account(self, user_id: str) -> Optional[Dict]:
-        """الحصول على حساب Ichancy للمستخدم"""
+        """الحصول على حساب Ichancy للمستخدم (من الذاكرة المؤقتة إن وُجد)"""
         try:
-            with self.get_connection() as conn:
-                with self.get_cursor(conn) as cursor:
-                    if self.db_type == "postgresql":
-                        cursor.execute('''
-                            SELECT * FROM ichancy_accounts 
-                            WHERE user_id = %s AND status = 'active' 
-                            ORDER BY created_at DESC LIMIT 1
-                        ''', (user_id,))
-                    else:
-                        cursor.execute('''
-                            SELECT * FROM ichancy_accounts 
-                            WHERE user_id = ? AND status = 'active' 
-                            ORDER BY created_at DESC LIMIT 1
-                        ''', (user_id,))
-                    
-                    result = cursor.fetchone()
-                    if result:
-                        return dict(result)
-                    return None
-        
+            return account_cache.get_or_load(user_id, lambda: self._load_ichancy_account(user_id))
         except Exception as e:
             logger.error(f"❌ فشل جلب حساب Ichancy للمستخدم {user_id}: {str(e)}")
             return None
     
+    def _load_ichancy_account(self, user_id: str) -> Optional[Dict]:
+        """قراءة حساب Ichancy النشط للمستخدم من قاعدة البيانات"""
+        with self.get_connection() as conn:
+            with self.get_cursor(conn) as cursor:
+                if self.db_type == "postgresql":
+                    cursor.execute('''
+                        SELECT * FROM ichancy_accounts 
+                        WHERE user_id = %s AND status = 'active' 
+                        ORDER BY created_at DESC LIMIT 1
+                    ''', (user_id,))
+                else:
+                    cursor.execute('''
+                        SELECT * FROM ichancy_accounts 
+                        WHERE user_id = ? AND status = 'active' 
+                        ORDER BY created_at DESC LIMIT 1
+                    ''', (user_id,))
+                
+                result = cursor.fetchone()
+                if result:
+                    return dict(result)
+                return None
+    
     def update_account_balance(self, player_id: str, new_balance: float) -> bool:
         """تحديث رصيد حساب Ichancy"""
         try:
@@ -432,22 +734,58 @@ class DatabaseManager:
                             UPDATE ichancy_accounts 
                             SET current_balance = %s, updated_at = %s 
                             WHERE player_id = %s
+                            RETURNING user_id
                         ''', (new_balance, datetime.now(), player_id))
+                        owners = [row['user_id'] for row in cursor.fetchall()]
                     else:
                         cursor.execute('''
                             UPDATE ichancy_accounts 
                             SET current_balance = ?, updated_at = ? 
                             WHERE player_id = ?
                         ''', (new_balance, datetime.now(), player_id))
+                        cursor.execute(
+                            "SELECT user_id FROM ichancy_accounts WHERE player_id = ?",
+                            (player_id,)
+                        )
+                        owners = [row['user_id'] for row in cursor.fetchall()]
+                    
+                    # الحساب المؤقت يحمل current_balance
+                    for user_id in owners:
+                        self._invalidate_on_commit(account_cache, user_id)
                     
                     logger.info(f"✅ تم تحديث رصيد حساب {player_id}: {new_balance}")
-                    return cursor.rowcount > 0
+                    return len(owners) > 0
         
         except Exception as e:
             error_msg = f"❌ فشل تحديث رصيد الحساب {player_id}: {str(e)}"
             logger.error(error_msg)
             return False
     
+    def get_account_parent_id(self, player_id: str = None, login: str = None) -> Tuple[bool, Optional[str]]:
+        """(هل وُجد الحساب، حساب الوكيل المالك للاعب): None للحسابات القديمة، و(False, None) لغير الموجودة أو عند الفشل"""
+        column, value = ('player_id', player_id) if player_id is not None else ('login', login)
+        
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
+                        cursor.execute(
+                            f"SELECT parent_id FROM ichancy_accounts WHERE {column} = %s LIMIT 1",
+                            (str(value),)
+                        )
+                    else:
+                        cursor.execute(
+                            f"SELECT parent_id FROM ichancy_accounts WHERE {column} = ? LIMIT 1",
+                            (str(value),)
+                        )
+                    
+                    result = cursor.fetchone()
+                    return (True, result['parent_id']) if result else (False, None)
+        
+        except Exception as e:
+            logger.error(f"❌ فشل جلب الوكيل المالك للاعب {value}: {str(e)}")
+            return False, None
+    
     def get_all_ichancy_logins(self) -> List[str]:
         """الحصول على جميع أسماء المستخدمين"""
         try:
@@ -509,6 +847,7 @@ class DatabaseManager:
                             transaction_data.get('reference_id', '')
                         ))
                     
+                    self._invalidate_on_commit(stats_cache, transaction_data['user_id'])
                     logger.info(f"✅ تم إضافة معاملة: {transaction_data['type']} - {transaction_data['amount']} NSP")
                     return True
         
@@ -531,14 +870,14 @@ class DatabaseManager:
                 with self.get_cursor(conn) as cursor:
                     if self.db_type == "postgresql":
                         cursor.execute('''
-                            SELECT * FROM transactions 
+                            SELECT *, transaction_type AS type FROM transactions 
                             WHERE user_id = %s 
                             ORDER BY created_at DESC 
                             LIMIT %s
                         ''', (user_id, limit))
                     else:
                         cursor.execute('''
-                            SELECT * FROM transactions 
+                            SELECT *, transaction_type AS type FROM transactions 
                             WHERE user_id = ? 
                             ORDER BY created_at DESC 
                             LIMIT ?
@@ -551,118 +890,634 @@ class DatabaseManager:
             logger.error(f"❌ فشل جلب معاملات المستخدم {user_id}: {str(e)}")
             return []
     
-    # ========== تسجيل الأخطاء ==========
-    def log_error(self, **error_data):
-        """تسجيل خطأ في قاعدة البيانات"""
+    # ========== طابور المهام الخلفية ==========
+    def enqueue_job(self, job_type: str, user_id: str, payload: Dict,
+                    chat_id: Any = None, message_id: Any = None) -> Optional[int]:
+        """إضافة مهمة جديدة إلى طابور المهام"""
         try:
+            payload_json = json.dumps(payload, ensure_ascii=False, default=str)
+            
             with self.get_connection() as conn:
                 with self.get_cursor(conn) as cursor:
                     if self.db_type == "postgresql":
                         cursor.execute('''
-                            INSERT INTO error_logs 
-                            (user_id, error_type, error_message, stack_trace, api_endpoint, request_data, response_data)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                        ''', (
-                            error_data.get('user_id'),
-                            error_data.get('error_type'),
-                            error_data.get('error_message', '')[:500],
-                            error_data.get('stack_trace', '')[:2000],
-                            error_data.get('api_endpoint'),
-                            error_data.get('request_data', '')[:1000],
-                            error_data.get('response_data', '')[:1000]
-                        ))
+                            INSERT INTO jobs (job_type, user_id, payload, status, chat_id, message_id, created_at, updated_at)
+                            VALUES (%s, %s, %s, 'pending', %s, %s, %s, %s)
+                            RETURNING id
+                        ''', (job_type, user_id, payload_json,
+                              str(chat_id) if chat_id is not None else None,
+                              str(message_id) if message_id is not None else None,
+                              datetime.now(), datetime.now()))
+                        job_id = cursor.fetchone()['id']
                     else:
                         cursor.execute('''
-                            INSERT INTO error_logs 
-                            (user_id, error_type, error_message, stack_trace, api_endpoint, request_data, response_data)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            error_data.get('user_id'),
-                            error_data.get('error_type'),
-                            error_data.get('error_message', '')[:500],
-                            error_data.get('stack_trace', '')[:2000],
-                            error_data.get('api_endpoint'),
-                            error_data.get('request_data', '')[:1000],
-                            error_data.get('response_data', '')[:1000]
-                        ))
+                            INSERT INTO jobs (job_type, user_id, payload, status, chat_id, message_id, created_at, updated_at)
+                            VALUES (?, ?, ?, 'pending', ?, ?, ?, ?)
+                        ''', (job_type, user_id, payload_json,
+                              str(chat_id) if chat_id is not None else None,
+                              str(message_id) if message_id is not None else None,
+                              datetime.now(), datetime.now()))
+                        job_id = cursor.lastrowid
+                    
+                    logger.info(f"📥 تمت إضافة مهمة {job_type} رقم {job_id} للمستخدم {user_id}")
+                    return job_id
         
         except Exception as e:
-            logger.error(f"❌ فشل تسجيل الخطأ في قاعدة البيانات: {str(e)}")
+            error_msg = f"❌ فشل إضافة مهمة {job_type} للمستخدم {user_id}: {str(e)}"
+            logger.error(error_msg)
+            self.log_error(
+                user_id=user_id,
+                error_type="enqueue_job_failed",
+                error_message=error_msg,
+                api_endpoint="database.enqueue_job"
+            )
+            return None
     
-    # ========== إحصائيات ==========
-    def get_user_stats(self, user_id: str) -> Dict:
-        """الحصول على إحصائيات المستخدم"""
+    def claim_next_job(self, worker_id: str) -> Optional[Dict]:
+        """حجز أقدم مهمة معلقة لتنفيذها باسم المنفذ ولمدة مهلة الحجز"""
         try:
+            lease_expires_at = datetime.now() + timedelta(seconds=config.APP_CONFIG["job_lease_seconds"])
+            
             with self.get_connection() as conn:
                 with self.get_cursor(conn) as cursor:
-                    
                     if self.db_type == "postgresql":
-                        # عدد الحسابات النشطة
                         cursor.execute('''
-                            SELECT COUNT(*) as count FROM ichancy_accounts 
-                            WHERE user_id = %s AND status = 'active'
-                        ''', (user_id,))
-                        account_count = cursor.fetchone()['count']
+                            UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_id = %s,
+                                            lease_expires_at = %s, updated_at = %s
+                            WHERE id = (
+                                SELECT id FROM jobs WHERE status = 'pending'
+                                ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1
+                            )
+                            RETURNING *
+                        ''', (worker_id, lease_expires_at, datetime.now()))
+                        result = cursor.fetchone()
+                    else:
+                        cursor.execute(
+                            "SELECT id FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1"
+                        )
+                        candidate = cursor.fetchone()
+                        if not candidate:
+                            return None
                         
-                        # إجمالي الإيداعات الناجحة
                         cursor.execute('''
-                            SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
-                            WHERE user_id = %s AND transaction_type = 'deposit' AND status = 'success'
-                        ''', (user_id,))
-                        total_deposits = cursor.fetchone()['total']
+                            UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_id = ?,
+                                            lease_expires_at = ?, updated_at = ?
+                            WHERE id = ? AND status = 'pending'
+                        ''', (worker_id, lease_expires_at, datetime.now(), candidate['id']))
                         
-                        # إجمالي السحوبات الناجحة
-                        cursor.execute('''
-                            SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
-                            WHERE user_id = %s AND transaction_type = 'withdraw' AND status = 'success'
-                        ''', (user_id,))
-                        total_withdrawals = cursor.fetchone()['total']
+                        # مهمة حجزها منفذ آخر في نفس اللحظة
+                        if cursor.rowcount == 0:
+                            return None
                         
-                        # عدد المعاملات الفاشلة
+                        cursor.execute("SELECT * FROM jobs WHERE id = ?", (candidate['id'],))
+                        result = cursor.fetchone()
+                    
+                    if not result:
+                        return None
+                    
+                    job = dict(result)
+                    job['payload'] = json.loads(job['payload']) if job.get('payload') else {}
+                    return job
+        
+        except Exception as e:
+            logger.error(f"❌ فشل حجز مهمة من الطابور: {str(e)}")
+            return None
+    
+    def renew_job_leases(self, worker_id: str) -> int:
+        """تمديد حجز جميع المهام الجارية لدى المنفذ (نبض يثبت أنه ما زال حياً)"""
+        try:
+            lease_expires_at = datetime.now() + timedelta(seconds=config.APP_CONFIG["job_lease_seconds"])
+            
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
+                        cursor.execute('''
+                            UPDATE jobs SET lease_expires_at = %s
+                            WHERE worker_id = %s AND status = 'running'
+                        ''', (lease_expires_at, worker_id))
+                    else:
                         cursor.execute('''
-                            SELECT COUNT(*) as count FROM transactions 
-                            WHERE user_id = %s AND status != 'success'
-                        ''', (user_id,))
-                        failed_transactions = cursor.fetchone()['count']
+                            UPDATE jobs SET lease_expires_at = ?
+                            WHERE worker_id = ? AND status = 'running'
+                        ''', (lease_expires_at, worker_id))
                     
+                    return cursor.rowcount
+        
+        except Exception as e:
+            logger.error(f"❌ فشل تمديد حجز مهام المنفذ {worker_id}: {str(e)}")
+            return 0
+    
+    def finish_job(self, job_id: int, status: str, result: str = None, error_message: str = None) -> bool:
+        """تحديث حالة المهمة بعد انتهاء تنفيذها"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
+                        cursor.execute('''
+                            UPDATE jobs SET status = %s, result = %s, error_message = %s, lease_expires_at = NULL,
+                                            updated_at = %s
+                            WHERE id = %s
+                        ''', (status, result, error_message, datetime.now(), job_id))
                     else:
-                        # SQLite implementation
                         cursor.execute('''
-                            SELECT COUNT(*) as count FROM ichancy_accounts 
-                            WHERE user_id = ? AND status = 'active'
-                        ''', (user_id,))
-                        account_count = cursor.fetchone()['count']
-                        
+                            UPDATE jobs SET status = ?, result = ?, error_message = ?, lease_expires_at = NULL,
+                                            updated_at = ?
+                            WHERE id = ?
+                        ''', (status, result, error_message, datetime.now(), job_id))
+                    
+                    return cursor.rowcount > 0
+        
+        except Exception as e:
+            logger.error(f"❌ فشل تحديث حالة المهمة {job_id}: {str(e)}")
+            return False
+    
+    def recover_interrupted_jobs(self) -> List[Dict]:
+        """تعليم المهام الجارية التي انتهت مهلة حجزها (توقف منفذها) وإرجاعها"""
+        try:
+            now = datetime.now()
+            
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    
+                    # مهام النسخ الحية تُجدد حجزها باستمرار، فلا تُلمس
+                    if self.db_type == "postgresql":
                         cursor.execute('''
-                            SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
-                            WHERE user_id = ? AND transaction_type = 'deposit' AND status = 'success'
-                        ''', (user_id,))
-                        total_deposits = cursor.fetchone()['total']
-                        
+                            UPDATE jobs SET status = 'interrupted', updated_at = %s
+                            WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < %s)
+                            RETURNING *
+                        ''', (now, now))
+                        results = cursor.fetchall()
+                    else:
                         cursor.execute('''
-                            SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
-                            WHERE user_id = ? AND transaction_type = 'withdraw' AND status = 'success'
-                        ''', (user_id,))
-                        total_withdrawals = cursor.fetchone()['total']
+                            SELECT * FROM jobs
+                            WHERE status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                        ''', (now,))
+                        candidates = cursor.fetchall() or []
                         
+                        results = []
+                        for candidate in candidates:
+                            # ربما جدد المنفذ حجزها أو أنهاها منذ القراءة
+                            cursor.execute('''
+                                UPDATE jobs SET status = 'interrupted', updated_at = ?
+                                WHERE id = ? AND status = 'running' AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                            ''', (now, candidate['id'], now))
+                            if cursor.rowcount > 0:
+                                results.append(candidate)
+                    
+                    jobs = []
+                    for row in results or []:
+                        job = dict(row)
+                        job['payload'] = json.loads(job['payload']) if job.get('payload') else {}
+                        jobs.append(job)
+                    
+                    if jobs:
+                        logger.warning(f"⚠️ تم العثور على {len(jobs)} مهمة منقطعة انتهت مهلة حجزها")
+                    
+                    return jobs
+        
+        except Exception as e:
+            logger.error(f"❌ فشل استرداد المهام المنقطعة: {str(e)}")
+            return []
+    
+    # ========== سجل العمليات المالية (Outbox) ==========
+    def open_money_intent(self, idempotency_key: str, job_id: Optional[int], user_id: str,
+                          player_id: str, operation: str, amount: float,
+                          balance_before: Optional[float] = None,
+                          reserve: bool = False) -> Optional[Dict]:
+        """تسجيل نية عملية مالية قبل إرسالها إلى Ichancy (مع حجز المبلغ المحلي في نفس المعاملة)"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    
+                    # مفتاح مكرر يعني أن العملية سُجلت مسبقاً، لا نكررها
+                    existing = self._get_money_intent(cursor, idempotency_key)
+                    if existing:
+                        existing['is_new'] = False
+                        logger.warning(f"⚠️ العملية {idempotency_key} مسجلة مسبقاً بالحالة: {existing['status']}")
+                        return existing
+                    
+                    if reserve:
+                        self._create_hold(cursor, user_id, amount, idempotency_key)
+                    
+                    if self.db_type == "postgresql":
+                        cursor.execute('''
+                            INSERT INTO money_outbox (idempotency_key, job_id, user_id, player_id, operation,
+                                                      amount, balance_before, status, created_at, updated_at)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending', %s, %s)
+                        ''', (idempotency_key, job_id, user_id, player_id, operation,
+                              amount, balance_before, datetime.now(), datetime.now()))
+                    else:
+                        cursor.execute('''
+                            INSERT INTO money_outbox (idempotency_key, job_id, user_id, player_id, operation,
+                                                      amount, balance_before, status, created_at, updated_at)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)
+                        ''', (idempotency_key, job_id, user_id, player_id, operation,
+                              amount, balance_before, datetime.now(), datetime.now()))
+                    
+                    entry = self._get_money_intent(cursor, idempotency_key)
+                    entry['is_new'] = True
+                    
+                    logger.info(f"📝 تم تسجيل نية العملية {idempotency_key}: {operation} {amount} NSP")
+                    return entry
+        
+        except Exception as e:
+            error_msg = f"❌ فشل تسجيل نية العملية {idempotency_key}: {str(e)}"
+            logger.error(error_msg)
+            self.log_error(
+                user_id=user_id,
+                error_type="open_money_intent_failed",
+                error_message=error_msg,
+                api_endpoint="database.open_money_intent"
+            )
+            return None
+    
+    def _get_money_intent(self, cursor, idempotency_key: str) -> Optional[Dict]:
+        """جلب نية عملية مالية بمفتاحها باستخدام مؤشر قائم"""
+        if self.db_type == "postgresql":
+            cursor.execute(
+                "SELECT * FROM money_outbox WHERE idempotency_key = %s",
+                (idempotency_key,)
+            )
+        else:
+            cursor.execute(
+                "SELECT * FROM money_outbox WHERE idempotency_key = ?",
+                (idempotency_key,)
+            )
+        
+        result = cursor.fetchone()
+        return dict(result) if result else None
+    
+    def complete_money_intent(self, idempotency_key: str, local_credit: bool = False) -> bool:
+        """إكمال العملية المالية مع الإضافة المحلية في نفس المعاملة (True فقط إذا أكملها هذا الاستدعاء)"""
+        return self._settle_money_intent(idempotency_key, 'completed', local_credit)
+    
+    def compensate_money_intent(self, idempotency_key: str, local_refund: bool = False,
+                                error_message: str = None) -> bool:
+        """إلغاء العملية المالية مع فك حجز المبلغ المحلي في نفس المعاملة (True فقط إذا ألغاها هذا الاستدعاء)"""
+        status = 'compensated' if local_refund else 'failed'
+        return self._settle_money_intent(idempotency_key, status, False, error_message)
+    
+    def _settle_money_intent(self, idempotency_key: str, status: str, credit_user: bool,
+                             error_message: str = None) -> bool:
+        """إنهاء نية عملية مالية مرة واحدة فقط (False إذا لم يكن هذا الاستدعاء من أنهاها)"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    
+                    # التحديث المشروط يضمن عدم تطبيق الخطوة المحلية مرتين
+                    if self.db_type == "postgresql":
+                        cursor.execute('''
+                            UPDATE money_outbox SET status = %s, error_message = %s, updated_at = %s
+                            WHERE idempotency_key = %s AND status IN ('pending', 'upstream_applied')
+                        ''', (status, error_message, datetime.now(), idempotency_key))
+                    else:
+                        cursor.execute('''
+                            UPDATE money_outbox SET status = ?, error_message = ?, updated_at = ?
+                            WHERE idempotency_key = ? AND status IN ('pending', 'upstream_applied')
+                        ''', (status, error_message, datetime.now(), idempotency_key))
+                    
+                    if cursor.rowcount == 0:
+                        # حسمها مستدعٍ آخر أو أُحيلت للمراجعة، فلا يُبلغ هذا المستدعي بنجاحها
+                        entry = self._get_money_intent(cursor, idempotency_key)
+                        logger.warning(
+                            f"⚠️ لم يتم إنهاء العملية {idempotency_key} بالحالة {status}، "
+                            f"حالتها الحالية: {entry['status'] if entry else 'غير موجودة'}"
+                        )
+                        return False
+                    
+                    # الحجز المرتبط بالعملية يُنفذ عند النجاح ويُلغى عند الفشل
+                    if status == 'completed':
+                        self._capture_hold(cursor, idempotency_key)
+                    else:
+                        self._release_hold(cursor, idempotency_key)
+                    
+                    if credit_user:
+                        entry = self._get_money_intent(cursor, idempotency_key)
+                        self._change_balance(cursor, entry['user_id'], float(entry['amount']), "add")
+                    
+                    logger.info(f"✅ تم إنهاء العملية {idempotency_key} بالحالة: {status}")
+                    return True
+        
+        except Exception as e:
+            error_msg = f"❌ فشل إنهاء العملية {idempotency_key}: {str(e)}"
+            logger.error(error_msg)
+            self.log_error(
+                error_type="settle_money_intent_failed",
+                error_message=error_msg,
+                api_endpoint="database._settle_money_intent"
+            )
+            return False
+    
+    def mark_money_intent(self, idempotency_key: str, status: str, error_message: str = None) -> bool:
+        """تحديث حالة نية العملية المالية دون أي تعديل على الرصيد"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
+                        cursor.execute('''
+                            UPDATE money_outbox SET status = %s, error_message = %s, updated_at = %s
+                            WHERE idempotency_key = %s AND status IN ('pending', 'upstream_applied')
+                        ''', (status, error_message, datetime.now(), idempotency_key))
+                    else:
+                        cursor.execute('''
+                            UPDATE money_outbox SET status = ?, error_message = ?, updated_at = ?
+                            WHERE idempotency_key = ? AND status IN ('pending', 'upstream_applied')
+                        ''', (status, error_message, datetime.now(), idempotency_key))
+                    
+                    if cursor.rowcount == 0:
+                        return False
+                    
+                    if status == 'needs_review':
+                        # لا يبقى الحجز نشطاً أثناء المراجعة: يُنفذ (أحوط إذا كانت العملية قد طُبقت)
+                        # ويُعاد المبلغ عند حسمها بأنها لم تُطبق
+                        self._capture_hold(cursor, idempotency_key)
+                    
+                    return True
+        
+        except Exception as e:
+            logger.error(f"❌ فشل تحديث حالة العملية {idempotency_key}: {str(e)}")
+            return False
+    
+    def settle_reviewed_money_intent(self, idempotency_key: str, applied: bool, error_message: str = None) -> bool:
+        """حسم عملية محالة للمراجعة بعد التحقق من نتيجتها على Ichancy (True فقط إذا حسمها هذا الاستدعاء)"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    entry = self._get_money_intent(cursor, idempotency_key)
+                    if not entry or entry['status'] != 'needs_review':
+                        logger.warning(
+                            f"⚠️ العملية {idempotency_key} ليست قيد المراجعة، حالتها: "
+                            f"{entry['status'] if entry else 'غير موجودة'}"
+                        )
+                        return False
+                    
+                    # حجز الإيداع نُفذ عند الإحالة، فيُعاد المبلغ إذا لم يُطبق؛ ومبلغ السحب يُضاف إذا طُبق
+                    refund = (entry['operation'] == 'withdraw') == applied
+                    if applied:
+                        status = 'completed'
+                    else:
+                        status = 'compensated' if refund else 'failed'
+                    
+                    if self.db_type == "postgresql":
+                        cursor.execute('''
+                            UPDATE money_outbox SET status = %s, error_message = %s, updated_at = %s
+                            WHERE idempotency_key = %s AND status = 'needs_review'
+                        ''', (status, error_message, datetime.now(), idempotency_key))
+                    else:
+                        cursor.execute('''
+                            UPDATE money_outbox SET status = ?, error_message = ?, updated_at = ?
+                            WHERE idempotency_key = ? AND status = 'needs_review'
+                        ''', (status, error_message, datetime.now(), idempotency_key))
+                    
+                    # حسمها مستدعٍ آخر منذ القراءة
+                    if cursor.rowcount == 0:
+                        return False
+                    
+                    if refund:
+                        self._change_balance(cursor, entry['user_id'], float(entry['amount']), "add")
+                    
+                    logger.info(f"✅ تم حسم العملية المراجعة {idempotency_key} بالحالة: {status}")
+                    return True
+        
+        except Exception as e:
+            error_msg = f"❌ فشل حسم العملية المراجعة {idempotency_key}: {str(e)}"
+            logger.error(error_msg)
+            self.log_error(
+                error_type="settle_reviewed_money_intent_failed",
+                error_message=error_msg,
+                api_endpoint="database.settle_reviewed_money_intent"
+            )
+            return False
+    
+    def set_money_intent_player(self, idempotency_key: str, player_id: str) -> bool:
+        """ربط نية عملية مالية سُجلت قبل إنشاء حساب اللاعب بمعرفه"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
                         cursor.execute('''
-                            SELECT COUNT(*) as count FROM transactions 
-                            WHERE user_id = ? AND status != 'success'
-                        ''', (user_id,))
-                        failed_transactions = cursor.fetchone()['count']
+                            UPDATE money_outbox SET player_id = %s, updated_at = %s
+                            WHERE idempotency_key = %s AND status = 'pending'
+                        ''', (player_id, datetime.now(), idempotency_key))
+                    else:
+                        cursor.execute('''
+                            UPDATE money_outbox SET player_id = ?, updated_at = ?
+                            WHERE idempotency_key = ? AND status = 'pending'
+                        ''', (player_id, datetime.now(), idempotency_key))
+                    
+                    return cursor.rowcount > 0
+        
+        except Exception as e:
+            logger.error(f"❌ فشل ربط العملية {idempotency_key} باللاعب {player_id}: {str(e)}")
+            return False
+    
+    def get_pending_money_intents(self, grace_period: float = 0) -> List[Dict]:
+        """جلب العمليات المؤكدة على Ichancy والمعلقة منذ مهلة السماح، عدا ما تنفذه مهمة محجوزة حالياً"""
+        try:
+            now = datetime.now()
+            settled_before = now - timedelta(seconds=grace_period)
+            
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    
+                    # عملية مهمة يجدد منفذها حجزها ما زالت قيد التنفيذ لدى نسخة حية
+                    if self.db_type == "postgresql":
+                        cursor.execute('''
+                            SELECT * FROM money_outbox
+                            WHERE (status = 'upstream_applied' OR (status = 'pending' AND updated_at < %s))
+                              AND NOT EXISTS (
+                                  SELECT 1 FROM jobs WHERE jobs.id = money_outbox.job_id
+                                  AND jobs.status = 'running' AND jobs.lease_expires_at >= %s
+                              )
+                            ORDER BY id
+                        ''', (settled_before, now))
+                    else:
+                        cursor.execute('''
+                            SELECT * FROM money_outbox
+                            WHERE (status = 'upstream_applied' OR (status = 'pending' AND updated_at < ?))
+                              AND NOT EXISTS (
+                                  SELECT 1 FROM jobs WHERE jobs.id = money_outbox.job_id
+                                  AND jobs.status = 'running' AND jobs.lease_expires_at >= ?
+                              )
+                            ORDER BY id
+                        ''', (settled_before, now))
+                    
+                    results = cursor.fetchall()
+                    return [dict(row) for row in results] if results else []
+        
+        except Exception as e:
+            logger.error(f"❌ فشل جلب العمليات المالية المعلقة: {str(e)}")
+            return []
+    
+    def get_money_intents_for_review(self, limit: int = 20) -> List[Dict]:
+        """جلب أقدم العمليات المحالة للمراجعة (نتيجتها على Ichancy غير معروفة)"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
+                        cursor.execute(
+                            "SELECT * FROM money_outbox WHERE status = 'needs_review' ORDER BY id LIMIT %s",
+                            (limit,)
+                        )
+                    else:
+                        cursor.execute(
+                            "SELECT * FROM money_outbox WHERE status = 'needs_review' ORDER BY id LIMIT ?",
+                            (limit,)
+                        )
                     
-                    return {
-                        "account_count": account_count or 0,
-                        "total_deposits": float(total_deposits or 0),
-                        "total_withdrawals": float(total_withdrawals or 0),
-                        "failed_transactions": failed_transactions or 0,
-                        "net_balance": float((total_deposits or 0) - (total_withdrawals or 0))
-                    }
+                    results = cursor.fetchall()
+                    return [dict(row) for row in results] if results else []
         
+        except Exception as e:
+            logger.error(f"❌ فشل جلب العمليات المحالة للمراجعة: {str(e)}")
+            return []
+    
+    def get_money_intent_for_job(self, job_id: int) -> Optional[Dict]:
+        """جلب نية العملية المالية المرتبطة بمهمة"""
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
+                        cursor.execute(
+                            "SELECT * FROM money_outbox WHERE job_id = %s ORDER BY id DESC LIMIT 1",
+                            (job_id,)
+                        )
+                    else:
+                        cursor.execute(
+                            "SELECT * FROM money_outbox WHERE job_id = ? ORDER BY id DESC LIMIT 1",
+                            (job_id,)
+                        )
+                    
+                    result = cursor.fetchone()
+                    return dict(result) if result else None
+        
+        except Exception as e:
+            logger.error(f"❌ فشل جلب العملية المالية للمهمة {job_id}: {str(e)}")
+            return None
+    
+    # ========== تسجيل الأخطاء ==========
+    def log_error(self, **error_data):
+        """تسجيل خطأ في قاعدة البيانات"""
+        self.log_errors([error_data])
+    
+    def log_errors(self, errors: List[Dict]):
+        """تسجيل عدة أخطاء في معاملة واحدة (للتسجيل المجمّع)"""
+        if not errors:
+            return
+        
+        rows = [(
+            error_data.get('user_id'),
+            error_data.get('error_type'),
+            error_data.get('error_message', '')[:500],
+            error_data.get('stack_trace', '')[:2000],
+            error_data.get('api_endpoint'),
+            error_data.get('request_data', '')[:1000],
+            error_data.get('response_data', '')[:1000]
+        ) for error_data in errors]
+        
+        try:
+            with self.get_connection() as conn:
+                with self.get_cursor(conn) as cursor:
+                    if self.db_type == "postgresql":
+                        cursor.executemany('''
+                            INSERT INTO error_logs 
+                            (user_id, error_type, error_message, stack_trace, api_endpoint, request_data, response_data)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s)
+                        ''', rows)
+                    else:
+                        cursor.executemany('''
+                            INSERT INTO error_logs 
+                            (user_id, error_type, error_message, stack_trace, api_endpoint, request_data, response_data)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ''', rows)
+        
+        except Exception as e:
+            logger.error(f"❌ فشل تسجيل الخطأ في قاعدة البيانات: {str(e)}")
+    
+    # ========== إحصائيات ==========
+    def get_user_stats(self, user_id: str) -> Dict:
+        """الحصول على إحصائيات المستخدم (من الذاكرة المؤقتة إن وُجدت)"""
+        try:
+            return stats_cache.get_or_load(user_id, lambda: self._load_user_stats(user_id))
         except Exception as e:
             logger.error(f"❌ فشل جلب إحصائيات المستخدم {user_id}: {str(e)}")
             return {}
     
+    def _load_user_stats(self, user_id: str) -> Dict:
+        """حساب إحصائيات المستخدم من قاعدة البيانات"""
+        with self.get_connection() as conn:
+            with self.get_cursor(conn) as cursor:
+                
+                if self.db_type == "postgresql":
+                    # عدد الحسابات النشطة
+                    cursor.execute('''
+                        SELECT COUNT(*) as count FROM ichancy_accounts 
+                        WHERE user_id = %s AND status = 'active'
+                    ''', (user_id,))
+                    account_count = cursor.fetchone()['count']
+                    
+                    # إجمالي الإيداعات الناجحة
+                    cursor.execute('''
+                        SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
+                        WHERE user_id = %s AND transaction_type = 'deposit' AND status = 'success'
+                    ''', (user_id,))
+                    total_deposits = cursor.fetchone()['total']
+                    
+                    # إجمالي السحوبات الناجحة
+                    cursor.execute('''
+                        SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
+                        WHERE user_id = %s AND transaction_type = 'withdraw' AND status = 'success'
+                    ''', (user_id,))
+                    total_withdrawals = cursor.fetchone()['total']
+                    
+                    # عدد المعاملات الفاشلة
+                    cursor.execute('''
+                        SELECT COUNT(*) as count FROM transactions 
+                        WHERE user_id = %s AND status != 'success'
+                    ''', (user_id,))
+                    failed_transactions = cursor.fetchone()['count']
+                
+                else:
+                    # SQLite implementation
+                    cursor.execute('''
+                        SELECT COUNT(*) as count FROM ichancy_accounts 
+                        WHERE user_id = ? AND status = 'active'
+                    ''', (user_id,))
+                    account_count = cursor.fetchone()['count']
+                    
+                    cursor.execute('''
+                        SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
+                        WHERE user_id = ? AND transaction_type = 'deposit' AND status = 'success'
+                    ''', (user_id,))
+                    total_deposits = cursor.fetchone()['total']
+                    
+                    cursor.execute('''
+                        SELECT COALESCE(SUM(amount), 0) as total FROM transactions 
+                        WHERE user_id = ? AND transaction_type = 'withdraw' AND status = 'success'
+                    ''', (user_id,))
+                    total_withdrawals = cursor.fetchone()['total']
+                    
+                    cursor.execute('''
+                        SELECT COUNT(*) as count FROM transactions 
+                        WHERE user_id = ? AND status != 'success'
+                    ''', (user_id,))
+                    failed_transactions = cursor.fetchone()['count']
+                
+                return {
+                    "account_count": account_count or 0,
+                    "total_deposits": float(total_deposits or 0),
+                    "total_withdrawals": float(total_withdrawals or 0),
+                    "failed_transactions": failed_transactions or 0,
+                    "net_balance": float((total_deposits or 0) - (total_withdrawals or 0))
+                }
+    
+    def ping(self):
+        """استعلام بسيط للتحقق من الاتصال (يرفع الاستثناء عند الفشل)"""
+        with self.get_connection() as conn:
+            with self.get_cursor(conn) as cursor:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+    
     def cleanup_old_data(self, days: int = 30):
         """تنظيف البيانات القديمة"""
         try:
@@ -1,6 +1,8 @@
 # handlers/account_handler.py
 import re
+import uuid
 import random
+import asyncio
 import string
 import logging
 import traceback
@@ -8,7 +10,7 @@ from typing import Dict, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import db
-from api.ichancy_api import api
+from api.agent_pool import api
 from config import config
 
 logger = logging.getLogger(__name__)
@@ -324,7 +326,7 @@ async def handle_password_input(update: Update, context: ContextTypes.DEFAULT_TY
 • سيتم خصم المبلغ من رصيدك المحلي
 
 📊 *معلومات رصيدك الحالي:*
-• الرصيد المتاح: `{db.get_user_balance(user_id):.2f}` NSP
+• الرصيد المتاح: `{db.get_available_balance(user_id):.2f}` NSP
 
 💡 *اقتراحات:*
 • `{config.APP_CONFIG['min_amount']}` NSP - الحد الأدنى
@@ -495,6 +497,9 @@ async def confirm_account_creation(update: Update, context: ContextTypes.DEFAULT
     
     logger.info(f"✅ تأكيد إنشاء حساب من المستخدم {user_id}")
     
+    idempotency_key = None
+    deposit_sent = False
+    
     try:
         # التحقق من وجود جميع البيانات
         if user_id not in user_states or not all([
@@ -525,26 +530,24 @@ async def confirm_account_creation(update: Update, context: ContextTypes.DEFAULT
             parse_mode='Markdown'
         )
         
-        # تسجيل بدء إنشاء الحساب
-        db.add_transaction({
-            'user_id': user_id,
-            'type': 'account_creation_processing',
-            'amount': amount,
-            'status': 'processing',
-            'details': f'بدء إنشاء حساب: {username}'
-        })
+        loop = asyncio.get_running_loop()
         
-        # 1. خصم المبلغ من رصيد المستخدم المحلي أولاً
-        deduction_success = db.update_user_balance(user_id, amount, "subtract")
+        # 1. تسجيل نية الإيداع الابتدائي وحجز المبلغ من الرصيد المحلي حتى تنتهي العملية
+        # (معرف اللاعب يُربط بالنية بعد إنشاء الحساب)
+        idempotency_key = f"account_deposit:{uuid.uuid4().hex}"
+        entry = await loop.run_in_executor(None, lambda: db.open_money_intent(
+            idempotency_key, None, user_id, None, 'deposit', amount, balance_before=0, reserve=True
+        ))
         
-        if not deduction_success:
+        if entry is None:
+            idempotency_key = None
             error_msg = f"❌ رصيد غير كافي للمستخدم {user_id}"
             logger.error(error_msg)
             
             await query.edit_message_text(
                 f"❌ *رصيد غير كافي!*\n\n"
                 f"⚠️ رصيدك الحالي غير كافي لخصم `{amount}` NSP\n\n"
-                f"📊 رصيدك الحالي: `{db.get_user_balance(user_id):.2f}` NSP\n"
+                f"📊 رصيدك المتاح: `{db.get_available_balance(user_id):.2f}` NSP\n"
                 f"💡 يمكنك تعبئة الرصيد أولاً ثم المحاولة مرة أخرى",
                 parse_mode='Markdown'
             )
@@ -562,22 +565,33 @@ async def confirm_account_creation(update: Update, context: ContextTypes.DEFAULT
             del user_states[user_id]
             return
         
-        logger.info(f"✅ تم خصم {amount} NSP من رصيد المستخدم {user_id}")
+        logger.info(f"🔒 تم حجز {amount} NSP من رصيد المستخدم {user_id}")
         
-        # 2. إنشاء الحساب على Ichancy
-        creation_result = api.create_player(username, password)
+        # 2. إنشاء الحساب على Ichancy مع تسجيل بدء العملية محلياً بالتوازي
+        creation_result, _ = await asyncio.gather(
+            loop.run_in_executor(None, api.create_player, username, password),
+            loop.run_in_executor(None, db.add_transaction, {
+                'user_id': user_id,
+                'type': 'account_creation_processing',
+                'amount': amount,
+                'status': 'processing',
+                'details': f'بدء إنشاء حساب: {username}'
+            })
+        )
         
         if not creation_result.get('success'):
             error_msg = creation_result.get('error', 'فشل غير معروف')
             logger.error(f"❌ فشل إنشاء حساب على Ichancy للمستخدم {user_id}: {error_msg}")
             
-            # إعادة المبلغ المخصوم
-            db.update_user_balance(user_id, amount, "add")
+            # لم يُرسل أي إيداع، فيُلغى الحجز ولا يُخصم أي مبلغ
+            await loop.run_in_executor(None, lambda: db.compensate_money_intent(
+                idempotency_key, local_refund=True, error_message=error_msg
+            ))
             
             await query.edit_message_text(
                 f"❌ *فشل إنشاء الحساب على Ichancy!*\n\n"
                 f"⚠️ {error_msg}\n\n"
-                f"🔙 تم إعادة `{amount}` NSP إلى رصيدك\n"
+                f"🔙 لم يتم خصم `{amount}` NSP من رصيدك\n"
                 f"📞 للدعم: @TSA_Support\n"
                 f"🔧 كود الخطأ: `{user_id[:8]}_ICHANCY_FAIL`",
                 parse_mode='Markdown'
@@ -599,43 +613,91 @@ async def confirm_account_creation(update: Update, context: ContextTypes.DEFAULT
         player_id = creation_result.get('player_id')
         email = creation_result.get('email', f"{username}@TSA.com")
         
-        logger.info(f"✅ تم إنشاء حساب Ichancy للمستخدم {user_id}: {player_id}")
-        
-        # 3. إيداع المبلغ الابتدائي
-        deposit_result = api.deposit(player_id, amount)
-        
-        if not deposit_result.get('success'):
-            error_msg = deposit_result.get('error', 'فشل غير معروف')
-            logger.warning(f"⚠️ فشل إيداع المبلغ الابتدائي للمستخدم {user_id}: {error_msg}")
+        if player_id is None:
+            error_msg = "تعذر الحصول على رقم اللاعب بعد إنشاء الحساب"
+            logger.error(f"❌ {error_msg} للمستخدم {user_id} ({username})")
             
-            # الحساب أنشئ ولكن الإيداع فشل
-            deposit_error_msg = f"تم إنشاء الحساب ولكن فشل الإيداع: {error_msg}"
+            # لا يمكن الإيداع دون رقم اللاعب، فلم يُرسل أي إيداع ويُلغى الحجز
+            await loop.run_in_executor(None, lambda: db.compensate_money_intent(
+                idempotency_key, local_refund=True, error_message=error_msg
+            ))
             
-        else:
-            deposit_error_msg = None
-            logger.info(f"✅ تم إيداع {amount} NSP لحساب {player_id}")
+            await query.edit_message_text(
+                f"❌ *فشل إنشاء الحساب على Ichancy!*\n\n"
+                f"⚠️ {error_msg}\n\n"
+                f"🔙 لم يتم خصم `{amount}` NSP من رصيدك\n"
+                f"📞 للدعم: @TSA_Support\n"
+                f"🔧 كود الخطأ: `{user_id[:8]}_NO_PLAYER_ID`",
+                parse_mode='Markdown'
+            )
+            
+            db.add_transaction({
+                'user_id': user_id,
+                'type': 'account_creation_failed',
+                'amount': amount,
+                'status': 'failed',
+                'error_message': error_msg,
+                'details': f'أنشئ الحساب {username} على Ichancy دون رقم لاعب'
+            })
+            
+            # تنظيف حالة المستخدم
+            del user_states[user_id]
+            return
         
-        # 4. حفظ الحساب في قاعدة البيانات
+        logger.info(f"✅ تم إنشاء حساب Ichancy للمستخدم {user_id}: {player_id}")
+        
+        # 3. إيداع المبلغ الابتدائي وحفظ الحساب محلياً بالتوازي
+        # (الحساب موجود على Ichancy مهما كانت نتيجة الإيداع، لذا حفظه آمن)
         account_data = {
             'user_id': user_id,
             'player_id': player_id,
+            'parent_id': creation_result.get('parent_id'),  # حساب الوكيل الذي أنشأ اللاعب
             'login': username,
             'password': password,
             'email': email,
             'initial_balance': amount
         }
         
-        db_success = db.add_ichancy_account(account_data)
+        await loop.run_in_executor(None, db.set_money_intent_player, idempotency_key, player_id)
+        deposit_sent = True
+        
+        # الحساب جديد ورصيده صفر، فيمكن التحقق من عدم تطبيق الإيداع قبل إعادته
+        deposit_result, db_success = await asyncio.gather(
+            loop.run_in_executor(None, lambda: api.deposit(player_id, amount, reference=idempotency_key, balance_before=0)),
+            loop.run_in_executor(None, db.add_ichancy_account, account_data)
+        )
+        
+        if not deposit_result.get('success'):
+            error_msg = deposit_result.get('error', 'فشل غير معروف')
+            logger.warning(f"⚠️ فشل إيداع المبلغ الابتدائي للمستخدم {user_id}: {error_msg}")
+            
+            # الفشل المؤكد يلغي الحجز، والفشل الغامض يبقى محجوزاً في سجل العمليات حتى يُحسم
+            if not deposit_result.get('ambiguous') and await loop.run_in_executor(
+                    None, lambda: db.compensate_money_intent(idempotency_key, local_refund=True, error_message=error_msg)):
+                deposit_error_msg = f"تم إنشاء الحساب ولكن فشل الإيداع (لم يُخصم المبلغ من رصيدك): {error_msg}"
+            else:
+                deposit_error_msg = (
+                    f"تم إنشاء الحساب ونتيجة الإيداع غير مؤكدة: {error_msg}. "
+                    f"يبقى المبلغ محجوزاً من رصيدك حتى مراجعة العملية"
+                )
+            
+        else:
+            # تنفيذ الحجز (الخصم الفعلي)، وإلا يكمله الحسم الدوري لأن Ichancy أكد الإيداع
+            if not await loop.run_in_executor(None, db.complete_money_intent, idempotency_key):
+                await loop.run_in_executor(
+                    None, db.mark_money_intent, idempotency_key, 'upstream_applied', 'فشل تنفيذ الحجز بعد الإيداع'
+                )
+            deposit_error_msg = None
+            logger.info(f"✅ تم إيداع {amount} NSP لحساب {player_id}")
         
         if not db_success:
             logger.error(f"❌ فشل حفظ الحساب في قاعدة البيانات للمستخدم {user_id}")
             # نستمر لأن الحساب أنشئ على Ichancy
         
-        # 5. جلب الرصيد النهائي
-        balance_result = api.get_balance(player_id)
-        final_balance = balance_result.get('balance', amount) if balance_result.get('success') else amount
+        # 4. الرصيد النهائي مشتق: الحساب الجديد يبدأ برصيد صفر
+        final_balance = 0 if deposit_error_msg else amount
         
-        # 6. إرسال رسالة النجاح
+        # 5. تجهيز رسالة النجاح
         success_message = f"""
 🎉 *تم إنشاء الحساب بنجاح!*
 
@@ -670,33 +732,32 @@ async def confirm_account_creation(update: Update, context: ContextTypes.DEFAULT
             [InlineKeyboardButton("🔙 القائمة الرئيسية", callback_data='main_menu')]
         ]
         
-        await query.edit_message_text(
-            success_message,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        
-        # 7. تسجيل النجاح
+        # 6. تسجيل النجاح وتحديث رصيد الحساب بالتوازي مع إرسال الرسالة
         transaction_details = f'تم إنشاء حساب: {username} (ID: {player_id})'
         if deposit_error_msg:
             transaction_details += f' - {deposit_error_msg}'
         
-        db.add_transaction({
-            'user_id': user_id,
-            'player_id': player_id,
-            'type': 'account_creation',
-            'amount': amount,
-            'status': 'success' if not deposit_error_msg else 'partial_success',
-            'error_message': deposit_error_msg,
-            'details': transaction_details
-        })
-        
-        # تحديث رصيد الحساب في قاعدة البيانات
-        db.update_account_balance(player_id, final_balance)
+        await asyncio.gather(
+            query.edit_message_text(
+                success_message,
+                parse_mode='Markdown',
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            ),
+            loop.run_in_executor(None, db.add_transaction, {
+                'user_id': user_id,
+                'player_id': player_id,
+                'type': 'account_creation',
+                'amount': amount,
+                'status': 'success' if not deposit_error_msg else 'partial_success',
+                'error_message': deposit_error_msg,
+                'details': transaction_details
+            }),
+            loop.run_in_executor(None, db.update_account_balance, player_id, final_balance)
+        )
         
         logger.info(f"✅ تم إنشاء حساب كامل للمستخدم {user_id}: {username}")
         
-        # 8. تنظيف حالة المستخدم
+        # 7. تنظيف حالة المستخدم
         del user_states[user_id]
         
     except Exception as e:
@@ -712,10 +773,13 @@ async def confirm_account_creation(update: Update, context: ContextTypes.DEFAULT
         )
         
         try:
-            # محاولة إعادة المبلغ إذا فشلت العملية
+            # قبل إرسال الإيداع يُلغى الحجز، وبعده تبقى العملية في السجل حتى تُحسم
             try:
-                db.update_user_balance(user_id, user_states[user_id].amount, "add")
-                refund_msg = f"تم إعادة المبلغ ({user_states[user_id].amount} NSP) إلى رصيدك."
+                if idempotency_key is None or (not deposit_sent and db.compensate_money_intent(
+                        idempotency_key, local_refund=True, error_message=error_msg)):
+                    refund_msg = "لم يتم خصم أي مبلغ من رصيدك."
+                else:
+                    refund_msg = "يرجى الاتصال بالدعم لمراجعة رصيدك."
             except:
                 refund_msg = "يرجى الاتصال بالدعم لاسترداد المبلغ."
             
@@ -837,8 +901,8 @@ def _validate_amount(amount_str: str, user_id: str) -> Dict:
                 'amount': None
             }
         
-        # التحقق من رصيد المستخدم
-        user_balance = db.get_user_balance(user_id)
+        # التحقق من رصيد المستخدم (بعد استبعاد المبالغ المحجوزة)
+        user_balance = db.get_available_balance(user_id)
         if amount > user_balance:
             return {
                 'valid': False,
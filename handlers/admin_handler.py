@@ -0,0 +1,82 @@
+# handlers/admin_handler.py
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+from database import db
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# نتيجة العملية على Ichancy كما يحددها المسؤول بعد التحقق من سجلات الوكيل
+SETTLE_OUTCOMES = {'applied': True, 'failed': False}
+
+def _is_admin(update: Update) -> bool:
+    """هل المرسل من المسؤولين المحددين في ADMIN_USER_IDS"""
+    return str(update.effective_user.id) in config.ADMIN_USER_IDS
+
+async def review_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """عرض العمليات المالية المحالة للمراجعة (للمسؤولين فقط)"""
+    
+    if not _is_admin(update):
+        await update.message.reply_text("⛔ هذا الأمر متاح للمسؤولين فقط")
+        return
+    
+    entries = db.get_money_intents_for_review()
+    
+    if not entries:
+        await update.message.reply_text("✅ لا توجد عمليات مالية بانتظار المراجعة")
+        return
+    
+    lines = ["🔍 *العمليات المالية بانتظار المراجعة:*\n"]
+    for entry in entries:
+        lines.append(
+            f"• `{entry['idempotency_key']}`\n"
+            f"  {entry['operation']} {float(entry['amount']):.2f} NSP - المستخدم `{entry['user_id']}` "
+            f"- اللاعب `{entry['player_id'] or '-'}`"
+        )
+    
+    lines.append("\nللحسم: `/settle <المفتاح> applied` أو `/settle <المفتاح> failed`")
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='Markdown')
+
+async def settle_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """حسم عملية مالية محالة للمراجعة بعد التحقق من نتيجتها على Ichancy (للمسؤولين فقط)"""
+    
+    user_id = str(update.effective_user.id)
+    
+    if not _is_admin(update):
+        await update.message.reply_text("⛔ هذا الأمر متاح للمسؤولين فقط")
+        return
+    
+    if len(context.args or []) != 2 or context.args[1] not in SETTLE_OUTCOMES:
+        await update.message.reply_text(
+            "❌ الاستخدام: `/settle <المفتاح> applied` إذا طُبقت العملية على Ichancy، "
+            "أو `/settle <المفتاح> failed` إذا لم تُطبق",
+            parse_mode='Markdown'
+        )
+        return
+    
+    idempotency_key, outcome = context.args
+    
+    if not db.settle_reviewed_money_intent(idempotency_key, SETTLE_OUTCOMES[outcome],
+                                           error_message=f'حسمها المسؤول {user_id}: {outcome}'):
+        await update.message.reply_text(
+            f"❌ لم يتم حسم العملية `{idempotency_key}` (غير موجودة أو ليست قيد المراجعة)",
+            parse_mode='Markdown'
+        )
+        return
+    
+    logger.info(f"🛠️ حسم المسؤول {user_id} العملية {idempotency_key} بالنتيجة: {outcome}")
+    
+    db.add_transaction({
+        'user_id': user_id,
+        'type': 'money_intent_settled',
+        'amount': 0,
+        'status': outcome,
+        'details': f'حسم المسؤول العملية {idempotency_key}: {outcome}'
+    })
+    
+    await update.message.reply_text(
+        f"✅ تم حسم العملية `{idempotency_key}` بالنتيجة: {outcome}",
+        parse_mode='Markdown'
+    )
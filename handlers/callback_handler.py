@@ -1,9 +1,15 @@
+import time
 import logging
 import traceback
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import db
-from api.ichancy_api import api
+from api.agent_pool import api
+from api.circuit_breaker import circuit_breakers
+from api.egress_pool import egress_pool
+from utils.metrics import metrics
+from utils.redis_manager import redis_manager
+from workers.health_monitor import health_monitor
 from config import config
 from handlers.start_handler import (
     help_handler, 
@@ -502,11 +508,12 @@ async def show_api_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(query.from_user.id)
     
     try:
-        # اختبار الاتصال بـ Ichancy API
-        login_result = api.login()
+        # آخر نتيجة من مراقب الحالة (بدون تسجيل دخول جديد مع كل ضغطة)
+        health = health_monitor.snapshot()
+        ichancy = health['ichancy']
         
-        api_status = "✅ نشط" if login_result.get('success') else "❌ غير نشط"
-        api_message = login_result.get('error', 'غير معروف') if not login_result.get('success') else 'يعمل بشكل طبيعي'
+        api_status = _format_health(ichancy, "✅ نشط", "❌ غير نشط")
+        api_message = ichancy['error'] or ('يعمل بشكل طبيعي' if ichancy['ok'] else 'لم يكتمل الفحص الأول بعد')
         
         # التحقق من إعدادات التطبيق
         config_status = "✅ مكتمل" if all([
@@ -516,12 +523,14 @@ async def show_api_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
             config.PARENT_ID
         ]) else "❌ غير مكتمل"
         
-        # التحقق من قاعدة البيانات
-        try:
-            test_balance = db.get_user_balance(user_id)
-            db_status = "✅ متصل"
-        except:
-            db_status = "❌ غير متصل"
+        db_status = _format_health(health['database'], "✅ متصل", "❌ غير متصل")
+        redis_status = _format_health(health['redis'], "✅ متصل", "❌ غير متصل")
+        if redis_manager.configured and not redis_manager.available:
+            redis_status += " (التخزين في الذاكرة مؤقتاً)"
+        
+        breakers_text = _format_circuit_breakers()
+        latency_text = _format_endpoint_metrics()
+        egress_text = _format_egresses()
         
         status_text = f"""
 🔧 *حالة النظام*
@@ -530,6 +539,15 @@ async def show_api_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • الحالة: {api_status}
 • الرسالة: {api_message}
 
+🔌 *قواطع الدائرة:*
+{breakers_text}
+
+⏱️ *زمن الطلبات (آخر 5-10 دقائق):*
+{latency_text}
+
+🌍 *مخارج الاتصال:*
+{egress_text}
+
 ⚙️ *إعدادات التطبيق:*
 • التوكن: {'✅' if config.BOT_TOKEN else '❌'}
 • اسم المستخدم: {'✅' if config.AGENT_USERNAME else '❌'}
@@ -540,6 +558,7 @@ async def show_api_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 🗄️ *قاعدة البيانات:*
 • الحالة: {db_status}
 • النوع: {db.db_type}
+• Redis: {redis_status}
 
 🌐 *البيئة:*
 • البيئة: {config.RAILWAY_ENVIRONMENT}
@@ -566,6 +585,77 @@ async def show_api_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
+def _format_health(result: dict, up_text: str, down_text: str) -> str:
+    """تنسيق نتيجة فحص خدمة مع عمرها وزمنها"""
+    if not result['enabled']:
+        return "⚪ غير مفعّل"
+    
+    if result['ok'] is None:
+        return "⏳ قيد الفحص"
+    
+    age = int(time.time() - result['checked_at'])
+    return f"{up_text if result['ok'] else down_text} (قبل {age} ثانية، {result['latency'] * 1000:.0f}ms)"
+
+def _format_circuit_breakers() -> str:
+    """تنسيق حالة قواطع الدائرة لكل نقطة نهاية"""
+    breakers = circuit_breakers.snapshot()
+    
+    if not breakers:
+        return "• لم تُرسل أي طلبات بعد"
+    
+    lines = []
+    for endpoint, breaker in sorted(breakers.items()):
+        if breaker['state'] == 'open':
+            lines.append(f"• `{endpoint}`: 🔴 مفتوحة (تجربة بعد {int(breaker['retry_in']) + 1} ثانية)")
+        elif breaker['state'] == 'half_open':
+            lines.append(f"• `{endpoint}`: 🟡 نصف مفتوحة")
+        else:
+            lines.append(f"• `{endpoint}`: 🟢 مغلقة (إخفاقات: {breaker['consecutive_failures']})")
+    
+    return "\n".join(lines)
+
+def _format_egresses() -> str:
+    """تنسيق صحة كل مخرج اتصال وزمنه وحالة استبعاده"""
+    lines = []
+    for name, egress in sorted(egress_pool.snapshot().items()):
+        if egress['available']:
+            state = f"🟢 صحة {egress['health']:.0%}، زمن {_format_seconds(egress['latency'] and round(egress['latency'], 3))}"
+        else:
+            state = f"🚷 مستبعد ({int(egress['ejected_for']) + 1} ثانية متبقية)"
+        lines.append(f"• `{name}`: {state}")
+    
+    return "\n".join(lines)
+
+def _format_seconds(value) -> str:
+    return "-" if value is None else f"{value:g}ث"
+
+def _format_endpoint_metrics() -> str:
+    """تنسيق عدد الطلبات وزمنها وأخطائها لكل نقطة نهاية من سجل المقاييس"""
+    requests_total = metrics.histogram_series('ichancy_request_seconds')
+    
+    if not requests_total:
+        return "• لا توجد قياسات بعد"
+    
+    errors = {}
+    for labels, count in metrics.counter_values('ichancy_errors_total').items():
+        endpoint = dict(labels)['endpoint']
+        errors[endpoint] = errors.get(endpoint, 0) + count
+    
+    lines = []
+    for labels, histogram in sorted(requests_total.items()):
+        endpoint = dict(labels)['endpoint']
+        network = metrics.histogram('ichancy_network_seconds', endpoint=endpoint, outcome='ok')
+        pacing = metrics.histogram('ichancy_pacing_seconds', endpoint=endpoint)
+        
+        lines.append(
+            f"• `{endpoint}`: {histogram.total_count} طلب، "
+            f"p50 {_format_seconds(histogram.percentile(50))}، p95 {_format_seconds(histogram.percentile(95))} "
+            f"(شبكة {_format_seconds(network.percentile(95))}، تأخير {_format_seconds(pacing.percentile(95))})، "
+            f"أخطاء {int(errors.get(endpoint, 0))}"
+        )
+    
+    return "\n".join(lines)
+
 async def show_system_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """عرض حالة النظام العام"""
     
@@ -1,13 +1,17 @@
 
 # handlers/deposit_handler.py
+import uuid
 import logging
 import traceback
 from typing import Dict, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import db
-from api.ichancy_api import api
+from api.agent_pool import api
+from api.priority import RequestPriority
 from config import config
+from workers.job_worker import job_worker
+from workers.balance_reconciler import schedule_balance_reconcile
 
 logger = logging.getLogger(__name__)
 
@@ -80,8 +84,8 @@ async def deposit_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
-        # جلب رصيد المستخدم المحلي
-        user_balance = db.get_user_balance(user_id)
+        # جلب رصيد المستخدم المحلي المتاح
+        user_balance = db.get_available_balance(user_id)
         
         if user_balance <= 0:
             logger.warning(f"⚠️ رصيد المستخدم {user_id} صفر أو أقل: {user_balance}")
@@ -227,7 +231,7 @@ async def handle_deposit_amount(update: Update, context: ContextTypes.DEFAULT_TY
         logger.info(f"✅ مبلغ إيداع مقبول للمستخدم {user_id}: {amount} NSP")
         
         # جلب المعلومات الحالية
-        user_balance = db.get_user_balance(user_id)
+        user_balance = db.get_available_balance(user_id)
         account = db.get_ichancy_account(user_id)
         
         # عرض تأكيد النهائي
@@ -303,7 +307,7 @@ async def handle_deposit_amount(update: Update, context: ContextTypes.DEFAULT_TY
         )
 
 async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """تأكيد وإتمام عملية الإيداع"""
+    """تأكيد عملية الإيداع وإضافتها إلى طابور التنفيذ"""
     
     query = update.callback_query
     await query.answer()
@@ -333,17 +337,81 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         player_id = deposit_states[user_id].player_id
         login = deposit_states[user_id].login
         
-        # تحديث الرسالة للإشارة إلى بدء العملية
+        # تنظيف حالة المستخدم، المهمة الخلفية مسؤولة عن العملية من الآن
+        del deposit_states[user_id]
+        
+        # تحديث الرسالة قبل إضافة المهمة حتى لا تطغى على نتيجتها
         await query.edit_message_text(
-            f"⏳ *جارٍ معالجة الإيداع...*\n\n"
+            f"⏳ *تم استلام طلب الإيداع!*\n\n"
             f"👤 المستخدم: `{login}`\n"
             f"💰 المبلغ: `{amount}` NSP\n"
             f"🆔 رقم اللاعب: `{player_id}`\n\n"
-            f"⏱️ قد تستغرق العملية 1-2 دقيقة\n"
-            f"⚡ يرجى الانتظار...",
+            f"⚡ جارٍ التنفيذ، سيتم تحديث هذه الرسالة تلقائياً عند اكتمال العملية",
             parse_mode='Markdown'
         )
         
+        # إضافة العملية إلى طابور المهام بدلاً من تنفيذها داخل الكولباك
+        job_id = job_worker.enqueue(
+            'deposit',
+            user_id,
+            {'amount': amount, 'player_id': player_id, 'login': login},
+            chat_id=chat_id,
+            message_id=query.message.message_id
+        )
+        
+        if job_id is None:
+            await query.edit_message_text(
+                f"❌ *تعذر بدء عملية الإيداع!*\n\n"
+                f"⚠️ لم يتم خصم أي مبلغ من رصيدك.\n"
+                f"💡 يرجى المحاولة مرة أخرى بعد قليل\n\n"
+                f"📞 للدعم: @TSA_Support\n"
+                f"🔧 كود الخطأ: `{user_id[:8]}_DEPOSIT_QUEUE_FAIL`",
+                parse_mode='Markdown'
+            )
+            return
+        
+        logger.info(f"📥 تمت إضافة إيداع المستخدم {user_id} إلى الطابور (المهمة {job_id})")
+    
+    except Exception as e:
+        error_msg = f"❌ فشل إضافة الإيداع إلى الطابور للمستخدم {user_id}: {str(e)}"
+        logger.error(error_msg)
+        
+        db.log_error(
+            user_id=user_id,
+            error_type='deposit_enqueue_failed',
+            error_message=error_msg,
+            stack_trace=traceback.format_exc(),
+            api_endpoint='handlers.deposit_handler.confirm_deposit'
+        )
+        
+        try:
+            await query.edit_message_text(
+                f"❌ *حدث خطأ غير متوقع!*\n\n"
+                f"⚠️ {str(e)}\n\n"
+                f"📞 للدعم الفوري: @TSA_Support\n"
+                f"🔧 كود الخطأ: `{user_id[:8]}_DEPOSIT_FINAL_FAIL`",
+                parse_mode='Markdown'
+            )
+        except:
+            pass
+        
+        # تنظيف حالة المستخدم في جميع الأحوال
+        if user_id in deposit_states:
+            del deposit_states[user_id]
+
+def run_deposit_job(job: Dict) -> Dict:
+    """تنفيذ عملية الإيداع من طابور المهام"""
+    
+    user_id = job['user_id']
+    amount = job['payload']['amount']
+    player_id = job['payload']['player_id']
+    login = job['payload']['login']
+    
+    idempotency_key = f"deposit:{job['id']}"
+    entry = None
+    deposited = False
+    
+    try:
         # تسجيل بدء معالجة الإيداع
         db.add_transaction({
             'user_id': user_id,
@@ -351,23 +419,48 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'type': 'deposit_processing',
             'amount': amount,
             'status': 'processing',
-            'details': f'بدء معالجة إيداع لحساب {login}'
+            'details': f'بدء معالجة إيداع لحساب {login} (المهمة {job["id"]})'
         })
         
-        # 1. خصم المبلغ من رصيد المستخدم المحلي أولاً
-        deduction_success = db.update_user_balance(user_id, amount, "subtract")
+        # 1. جلب الرصيد الحالي على Ichancy كمرجع لاسترداد العملية عند الأعطال
+        balance_before_result = api.get_balance(player_id)
         
-        if not deduction_success:
-            error_msg = f"❌ فشل خصم المبلغ من الرصيد المحلي للمستخدم {user_id}"
-            logger.error(error_msg)
+        if not balance_before_result.get('success'):
+            error_msg = balance_before_result.get('error', 'فشل التحقق من الرصيد')
+            logger.error(f"❌ فشل جلب رصيد Ichancy قبل الإيداع للمستخدم {user_id}: {error_msg}")
             
-            await query.edit_message_text(
-                f"❌ *فشل خصم المبلغ!*\n\n"
-                f"⚠️ تعذر خصم `{amount}` NSP من رصيدك المحلي\n\n"
-                f"📊 رصيدك الحالي: `{db.get_user_balance(user_id):.2f}` NSP\n"
-                f"💡 قد يكون رصيدك غير كافي أو حدث خطأ في النظام",
-                parse_mode='Markdown'
-            )
+            db.add_transaction({
+                'user_id': user_id,
+                'player_id': player_id,
+                'type': 'deposit_failed',
+                'amount': amount,
+                'status': 'failed',
+                'error_message': error_msg,
+                'details': 'فشل جلب الرصيد قبل الإيداع، لم يتم خصم أي مبلغ'
+            })
+            
+            return {
+                'status': 'failed',
+                'error': error_msg,
+                'text': (
+                    f"❌ *تعذر الاتصال بـ Ichancy!*\n\n"
+                    f"⚠️ {error_msg}\n\n"
+                    f"💡 لم يتم خصم أي مبلغ من رصيدك، يرجى المحاولة لاحقاً\n"
+                    f"🔧 كود الخطأ: `{user_id[:8]}_BALANCE_CHECK_FAIL`"
+                )
+            }
+        
+        balance_before = balance_before_result.get('balance', 0)
+        
+        # 2. تسجيل نية الإيداع وحجز المبلغ من الرصيد المحلي في معاملة واحدة
+        entry = db.open_money_intent(
+            idempotency_key, job['id'], user_id, player_id, 'deposit', amount,
+            balance_before=balance_before, reserve=True
+        )
+        
+        if entry is None:
+            error_msg = f"❌ فشل حجز المبلغ من الرصيد المحلي للمستخدم {user_id}"
+            logger.error(error_msg)
             
             db.add_transaction({
                 'user_id': user_id,
@@ -376,33 +469,51 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'amount': amount,
                 'status': 'failed',
                 'error_message': error_msg,
-                'details': 'فشل خصم المبلغ من الرصيد المحلي'
+                'details': 'فشل حجز المبلغ من الرصيد المحلي'
             })
             
-            # تنظيف حالة المستخدم
-            del deposit_states[user_id]
-            return
+            return {
+                'status': 'failed',
+                'error': error_msg,
+                'text': (
+                    f"❌ *فشل خصم المبلغ!*\n\n"
+                    f"⚠️ تعذر خصم `{amount}` NSP من رصيدك المحلي\n\n"
+                    f"📊 رصيدك المتاح: `{db.get_available_balance(user_id):.2f}` NSP\n"
+                    f"💡 قد يكون رصيدك غير كافي أو حدث خطأ في النظام"
+                )
+            }
+        
+        if not entry['is_new']:
+            # المهمة نُفذت من قبل بنفس المفتاح، لا نكرر الإيداع
+            return {
+                'status': 'failed',
+                'error': f'duplicate operation {idempotency_key}',
+                'text': (
+                    f"⚠️ *تمت معالجة هذه العملية مسبقاً!*\n\n"
+                    f"📋 حالة العملية: `{entry['status']}`\n"
+                    f"📞 للاستفسار: @TSA_Support"
+                )
+            }
         
-        logger.info(f"✅ تم خصم {amount} NSP من رصيد المستخدم {user_id}")
+        logger.info(f"🔒 تم حجز {amount} NSP من رصيد المستخدم {user_id}")
         
-        # 2. إيداع المبلغ على حساب Ichancy
-        deposit_result = api.deposit(player_id, amount)
+        # 3. إيداع المبلغ على حساب Ichancy
+        deposit_result = api.deposit(player_id, amount, reference=idempotency_key, balance_before=balance_before)
         
         if not deposit_result.get('success'):
             error_msg = deposit_result.get('error', 'فشل غير معروف في الإيداع')
             logger.error(f"❌ فشل إيداع على Ichancy للمستخدم {user_id}: {error_msg}")
             
-            # إعادة المبلغ المخصوم
-            db.update_user_balance(user_id, amount, "add")
-            
-            await query.edit_message_text(
-                f"❌ *فشل إيداع المبلغ على Ichancy!*\n\n"
-                f"⚠️ {error_msg}\n\n"
-                f"🔙 تم إعادة `{amount}` NSP إلى رصيدك المحلي\n"
-                f"📞 للدعم: @TSA_Support\n"
-                f"🔧 كود الخطأ: `{user_id[:8]}_ICHANCY_DEPOSIT_FAIL`",
-                parse_mode='Markdown'
-            )
+            if deposit_result.get('ambiguous'):
+                # ربما وصل الطلب رغم فشل الرد: يبقى المبلغ محجوزاً حتى تُحسم العملية
+                refund_msg = f"🔍 نتيجة العملية غير مؤكدة، يبقى `{amount}` NSP محجوزاً حتى مراجعتها"
+                resolution = 'pending'
+            elif db.compensate_money_intent(idempotency_key, local_refund=True, error_message=error_msg):
+                refund_msg = f"🔙 لم يتم خصم `{amount}` NSP من رصيدك المحلي"
+                resolution = 'compensated'
+            else:
+                refund_msg = "🔍 العملية قيد المراجعة وسيتم حسمها لاحقاً"
+                resolution = 'pending'
             
             db.add_transaction({
                 'user_id': user_id,
@@ -411,38 +522,69 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'amount': amount,
                 'status': 'failed',
                 'error_message': error_msg,
-                'details': f'فشل إيداع على Ichancy: {error_msg}'
+                'details': f'فشل إيداع على Ichancy: {error_msg} ({resolution})'
             })
             
-            # تنظيف حالة المستخدم
-            del deposit_states[user_id]
-            return
-        
-        logger.info(f"✅ تم إيداع {amount} NSP لحساب {player_id} على Ichancy")
+            return {
+                'status': 'failed',
+                'error': error_msg,
+                'text': (
+                    f"❌ *فشل إيداع المبلغ على Ichancy!*\n\n"
+                    f"⚠️ {error_msg}\n\n"
+                    f"{refund_msg}\n"
+                    f"📞 للدعم: @TSA_Support\n"
+                    f"🔧 كود الخطأ: `{user_id[:8]}_ICHANCY_DEPOSIT_FAIL`"
+                )
+            }
         
-        # 3. جلب الرصيد الجديد
-        balance_result = api.get_balance(player_id)
+        deposited = True
         
-        if balance_result.get('success'):
-            new_balance = balance_result.get('balance', 0)
+        # إنهاء نية العملية ينفذ الحجز (الخصم الفعلي) في نفس المعاملة
+        if not db.complete_money_intent(idempotency_key):
+            error_msg = f"❌ فشل تنفيذ خصم الإيداع من الرصيد المحلي للمستخدم {user_id}"
+            logger.error(error_msg)
             
-            # تحديث رصيد الحساب في قاعدة البيانات
-            db.update_account_balance(player_id, new_balance)
+            # Ichancy أكد الإيداع، فيكمل الحسم الدوري الخصم المحلي
+            db.mark_money_intent(idempotency_key, 'upstream_applied', error_msg)
             
-            # حساب الرصيد السابق
-            old_balance = new_balance - amount
+            db.add_transaction({
+                'user_id': user_id,
+                'player_id': player_id,
+                'type': 'deposit_failed',
+                'amount': amount,
+                'status': 'failed',
+                'error_message': error_msg,
+                'details': 'تم الإيداع على Ichancy وتعذر تنفيذ الحجز المحلي - سيتم إكماله تلقائياً'
+            })
             
-            balance_info = f"""
+            return {
+                'status': 'failed',
+                'error': error_msg,
+                'text': (
+                    f"⚠️ *تم الإيداع على Ichancy مع تأخر في تسجيله!*\n\n"
+                    f"🔁 العملية مسجلة وسيتم إكمالها تلقائياً.\n"
+                    f"📞 للدعم: @TSA_Support\n"
+                    f"🔧 كود الخطأ: `{user_id[:8]}_LOCAL_CAPTURE_FAIL`"
+                )
+            }
+        
+        logger.info(f"✅ تم إيداع {amount} NSP لحساب {player_id} على Ichancy")
+        
+        # 4. الرصيد الجديد مشتق من الرصيد المرجعي، والمطابقة الفعلية تتم في الخلفية
+        new_balance = balance_before + amount
+        
+        # تحديث رصيد الحساب في قاعدة البيانات
+        db.update_account_balance(player_id, new_balance)
+        schedule_balance_reconcile(user_id, player_id, new_balance)
+        
+        balance_info = f"""
 📊 *معلومات الرصيد:*
-• الرصيد السابق: `{old_balance:.2f}` NSP
+• الرصيد السابق: `{balance_before:.2f}` NSP
 • المبلغ المضاف: `{amount}` NSP
 • الرصيد الحالي: `{new_balance:.2f}` NSP
-            """
-        else:
-            balance_info = "⚠️ *ملاحظة:* تعذر جلب الرصيد الحالي، يرجى التحقق يدوياً"
-            new_balance = None
+        """
         
-        # 4. إرسال رسالة النجاح
+        # 5. تجهيز رسالة النجاح
         success_message = f"""
 🎉 *تم الإيداع بنجاح!*
 
@@ -480,16 +622,8 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🔙 القائمة الرئيسية", callback_data='main_menu')]
         ]
         
-        await query.edit_message_text(
-            success_message,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        
-        # 5. تسجيل النجاح
-        transaction_details = f'إيداع ناجح لحساب {login} (ID: {player_id})'
-        if new_balance is not None:
-            transaction_details += f' - الرصيد الجديد: {new_balance} NSP'
+        # 6. تسجيل النجاح
+        transaction_details = f'إيداع ناجح لحساب {login} (ID: {player_id}) - الرصيد الجديد: {new_balance} NSP'
         
         db.add_transaction({
             'user_id': user_id,
@@ -500,14 +634,14 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'details': transaction_details
         })
         
-        # 6. تحديث رصيد المستخدم المحلي النهائي
-        final_balance = db.get_user_balance(user_id)
-        logger.info(f"✅ رصيد المستخدم {user_id} النهائي: {final_balance} NSP")
-        
         logger.info(f"✅ تم إتمام إيداع كامل للمستخدم {user_id}: {amount} NSP للحساب {login}")
         
-        # 7. تنظيف حالة المستخدم
-        del deposit_states[user_id]
+        return {
+            'status': 'done',
+            'text': success_message,
+            'reply_markup': InlineKeyboardMarkup(keyboard),
+            'summary': {'amount': amount, 'player_id': player_id, 'new_balance': new_balance}
+        }
         
     except Exception as e:
         error_msg = f"❌ فشل إتمام الإيداع للمستخدم {user_id}: {str(e)}"
@@ -518,35 +652,32 @@ async def confirm_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
             error_type='deposit_final_failed',
             error_message=error_msg,
             stack_trace=traceback.format_exc(),
-            api_endpoint='handlers.deposit_handler.confirm_deposit'
+            api_endpoint='handlers.deposit_handler.run_deposit_job'
         )
         
-        try:
-            # محاولة إعادة المبلغ إذا فشلت العملية
-            try:
-                if user_id in deposit_states and deposit_states[user_id].amount:
-                    db.update_user_balance(user_id, deposit_states[user_id].amount, "add")
-                    refund_msg = f"تم إعادة المبلغ ({deposit_states[user_id].amount} NSP) إلى رصيدك."
-                else:
-                    refund_msg = "يرجى الاتصال بالدعم لاسترداد المبلغ."
-            except:
-                refund_msg = "يرجى الاتصال بالدعم لاسترداد المبلغ."
-            
-            await query.edit_message_text(
+        # لا نخمن نتيجة الإيداع: العملية المعلقة تبقى محجوزة حتى يحسمها الحسم الدوري
+        refund_msg = "يرجى الاتصال بالدعم لاسترداد المبلغ."
+        if entry is not None and entry.get('is_new'):
+            if deposited:
+                # الإيداع مؤكد: إذا لم يُنفذ الحجز بعد يكمله الحسم الدوري
+                db.mark_money_intent(idempotency_key, 'upstream_applied', error_msg)
+                refund_msg = "تم إيداع المبلغ على Ichancy، يرجى مراجعة حسابك."
+            else:
+                refund_msg = f"نتيجة العملية غير مؤكدة، يبقى المبلغ ({amount} NSP) محجوزاً حتى مراجعتها."
+        elif entry is None:
+            refund_msg = "لم يتم خصم أي مبلغ من رصيدك."
+        
+        return {
+            'status': 'failed',
+            'error': error_msg,
+            'text': (
                 f"❌ *حدث خطأ غير متوقع!*\n\n"
                 f"⚠️ {str(e)}\n\n"
                 f"🔙 {refund_msg}\n"
                 f"📞 للدعم الفوري: @TSA_Support\n"
-                f"🔧 كود الخطأ: `{user_id[:8]}_DEPOSIT_FINAL_FAIL`",
-                parse_mode='Markdown'
+                f"🔧 كود الخطأ: `{user_id[:8]}_DEPOSIT_FINAL_FAIL`"
             )
-            
-        except:
-            pass
-        
-        # تنظيف حالة المستخدم في جميع الأحوال
-        if user_id in deposit_states:
-            del deposit_states[user_id]
+        }
 
 async def cancel_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إلغاء عملية الإيداع"""
@@ -600,19 +731,22 @@ async def quick_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE, amou
             return
         
         # التحقق من رصيد المستخدم
-        user_balance = db.get_user_balance(user_id)
+        user_balance = db.get_available_balance(user_id)
         
         if user_balance < amount:
             await update.message.reply_text(
-                f"❌ رصيدك غير كافي! الرصيد الحالي: {user_balance:.2f} NSP",
+                f"❌ رصيدك غير كافي! الرصيد المتاح: {user_balance:.2f} NSP",
                 parse_mode='Markdown'
             )
             return
         
-        # خصم المبلغ
-        deduction_success = db.update_user_balance(user_id, amount, "subtract")
+        # تسجيل نية الإيداع وحجز المبلغ حتى تنتهي العملية
+        idempotency_key = f"quick_deposit:{uuid.uuid4().hex}"
+        entry = db.open_money_intent(
+            idempotency_key, None, user_id, ichancy_account['player_id'], 'deposit', amount, reserve=True
+        )
         
-        if not deduction_success:
+        if entry is None:
             await update.message.reply_text(
                 "❌ فشل خصم المبلغ!",
                 parse_mode='Markdown'
@@ -620,14 +754,28 @@ async def quick_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE, amou
             return
         
         # إيداع المبلغ على Ichancy
-        deposit_result = api.deposit(ichancy_account['player_id'], amount)
+        deposit_result = api.deposit(ichancy_account['player_id'], amount, reference=idempotency_key)
         
         if not deposit_result.get('success'):
-            # إعادة المبلغ
-            db.update_user_balance(user_id, amount, "add")
+            error_msg = deposit_result.get('error', 'خطأ غير معروف')
+            
+            # الفشل الغامض يبقى محجوزاً حتى يُحسم، والفشل المؤكد يلغي الحجز
+            if deposit_result.get('ambiguous') or not db.compensate_money_intent(
+                    idempotency_key, local_refund=True, error_message=error_msg):
+                error_msg += "\n🔍 نتيجة العملية غير مؤكدة، يبقى المبلغ محجوزاً حتى مراجعتها"
             
             await update.message.reply_text(
-                f"❌ فشل الإيداع: {deposit_result.get('error', 'خطأ غير معروف')}",
+                f"❌ فشل الإيداع: {error_msg}",
+                parse_mode='Markdown'
+            )
+            return
+        
+        # تنفيذ الحجز (الخصم الفعلي)
+        if not db.complete_money_intent(idempotency_key):
+            db.mark_money_intent(idempotency_key, 'upstream_applied', 'فشل تنفيذ الحجز بعد الإيداع')
+            
+            await update.message.reply_text(
+                f"⚠️ تم إيداع {amount} NSP وسيتم تسجيل الخصم تلقائياً.",
                 parse_mode='Markdown'
             )
             return
@@ -682,8 +830,8 @@ def _validate_deposit_amount(amount_str: str, user_id: str) -> Dict:
                 'amount': None
             }
         
-        # التحقق من رصيد المستخدم
-        user_balance = db.get_user_balance(user_id)
+        # التحقق من رصيد المستخدم (بعد استبعاد المبالغ المحجوزة)
+        user_balance = db.get_available_balance(user_id)
         if amount > user_balance:
             return {
                 'valid': False,
@@ -823,6 +971,9 @@ async def show_deposit_history(update: Update, context: ContextTypes.DEFAULT_TYP
             parse_mode='Markdown'
         )
 
+# تسجيل منفذ الإيداع في طابور المهام
+job_worker.register('deposit', run_deposit_job, priority=RequestPriority.MONEY)
+
 if __name__ == "__main__":
     print("✅ تم تحميل معالج تعبئة الرصيد بنجاح")
     print("🔍 اختبار دوال التحقق:")
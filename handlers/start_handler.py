@@ -6,6 +6,7 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import db
 from config import config
+from workers.health_monitor import health_monitor
 
 logger = logging.getLogger(__name__)
 
@@ -297,15 +298,12 @@ async def _check_services_status() -> dict:
         if all([config.AGENT_USERNAME, config.AGENT_PASSWORD, config.PARENT_ID]):
             status['api'] = True
         
-        # التحقق من اتصال قاعدة البيانات (محاولة استعلام بسيط)
-        try:
-            test_balance = db.get_user_balance('test_user')
-            status['database'] = True
-        except:
-            status['database'] = False
+        # آخر نتيجة من مراقب الحالة بدلاً من استعلام مع كل /start
+        health = health_monitor.snapshot()
         
-        # التحقق من توفر موقع Ichancy (اختياري - قد يكون بطيئاً)
-        # status['ichancy_site'] = await _check_ichancy_availability()
+        # قبل الفحص الأول نفترض أن قاعدة البيانات تعمل
+        status['database'] = health['database']['ok'] is not False
+        status['ichancy_site'] = health['ichancy']['ok'] is True
         
         logger.debug(f"📊 حالة الخدمات: {status}")
         
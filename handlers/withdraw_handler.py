@@ -1,13 +1,18 @@
 
 # handlers/withdraw_handler.py
+import uuid
 import logging
 import traceback
 from typing import Dict, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from database import db
-from api.ichancy_api import api
+from api.ichancy_api import BalanceSnapshot
+from api.agent_pool import api
+from api.priority import RequestPriority
 from config import config
+from workers.job_worker import job_worker
+from workers.balance_reconciler import schedule_balance_reconcile
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +24,7 @@ class WithdrawState:
         self.player_id = None
         self.login = None
         self.current_balance = None
+        self.balance_snapshot = None
 
 # تخزين حالات المستخدمين
 withdraw_states = {}
@@ -127,6 +133,7 @@ async def withdraw_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         withdraw_states[user_id].player_id = ichancy_account['player_id']
         withdraw_states[user_id].login = ichancy_account['login']
         withdraw_states[user_id].current_balance = current_balance
+        withdraw_states[user_id].balance_snapshot = balance_result.get('snapshot')
         
         # جلب رصيد المستخدم المحلي
         user_balance = db.get_user_balance(user_id)
@@ -350,7 +357,7 @@ async def handle_withdraw_amount(update: Update, context: ContextTypes.DEFAULT_T
         )
 
 async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """تأكيد وإتمام عملية السحب"""
+    """تأكيد عملية السحب وإضافتها إلى طابور التنفيذ"""
     
     query = update.callback_query
     await query.answer()
@@ -381,19 +388,91 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
         player_id = withdraw_states[user_id].player_id
         login = withdraw_states[user_id].login
         current_balance = withdraw_states[user_id].current_balance
+        balance_snapshot = withdraw_states[user_id].balance_snapshot
         
-        # تحديث الرسالة للإشارة إلى بدء العملية
+        # تنظيف حالة المستخدم، المهمة الخلفية مسؤولة عن العملية من الآن
+        del withdraw_states[user_id]
+        
+        # تحديث الرسالة قبل إضافة المهمة حتى لا تطغى على نتيجتها
         await query.edit_message_text(
-            f"⏳ *جارٍ معالجة السحب...*\n\n"
+            f"⏳ *تم استلام طلب السحب!*\n\n"
             f"👤 المستخدم: `{login}`\n"
             f"💰 المبلغ: `{amount}` NSP\n"
             f"🆔 رقم اللاعب: `{player_id}`\n"
             f"📊 الرصيد الحالي: `{current_balance}` NSP\n\n"
-            f"⏱️ قد تستغرق العملية 1-2 دقيقة\n"
-            f"⚡ يرجى الانتظار...",
+            f"⚡ جارٍ التنفيذ، سيتم تحديث هذه الرسالة تلقائياً عند اكتمال العملية",
             parse_mode='Markdown'
         )
         
+        # إضافة العملية إلى طابور المهام بدلاً من تنفيذها داخل الكولباك
+        job_id = job_worker.enqueue(
+            'withdraw',
+            user_id,
+            {
+                'amount': amount,
+                'player_id': player_id,
+                'login': login,
+                'current_balance': current_balance,
+                'balance_snapshot': balance_snapshot.to_dict() if balance_snapshot else None
+            },
+            chat_id=chat_id,
+            message_id=query.message.message_id
+        )
+        
+        if job_id is None:
+            await query.edit_message_text(
+                f"❌ *تعذر بدء عملية السحب!*\n\n"
+                f"⚠️ لم يتم سحب أي مبلغ من حسابك.\n"
+                f"💡 يرجى المحاولة مرة أخرى بعد قليل\n\n"
+                f"📞 للدعم: @TSA_Support\n"
+                f"🔧 كود الخطأ: `{user_id[:8]}_WITHDRAW_QUEUE_FAIL`",
+                parse_mode='Markdown'
+            )
+            return
+        
+        logger.info(f"📥 تمت إضافة سحب المستخدم {user_id} إلى الطابور (المهمة {job_id})")
+    
+    except Exception as e:
+        error_msg = f"❌ فشل إضافة السحب إلى الطابور للمستخدم {user_id}: {str(e)}"
+        logger.error(error_msg)
+        
+        db.log_error(
+            user_id=user_id,
+            error_type='withdraw_enqueue_failed',
+            error_message=error_msg,
+            stack_trace=traceback.format_exc(),
+            api_endpoint='handlers.withdraw_handler.confirm_withdraw'
+        )
+        
+        try:
+            await query.edit_message_text(
+                f"❌ *حدث خطأ غير متوقع!*\n\n"
+                f"⚠️ {str(e)}\n\n"
+                f"📞 للدعم الفوري: @TSA_Support\n"
+                f"🔧 كود الخطأ: `{user_id[:8]}_WITHDRAW_FINAL_FAIL`",
+                parse_mode='Markdown'
+            )
+        except:
+            pass
+        
+        # تنظيف حالة المستخدم في جميع الأحوال
+        if user_id in withdraw_states:
+            del withdraw_states[user_id]
+
+def run_withdraw_job(job: Dict) -> Dict:
+    """تنفيذ عملية السحب من طابور المهام"""
+    
+    user_id = job['user_id']
+    amount = job['payload']['amount']
+    player_id = job['payload']['player_id']
+    login = job['payload']['login']
+    current_balance = job['payload']['current_balance']
+    
+    idempotency_key = f"withdraw:{job['id']}"
+    entry = None
+    withdrawn = False
+    
+    try:
         # تسجيل بدء معالجة السحب
         db.add_transaction({
             'user_id': user_id,
@@ -401,52 +480,54 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'type': 'withdraw_processing',
             'amount': amount,
             'status': 'processing',
-            'details': f'بدء معالجة سحب من حساب {login} - الرصيد الحالي: {current_balance}'
+            'details': f'بدء معالجة سحب من حساب {login} - الرصيد الحالي: {current_balance} (المهمة {job["id"]})'
         })
         
-        # 1. التحقق من الرصيد الحالي مرة أخرى (للتأكد)
-        balance_check = api.get_balance(player_id)
+        # 1. التحقق من الرصيد الحالي (نتجاوز الطلب إذا كانت لقطة الرصيد حديثة)
+        snapshot = BalanceSnapshot.from_dict(job['payload'].get('balance_snapshot'))
         
-        if not balance_check.get('success'):
-            error_msg = balance_check.get('error', 'فشل التحقق من الرصيد')
-            logger.error(f"❌ فشل التحقق من رصيد Ichancy للمستخدم {user_id}: {error_msg}")
-            
-            await query.edit_message_text(
-                f"❌ *فشل التحقق من الرصيد!*\n\n"
-                f"⚠️ {error_msg}\n\n"
-                f"📞 للدعم: @TSA_Support\n"
-                f"🔧 كود الخطأ: `{user_id[:8]}_BALANCE_CHECK_FAIL`",
-                parse_mode='Markdown'
-            )
+        # الرصيد المرجعي في سجل العمليات يُحفظ فقط إذا جُلب الآن، فاللقطة قد تسبق عمليات أخرى
+        journaled_balance = None
+        
+        if snapshot is not None and snapshot.is_fresh():
+            logger.info(f"⚡ استخدام رصيد محفوظ منذ {snapshot.age:.1f} ثانية للمستخدم {user_id}")
+        else:
+            balance_check = api.get_balance(player_id)
             
-            db.add_transaction({
-                'user_id': user_id,
-                'player_id': player_id,
-                'type': 'withdraw_failed',
-                'amount': amount,
-                'status': 'failed',
-                'error_message': error_msg,
-                'details': 'فشل التحقق من الرصيد قبل السحب'
-            })
+            if not balance_check.get('success'):
+                error_msg = balance_check.get('error', 'فشل التحقق من الرصيد')
+                logger.error(f"❌ فشل التحقق من رصيد Ichancy للمستخدم {user_id}: {error_msg}")
+                
+                db.add_transaction({
+                    'user_id': user_id,
+                    'player_id': player_id,
+                    'type': 'withdraw_failed',
+                    'amount': amount,
+                    'status': 'failed',
+                    'error_message': error_msg,
+                    'details': 'فشل التحقق من الرصيد قبل السحب'
+                })
+                
+                return {
+                    'status': 'failed',
+                    'error': error_msg,
+                    'text': (
+                        f"❌ *فشل التحقق من الرصيد!*\n\n"
+                        f"⚠️ {error_msg}\n\n"
+                        f"📞 للدعم: @TSA_Support\n"
+                        f"🔧 كود الخطأ: `{user_id[:8]}_BALANCE_CHECK_FAIL`"
+                    )
+                }
             
-            # تنظيف حالة المستخدم
-            del withdraw_states[user_id]
-            return
+            snapshot = balance_check['snapshot']
+            journaled_balance = snapshot.balance
         
-        updated_balance = balance_check.get('balance', current_balance)
+        updated_balance = snapshot.balance
         
         if updated_balance < amount:
             error_msg = f"❌ الرصيد غير كافي بعد التحقق. الرصيد الحالي: {updated_balance} NSP"
             logger.error(f"❌ رصيد غير كافي للمستخدم {user_id}: {error_msg}")
             
-            await query.edit_message_text(
-                f"❌ *الرصيد غير كافي!*\n\n"
-                f"⚠️ رصيدك الحالي: `{updated_balance}` NSP\n"
-                f"💰 المبلغ المطلوب: `{amount}` NSP\n\n"
-                f"💡 قد يكون الرصيد قد تغير أثناء العملية",
-                parse_mode='Markdown'
-            )
-            
             db.add_transaction({
                 'user_id': user_id,
                 'player_id': player_id,
@@ -457,26 +538,28 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'details': f'رصيد غير كافي بعد التحقق: {updated_balance} NSP'
             })
             
-            # تنظيف حالة المستخدم
-            del withdraw_states[user_id]
-            return
+            return {
+                'status': 'failed',
+                'error': error_msg,
+                'text': (
+                    f"❌ *الرصيد غير كافي!*\n\n"
+                    f"⚠️ رصيدك الحالي: `{updated_balance}` NSP\n"
+                    f"💰 المبلغ المطلوب: `{amount}` NSP\n\n"
+                    f"💡 قد يكون الرصيد قد تغير أثناء العملية"
+                )
+            }
         
         logger.info(f"✅ الرصيد الحالي مؤكد: {updated_balance} NSP للمستخدم {user_id}")
         
-        # 2. سحب المبلغ من حساب Ichancy
-        withdraw_result = api.withdraw(player_id, amount)
+        # 2. تسجيل نية السحب قبل إرسالها إلى Ichancy
+        entry = db.open_money_intent(
+            idempotency_key, job['id'], user_id, player_id, 'withdraw', amount,
+            balance_before=journaled_balance
+        )
         
-        if not withdraw_result.get('success'):
-            error_msg = withdraw_result.get('error', 'فشل غير معروف في السحب')
-            logger.error(f"❌ فشل السحب من Ichancy للمستخدم {user_id}: {error_msg}")
-            
-            await query.edit_message_text(
-                f"❌ *فشل سحب المبلغ من Ichancy!*\n\n"
-                f"⚠️ {error_msg}\n\n"
-                f"📞 للدعم: @TSA_Support\n"
-                f"🔧 كود الخطأ: `{user_id[:8]}_ICHANCY_WITHDRAW_FAIL`",
-                parse_mode='Markdown'
-            )
+        if entry is None:
+            error_msg = f"❌ فشل تسجيل عملية السحب للمستخدم {user_id}"
+            logger.error(error_msg)
             
             db.add_transaction({
                 'user_id': user_id,
@@ -485,40 +568,83 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'amount': amount,
                 'status': 'failed',
                 'error_message': error_msg,
-                'details': f'فشل السحب من Ichancy: {error_msg}'
+                'details': 'فشل تسجيل نية السحب، لم يتم سحب أي مبلغ'
             })
             
-            # تنظيف حالة المستخدم
-            del withdraw_states[user_id]
-            return
+            return {
+                'status': 'failed',
+                'error': error_msg,
+                'text': (
+                    f"❌ *تعذر بدء عملية السحب!*\n\n"
+                    f"⚠️ لم يتم سحب أي مبلغ من حسابك.\n"
+                    f"💡 يرجى المحاولة مرة أخرى بعد قليل\n\n"
+                    f"📞 للدعم: @TSA_Support\n"
+                    f"🔧 كود الخطأ: `{user_id[:8]}_WITHDRAW_INTENT_FAIL`"
+                )
+            }
         
-        logger.info(f"✅ تم سحب {amount} NSP من حساب {player_id} على Ichancy")
+        if not entry['is_new']:
+            # المهمة نُفذت من قبل بنفس المفتاح، لا نكرر السحب
+            return {
+                'status': 'failed',
+                'error': f'duplicate operation {idempotency_key}',
+                'text': (
+                    f"⚠️ *تمت معالجة هذه العملية مسبقاً!*\n\n"
+                    f"📋 حالة العملية: `{entry['status']}`\n"
+                    f"📞 للاستفسار: @TSA_Support"
+                )
+            }
         
-        # 3. إضافة المبلغ إلى رصيد المستخدم المحلي
-        addition_success = db.update_user_balance(user_id, amount, "add")
+        # 3. سحب المبلغ من حساب Ichancy
+        withdraw_result = api.withdraw(player_id, amount, reference=idempotency_key, snapshot=snapshot)
         
-        if not addition_success:
-            error_msg = f"❌ فشل إضافة المبلغ إلى الرصيد المحلي للمستخدم {user_id}"
-            logger.error(error_msg)
+        if withdraw_result.get('success'):
+            withdrawn = True
+            logger.info(f"✅ تم سحب {amount} NSP من حساب {player_id} على Ichancy")
             
-            # محاولة استرداد المبلغ المسحوب
-            try:
-                recovery_result = api.deposit(player_id, amount)
-                if recovery_result.get('success'):
-                    recovery_msg = "تم استرداد المبلغ إلى حساب Ichancy."
-                else:
-                    recovery_msg = "يرجى الاتصال بالدعم لاسترداد المبلغ."
-            except:
-                recovery_msg = "يرجى الاتصال بالدعم لاسترداد المبلغ."
+            # 4. إضافة المبلغ إلى الرصيد المحلي وإنهاء نية العملية في معاملة واحدة
+            if not db.complete_money_intent(idempotency_key, local_credit=True):
+                error_msg = f"❌ فشل إضافة المبلغ إلى الرصيد المحلي للمستخدم {user_id}"
+                logger.error(error_msg)
+                
+                # تبقى العملية في السجل ليكملها المسترد عند إعادة التشغيل
+                db.mark_money_intent(idempotency_key, 'upstream_applied', error_msg)
+                
+                db.add_transaction({
+                    'user_id': user_id,
+                    'player_id': player_id,
+                    'type': 'withdraw_failed',
+                    'amount': amount,
+                    'status': 'failed',
+                    'error_message': error_msg,
+                    'details': 'فشل إضافة المبلغ إلى الرصيد المحلي - سيتم إكمالها تلقائياً'
+                })
+                
+                return {
+                    'status': 'failed',
+                    'error': error_msg,
+                    'text': (
+                        f"❌ *فشل إضافة المبلغ إلى رصيدك!*\n\n"
+                        f"⚠️ {error_msg}\n\n"
+                        f"🔁 العملية مسجلة وسيتم إضافة المبلغ تلقائياً.\n"
+                        f"📞 للدعم الفوري: @TSA_Support\n"
+                        f"🔧 كود الخطأ: `{user_id[:8]}_LOCAL_BALANCE_FAIL`"
+                    )
+                }
+        else:
+            error_msg = withdraw_result.get('error', 'فشل غير معروف في السحب')
+            logger.error(f"❌ فشل السحب من Ichancy للمستخدم {user_id}: {error_msg}")
             
-            await query.edit_message_text(
-                f"❌ *فشل إضافة المبلغ إلى رصيدك!*\n\n"
-                f"⚠️ {error_msg}\n\n"
-                f"🔁 {recovery_msg}\n"
-                f"📞 للدعم الفوري: @TSA_Support\n"
-                f"🔧 كود الخطأ: `{user_id[:8]}_LOCAL_BALANCE_FAIL`",
-                parse_mode='Markdown'
-            )
+            if withdraw_result.get('ambiguous'):
+                # ربما وصل الطلب رغم فشل الرد: تبقى العملية معلقة حتى تُحسم
+                status_msg = "🔍 نتيجة العملية غير مؤكدة وسيتم مراجعتها قبل إضافة أي مبلغ"
+                resolution = 'pending'
+            elif db.compensate_money_intent(idempotency_key, error_message=error_msg):
+                status_msg = "💡 لم يتم سحب أي مبلغ من حسابك."
+                resolution = 'failed'
+            else:
+                status_msg = "🔍 العملية قيد المراجعة وسيتم حسمها لاحقاً"
+                resolution = 'pending'
             
             db.add_transaction({
                 'user_id': user_id,
@@ -527,38 +653,42 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'amount': amount,
                 'status': 'failed',
                 'error_message': error_msg,
-                'details': f'فشل إضافة المبلغ إلى الرصيد المحلي - {recovery_msg}'
+                'details': f'فشل السحب من Ichancy: {error_msg} ({resolution})'
             })
             
-            # تنظيف حالة المستخدم
-            del withdraw_states[user_id]
-            return
+            return {
+                'status': 'failed',
+                'error': error_msg,
+                'text': (
+                    f"❌ *فشل سحب المبلغ من Ichancy!*\n\n"
+                    f"⚠️ {error_msg}\n\n"
+                    f"{status_msg}\n"
+                    f"📞 للدعم: @TSA_Support\n"
+                    f"🔧 كود الخطأ: `{user_id[:8]}_ICHANCY_WITHDRAW_FAIL`"
+                )
+            }
         
         logger.info(f"✅ تم إضافة {amount} NSP إلى رصيد المستخدم المحلي {user_id}")
         
-        # 4. جلب الرصيد الجديد على Ichancy
-        final_balance_result = api.get_balance(player_id)
+        # 5. الرصيد الجديد على Ichancy مشتق من الفرق، والمطابقة الفعلية تتم في الخلفية
+        result_snapshot = withdraw_result.get('snapshot')
+        new_balance = result_snapshot.balance if result_snapshot else updated_balance - amount
         
-        if final_balance_result.get('success'):
-            new_balance = final_balance_result.get('balance', updated_balance - amount)
-            
-            # تحديث رصيد الحساب في قاعدة البيانات
-            db.update_account_balance(player_id, new_balance)
-            
-            balance_info = f"""
+        # تحديث رصيد الحساب في قاعدة البيانات
+        db.update_account_balance(player_id, new_balance)
+        schedule_balance_reconcile(user_id, player_id, new_balance)
+        
+        balance_info = f"""
 📊 *معلومات الرصيد على Ichancy:*
 • الرصيد السابق: `{updated_balance:.2f}` NSP
 • المبلغ المسحوب: `{amount}` NSP
 • الرصيد الحالي: `{new_balance:.2f}` NSP
-            """
-        else:
-            balance_info = "⚠️ *ملاحظة:* تعذر جلب الرصيد الحالي على Ichancy، يرجى التحقق يدوياً"
-            new_balance = None
+        """
         
-        # 5. جلب الرصيد المحلي الجديد
+        # 6. جلب الرصيد المحلي الجديد
         final_local_balance = db.get_user_balance(user_id)
         
-        # 6. إرسال رسالة النجاح
+        # 7. تجهيز رسالة النجاح
         success_message = f"""
 🎉 *تم السحب بنجاح!*
 
@@ -601,16 +731,8 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🔙 القائمة الرئيسية", callback_data='main_menu')]
         ]
         
-        await query.edit_message_text(
-            success_message,
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        
-        # 7. تسجيل النجاح
-        transaction_details = f'سحب ناجح من حساب {login} (ID: {player_id})'
-        if new_balance is not None:
-            transaction_details += f' - الرصيد الجديد على Ichancy: {new_balance} NSP'
+        # 8. تسجيل النجاح
+        transaction_details = f'سحب ناجح من حساب {login} (ID: {player_id}) - الرصيد الجديد على Ichancy: {new_balance} NSP'
         
         db.add_transaction({
             'user_id': user_id,
@@ -623,8 +745,12 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"✅ تم إتمام سحب كامل للمستخدم {user_id}: {amount} NSP من الحساب {login}")
         
-        # 8. تنظيف حالة المستخدم
-        del withdraw_states[user_id]
+        return {
+            'status': 'done',
+            'text': success_message,
+            'reply_markup': InlineKeyboardMarkup(keyboard),
+            'summary': {'amount': amount, 'player_id': player_id, 'new_balance': new_balance}
+        }
         
     except Exception as e:
         error_msg = f"❌ فشل إتمام السحب للمستخدم {user_id}: {str(e)}"
@@ -635,40 +761,30 @@ async def confirm_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
             error_type='withdraw_final_failed',
             error_message=error_msg,
             stack_trace=traceback.format_exc(),
-            api_endpoint='handlers.withdraw_handler.confirm_withdraw'
+            api_endpoint='handlers.withdraw_handler.run_withdraw_job'
         )
         
-        try:
-            # محاولة استرداد الحالة
-            recovery_msg = ""
-            if user_id in withdraw_states:
-                try:
-                    # التحقق مما إذا تم السحب بالفعل
-                    current_balance = api.get_balance(withdraw_states[user_id].player_id)
-                    if current_balance.get('success'):
-                        balance = current_balance.get('balance', 0)
-                        original_balance = withdraw_states[user_id].current_balance
-                        
-                        if balance < original_balance - 1:  # هامش خطأ
-                            recovery_msg = "⚠️ قد يكون المبلغ قد سُحب بالفعل، يرجى الاتصال بالدعم."
-                except:
-                    pass
-            
-            await query.edit_message_text(
+        # لا نخمن نتيجة السحب: العملية المعلقة تبقى في السجل حتى يحسمها الحسم الدوري
+        recovery_msg = ""
+        if entry is not None and entry.get('is_new'):
+            if withdrawn:
+                # السحب مؤكد: إذا لم يُضف المبلغ محلياً بعد يضيفه الحسم الدوري
+                db.mark_money_intent(idempotency_key, 'upstream_applied', error_msg)
+                recovery_msg = "✅ تم سحب المبلغ من Ichancy وسيُضاف إلى رصيدك، يرجى مراجعة حسابك."
+            else:
+                recovery_msg = "🔍 نتيجة العملية غير مؤكدة وسيتم مراجعتها قبل إضافة أي مبلغ."
+        
+        return {
+            'status': 'failed',
+            'error': error_msg,
+            'text': (
                 f"❌ *حدث خطأ غير متوقع!*\n\n"
                 f"⚠️ {str(e)}\n\n"
                 f"{recovery_msg}\n"
                 f"📞 للدعم الفوري: @TSA_Support\n"
-                f"🔧 كود الخطأ: `{user_id[:8]}_WITHDRAW_FINAL_FAIL`",
-                parse_mode='Markdown'
+                f"🔧 كود الخطأ: `{user_id[:8]}_WITHDRAW_FINAL_FAIL`"
             )
-            
-        except:
-            pass
-        
-        # تنظيف حالة المستخدم في جميع الأحوال
-        if user_id in withdraw_states:
-            del withdraw_states[user_id]
+        }
 
 async def cancel_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """إلغاء عملية السحب"""
@@ -740,28 +856,44 @@ async def quick_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE, amo
             )
             return
         
+        # تسجيل نية السحب قبل إرسالها إلى Ichancy
+        idempotency_key = f"quick_withdraw:{uuid.uuid4().hex}"
+        entry = db.open_money_intent(
+            idempotency_key, None, user_id, ichancy_account['player_id'], 'withdraw', amount,
+            balance_before=current_balance
+        )
+        
+        if entry is None:
+            await update.message.reply_text(
+                "❌ تعذر بدء عملية السحب، لم يتم سحب أي مبلغ.",
+                parse_mode='Markdown'
+            )
+            return
+        
         # سحب المبلغ من Ichancy
-        withdraw_result = api.withdraw(ichancy_account['player_id'], amount)
+        withdraw_result = api.withdraw(ichancy_account['player_id'], amount, reference=idempotency_key)
         
         if not withdraw_result.get('success'):
+            error_msg = withdraw_result.get('error', 'خطأ غير معروف')
+            
+            # الفشل الغامض يبقى معلقاً حتى يُحسم، والفشل المؤكد ينهي العملية
+            if withdraw_result.get('ambiguous') or not db.compensate_money_intent(
+                    idempotency_key, error_message=error_msg):
+                error_msg += "\n🔍 نتيجة العملية غير مؤكدة وسيتم مراجعتها قبل إضافة أي مبلغ"
+            
             await update.message.reply_text(
-                f"❌ فشل السحب: {withdraw_result.get('error', 'خطأ غير معروف')}",
+                f"❌ فشل السحب: {error_msg}",
                 parse_mode='Markdown'
             )
             return
         
-        # إضافة المبلغ إلى الرصيد المحلي
-        addition_success = db.update_user_balance(user_id, amount, "add")
-        
-        if not addition_success:
-            # محاولة استرداد
-            try:
-                api.deposit(ichancy_account['player_id'], amount)
-            except:
-                pass
+        # إضافة المبلغ إلى الرصيد المحلي وإنهاء نية العملية في معاملة واحدة
+        if not db.complete_money_intent(idempotency_key, local_credit=True):
+            # السحب تم على Ichancy، فيضيف الحسم الدوري المبلغ لاحقاً بدلاً من إعادة إيداعه
+            db.mark_money_intent(idempotency_key, 'upstream_applied', 'فشل إضافة المبلغ إلى الرصيد المحلي')
             
             await update.message.reply_text(
-                "❌ فشل إضافة المبلغ إلى الرصيد المحلي! يرجى الاتصال بالدعم.",
+                "⚠️ تم السحب من Ichancy وسيتم إضافة المبلغ إلى رصيدك تلقائياً.",
                 parse_mode='Markdown'
             )
             return
@@ -1030,6 +1162,9 @@ async def withdraw_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
+# تسجيل منفذ السحب في طابور المهام
+job_worker.register('withdraw', run_withdraw_job, priority=RequestPriority.MONEY)
+
 if __name__ == "__main__":
     print("✅ تم تحميل معالج سحب الرصيد بنجاح")
     print("🔍 اختبار دوال التحقق:")
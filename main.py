@@ -19,6 +19,48 @@ from utils.logger import setup_logger
 # إعداد التسجيل
 logger = setup_logger('ichancy_bot')
 
+async def start_background_workers(application):
+    """تشغيل منفذي المهام الخلفية بعد تهيئة البوت"""
+    from workers.job_worker import job_worker
+    from workers.outbox_recovery import outbox_recovery
+    from workers.health_monitor import health_monitor
+    from workers.session_refresher import session_refresher
+    from utils.metrics_server import start_metrics_server
+    from utils.protection_telemetry import protection_telemetry
+    
+    if config.METRICS_PORT:
+        application.bot_data['metrics_server'] = start_metrics_server(config.METRICS_PORT, config.METRICS_HOST)
+    
+    # حسم العمليات المالية المعلقة التي تركتها نسخ متوقفة قبل استقبال مهام جديدة
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, outbox_recovery.recover_pending)
+    
+    await job_worker.start(application.bot)
+    await outbox_recovery.start()
+    await health_monitor.start()
+    await session_refresher.start()
+    await protection_telemetry.start()
+
+async def stop_background_workers(application):
+    """إيقاف منفذي المهام الخلفية عند إيقاف البوت"""
+    from workers.job_worker import job_worker
+    from workers.outbox_recovery import outbox_recovery
+    from workers.health_monitor import health_monitor
+    from workers.session_refresher import session_refresher
+    from utils.protection_telemetry import protection_telemetry
+    from utils.redis_manager import redis_manager
+    await protection_telemetry.stop()
+    await session_refresher.stop()
+    await health_monitor.stop()
+    await outbox_recovery.stop()
+    await job_worker.stop()
+    await redis_manager.aclose()
+    
+    metrics_server = application.bot_data.pop('metrics_server', None)
+    if metrics_server:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+
 async def main():
     """الدالة الرئيسية التشغيلية"""
     
@@ -36,7 +78,7 @@ async def main():
         
         # إنشاء تطبيق التليجرام
         logger.info("🔧 جاري إنشاء تطبيق البوت...")
-        application = ApplicationBuilder().token(config.BOT_TOKEN).build()
+        application = ApplicationBuilder().token(config.BOT_TOKEN).post_init(start_background_workers).post_shutdown(stop_background_workers).build()
         
         # استيراد handlers بعد إنشاء التطبيق
         from handlers import (
@@ -44,7 +86,8 @@ async def main():
             account_handler,
             deposit_handler,
             withdraw_handler,
-            callback_handler
+            callback_handler,
+            admin_handler
         )
         
         # إعداد المعالجات
@@ -70,6 +113,10 @@ async def main():
         # معالجة سحب الرصيد
         application.add_handler(CommandHandler("withdraw", withdraw_handler.withdraw_handler))
         
+        # أوامر المسؤولين: مراجعة العمليات المالية غير المحسومة وحسمها
+        application.add_handler(CommandHandler("review", admin_handler.review_handler))
+        application.add_handler(CommandHandler("settle", admin_handler.settle_handler))
+        
         # معالجة الأزرار (Callback Queries)
         application.add_handler(CallbackQueryHandler(callback_handler.handle_callback))
         
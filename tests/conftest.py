@@ -0,0 +1,59 @@
+# tests/conftest.py
+"""
+إعداد الاختبارات: متغيرات بيئة وهمية، وقاعدة SQLite في مجلد مؤقت بدلاً من مجلد المشروع
+(الإعدادات وقاعدة البيانات تُنشأ عند الاستيراد، فيجب ضبطها قبل أي استيراد من المشروع)
+"""
+
+import os
+import sys
+import tempfile
+import pytest
+
+os.environ.update({
+    'BOT_TOKEN': 'test-token',
+    'AGENT_USERNAME': 'test-agent',
+    'AGENT_PASSWORD': 'test-password',
+    'PARENT_ID': '1',
+    'DATABASE_URL': '',
+    'REDIS_URL': '',
+    'METRICS_PORT': '',
+    'METRICS_HOST': '127.0.0.1',
+    'HUMAN_DELAY_MIN': '0',
+    'HUMAN_DELAY_MAX': '0',
+})
+os.chdir(tempfile.mkdtemp(prefix='ichancy-tests-'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db
+from utils.cache import _caches
+
+@pytest.fixture
+def clean_db():
+    """قاعدة بيانات فارغة لكل اختبار"""
+    with db.get_connection() as conn:
+        with db.get_cursor(conn) as cursor:
+            for table in ('money_outbox', 'balance_holds', 'jobs', 'transactions', 'users'):
+                cursor.execute(f"DELETE FROM {table}")
+    
+    for cache in list(_caches.values()):
+        cache.invalidate_all()
+    return db
+
+@pytest.fixture
+def intent_status(clean_db):
+    """حالة نية العملية المالية وحالة حجزها بالمفتاح (None لما لا يوجد)"""
+    def status(key):
+        with clean_db.get_connection() as conn:
+            with clean_db.get_cursor(conn) as cursor:
+                intent = clean_db._get_money_intent(cursor, key)
+                cursor.execute("SELECT status FROM balance_holds WHERE reference = ?", (key,))
+                hold = cursor.fetchone()
+        return intent['status'] if intent else None, hold['status'] if hold else None
+    return status
+
+@pytest.fixture
+def user(clean_db):
+    """مستخدم برصيد 100 NSP"""
+    clean_db.add_user('1001', 'tester')
+    clean_db.update_user_balance('1001', 100, 'add')
+    return '1001'
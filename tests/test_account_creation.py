@@ -0,0 +1,44 @@
+# tests/test_account_creation.py
+import asyncio
+from types import SimpleNamespace
+import pytest
+from handlers import account_handler
+
+class FakeQuery:
+    def __init__(self, user_id):
+        self.from_user = SimpleNamespace(id=int(user_id))
+        self.message = SimpleNamespace(chat=SimpleNamespace(id=int(user_id)))
+        self.messages = []
+    
+    async def answer(self):
+        pass
+    
+    async def edit_message_text(self, text, **kwargs):
+        self.messages.append(text)
+
+@pytest.fixture
+def creation(user, monkeypatch):
+    state = account_handler.AccountCreationState()
+    state.username, state.password, state.amount = 'player1', 'secret', 30
+    monkeypatch.setitem(account_handler.user_states, user, state)
+    deposits = []
+    monkeypatch.setattr(account_handler.api, 'deposit', lambda *args, **kwargs: deposits.append(args) or {'success': True})
+    return deposits
+
+def test_missing_player_id_releases_the_hold(clean_db, user, creation, intent_status, monkeypatch):
+    monkeypatch.setattr(account_handler.api, 'create_player', lambda username, password: {'success': True, 'player_id': None})
+    query = FakeQuery(user)
+    
+    asyncio.run(account_handler.confirm_account_creation(SimpleNamespace(callback_query=query), None))
+    
+    with clean_db.get_connection() as conn:
+        with clean_db.get_cursor(conn) as cursor:
+            cursor.execute("SELECT idempotency_key FROM money_outbox WHERE user_id = ?", (user,))
+            key = cursor.fetchone()['idempotency_key']
+    
+    assert intent_status(key) == ('compensated', 'released')
+    assert creation == []
+    assert clean_db.get_ichancy_account(user) is None
+    assert clean_db.get_user_balance(user) == 100
+    assert clean_db.get_available_balance(user) == 100
+    assert user not in account_handler.user_states
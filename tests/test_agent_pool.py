@@ -0,0 +1,40 @@
+# tests/test_agent_pool.py
+import pytest
+from api import agent_pool
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """نتيجة قراءة الوكيل المالك من قاعدة البيانات وعدد مرات القراءة"""
+    state = {'result': (False, None), 'calls': 0}
+    
+    def get_account_parent_id(player_id=None, login=None):
+        state['calls'] += 1
+        return state['result']
+    
+    monkeypatch.setattr(agent_pool.db, 'get_account_parent_id', get_account_parent_id)
+    return state
+
+@pytest.fixture
+def pool():
+    return agent_pool.AgentPool([{'username': 'second-agent', 'password': 'x', 'parent_id': '2'}])
+
+def test_saved_owner_is_cached(pool, lookups):
+    lookups['result'] = (True, '2')
+    
+    assert pool.for_player('p1') is pool.agents[1]
+    assert pool.for_player('p1') is pool.agents[1]
+    assert lookups['calls'] == 1
+
+def test_legacy_player_without_parent_is_cached_on_primary(pool, lookups):
+    lookups['result'] = (True, None)
+    
+    assert pool.for_player('p1') is pool.primary
+    assert pool.for_player('p1') is pool.primary
+    assert lookups['calls'] == 1
+
+def test_failed_lookup_is_not_cached(pool, lookups):
+    assert pool.for_player('p1') is pool.primary
+    
+    lookups['result'] = (True, '2')
+    assert pool.for_player('p1') is pool.agents[1]
+    assert lookups['calls'] == 2
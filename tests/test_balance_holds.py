@@ -0,0 +1,88 @@
+# tests/test_balance_holds.py
+
+def test_open_reserves_the_amount(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, balance_before=0, reserve=True)
+    
+    assert intent_status('deposit:1') == ('pending', 'active')
+    assert clean_db.get_user_balance(user) == 100
+    assert clean_db.get_available_balance(user) == 70
+
+def test_duplicate_intent_does_not_reserve_twice(clean_db, user):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert clean_db.get_available_balance(user) == 70
+
+def test_reserve_beyond_available_balance_records_nothing(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 80, reserve=True)
+    
+    assert clean_db.open_money_intent('deposit:2', None, user, 'p1', 'deposit', 30, reserve=True) is None
+    assert intent_status('deposit:2') == (None, None)
+    assert clean_db.get_available_balance(user) == 20
+
+def test_completion_captures_the_hold(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.complete_money_intent('deposit:1')
+    
+    assert intent_status('deposit:1') == ('completed', 'captured')
+    assert clean_db.get_user_balance(user) == 70
+    assert clean_db.get_available_balance(user) == 70
+
+def test_failure_releases_the_hold(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.compensate_money_intent('deposit:1', error_message='rejected')
+    
+    assert intent_status('deposit:1') == ('failed', 'released')
+    assert clean_db.get_user_balance(user) == 100
+    assert clean_db.get_available_balance(user) == 100
+
+def test_hold_is_captured_once(clean_db, user):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.complete_money_intent('deposit:1')
+    clean_db.complete_money_intent('deposit:1')
+    
+    assert clean_db.get_user_balance(user) == 70
+
+def test_review_captures_the_hold(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.mark_money_intent('deposit:1', 'needs_review')
+    
+    assert intent_status('deposit:1') == ('needs_review', 'captured')
+    assert clean_db.get_user_balance(user) == 70
+    assert clean_db.get_available_balance(user) == 70
+
+def test_reviewed_deposit_not_applied_is_refunded(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.mark_money_intent('deposit:1', 'needs_review')
+    
+    assert clean_db.settle_reviewed_money_intent('deposit:1', applied=False)
+    assert not clean_db.settle_reviewed_money_intent('deposit:1', applied=False)
+    assert intent_status('deposit:1') == ('compensated', 'captured')
+    assert clean_db.get_user_balance(user) == 100
+
+def test_reviewed_deposit_applied_keeps_the_debit(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.mark_money_intent('deposit:1', 'needs_review')
+    
+    assert clean_db.settle_reviewed_money_intent('deposit:1', applied=True)
+    assert intent_status('deposit:1') == ('completed', 'captured')
+    assert clean_db.get_user_balance(user) == 70
+
+def test_reviewed_withdraw_is_credited_only_if_applied(clean_db, user, intent_status):
+    clean_db.open_money_intent('withdraw:1', None, user, 'p1', 'withdraw', 25, balance_before=40)
+    clean_db.open_money_intent('withdraw:2', None, user, 'p1', 'withdraw', 25, balance_before=40)
+    clean_db.mark_money_intent('withdraw:1', 'needs_review')
+    clean_db.mark_money_intent('withdraw:2', 'needs_review')
+    
+    assert clean_db.settle_reviewed_money_intent('withdraw:1', applied=True)
+    assert clean_db.settle_reviewed_money_intent('withdraw:2', applied=False)
+    assert intent_status('withdraw:1') == ('completed', None)
+    assert intent_status('withdraw:2') == ('failed', None)
+    assert clean_db.get_user_balance(user) == 125
+
+def test_only_reviewed_intents_are_settled_by_review(clean_db, user):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert not clean_db.settle_reviewed_money_intent('deposit:1', applied=False)
+    assert not clean_db.settle_reviewed_money_intent('missing', applied=True)
+    assert clean_db.get_available_balance(user) == 70
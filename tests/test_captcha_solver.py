@@ -0,0 +1,57 @@
+# tests/test_captcha_solver.py
+import time
+import asyncio
+import threading
+import pytest
+from api.captcha_solver import CaptchaSolver
+from api.egress_pool import Egress
+
+@pytest.fixture
+def solver(monkeypatch):
+    """محلل لا يرسل طلبات: المحاولة الأولى تفشل والتالية تنجح بعد انتظار قصير"""
+    solver = CaptchaSolver()
+    monkeypatch.setattr(solver, '_start_bypass', lambda max_retries: None)
+    monkeypatch.setattr(solver, '_retry_wait', lambda attempt: 0.5 if attempt else 0.0)
+    monkeypatch.setattr(solver, '_human_like_delay', lambda *args: None)
+    monkeypatch.setattr(solver, '_fetch_for_bypass', lambda url, attempt, egress: attempt)
+    monkeypatch.setattr(solver, '_evaluate_bypass_response',
+                        lambda url, attempt, *args: (attempt, 'ok') if attempt else None)
+    
+    async def no_delay(*args):
+        pass
+    monkeypatch.setattr(solver, '_human_like_delay_async', no_delay)
+    return solver
+
+def test_async_bypass_wait_does_not_block_sync_callers(solver):
+    egress = Egress()
+    finished = {}
+    
+    def sync_bypass():
+        solver.bypass_cloudflare('https://example.test', max_retries=1, egress=egress)
+        finished['sync'] = time.monotonic()
+    
+    async def scenario():
+        bypass = asyncio.ensure_future(solver.bypass_cloudflare_async('https://example.test', egress=egress))
+        await asyncio.sleep(0.1)    # المحاولة الأولى انتهت والمحاولة غير المتزامنة تنتظر قبل الثانية
+        thread = threading.Thread(target=sync_bypass)
+        thread.start()
+        result = await bypass
+        finished['async'] = time.monotonic()
+        thread.join()
+        return result
+    
+    assert asyncio.run(scenario()) == (1, 'ok')
+    assert finished['sync'] < finished['async']
+
+def test_concurrent_async_bypasses_share_one_attempt(solver):
+    calls = []
+    solver._fetch_for_bypass = lambda url, attempt, egress: calls.append(attempt) or attempt
+    egress = Egress()
+    
+    async def scenario():
+        return await asyncio.gather(*(
+            solver.bypass_cloudflare_async('https://example.test', egress=egress) for _ in range(3)
+        ))
+    
+    assert asyncio.run(scenario()) == [(1, 'ok')] * 3
+    assert calls == [0, 1]
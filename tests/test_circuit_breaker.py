@@ -0,0 +1,68 @@
+# tests/test_circuit_breaker.py
+import pytest
+from api.circuit_breaker import CircuitBreaker
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker('test', failure_threshold=3, recovery_timeout=30)
+
+def _open(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure('HTTP 503')
+
+def _cool_down(breaker):
+    """انتهاء فترة التهدئة دون انتظارها"""
+    breaker.opened_at -= breaker.recovery_timeout
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow_request()
+    
+    breaker.record_failure('HTTP 503')
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert 0 < breaker.retry_in() <= 30
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_half_open_allows_one_trial_request(breaker):
+    _open(breaker)
+    _cool_down(breaker)
+    
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request()
+
+def test_successful_trial_closes(breaker):
+    _open(breaker)
+    _cool_down(breaker)
+    breaker.allow_request()
+    breaker.record_success()
+    
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+
+def test_failed_trial_reopens(breaker):
+    _open(breaker)
+    _cool_down(breaker)
+    breaker.allow_request()
+    breaker.record_failure('timeout')
+    
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.snapshot()['last_error'] == 'timeout'
+
+def test_release_frees_the_trial_slot(breaker):
+    _open(breaker)
+    _cool_down(breaker)
+    breaker.allow_request()
+    breaker.release()
+    
+    assert breaker.allow_request()
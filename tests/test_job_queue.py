@@ -0,0 +1,56 @@
+# tests/test_job_queue.py
+from datetime import datetime, timedelta
+
+def _expire_lease(db, job_id):
+    """منفذ توقف عن تجديد حجزه"""
+    with db.get_connection() as conn:
+        with db.get_cursor(conn) as cursor:
+            cursor.execute("UPDATE jobs SET lease_expires_at = ? WHERE id = ?",
+                           (datetime.now() - timedelta(seconds=1), job_id))
+
+def test_claim_leases_the_oldest_job(clean_db):
+    first = clean_db.enqueue_job('deposit', '1001', {'amount': 10})
+    clean_db.enqueue_job('deposit', '1001', {'amount': 20})
+    
+    job = clean_db.claim_next_job('worker-a')
+    
+    assert job['id'] == first and job['status'] == 'running'
+    assert job['worker_id'] == 'worker-a' and job['lease_expires_at']
+    assert job['payload'] == {'amount': 10}
+
+def test_claim_skips_running_jobs(clean_db):
+    clean_db.enqueue_job('deposit', '1001', {})
+    clean_db.claim_next_job('worker-a')
+    
+    assert clean_db.claim_next_job('worker-b') is None
+
+def test_live_leases_are_not_recovered(clean_db):
+    clean_db.enqueue_job('deposit', '1001', {})
+    clean_db.claim_next_job('worker-a')
+    
+    assert clean_db.recover_interrupted_jobs() == []
+
+def test_expired_leases_are_recovered_once(clean_db):
+    job_id = clean_db.enqueue_job('deposit', '1001', {})
+    clean_db.claim_next_job('worker-a')
+    _expire_lease(clean_db, job_id)
+    
+    assert [job['id'] for job in clean_db.recover_interrupted_jobs()] == [job_id]
+    assert clean_db.recover_interrupted_jobs() == []
+
+def test_renewal_keeps_the_job_with_its_worker(clean_db):
+    job_id = clean_db.enqueue_job('deposit', '1001', {})
+    clean_db.claim_next_job('worker-a')
+    _expire_lease(clean_db, job_id)
+    
+    assert clean_db.renew_job_leases('worker-b') == 0
+    assert clean_db.renew_job_leases('worker-a') == 1
+    assert clean_db.recover_interrupted_jobs() == []
+
+def test_finished_jobs_are_not_recovered(clean_db):
+    job_id = clean_db.enqueue_job('deposit', '1001', {})
+    clean_db.claim_next_job('worker-a')
+    
+    assert clean_db.finish_job(job_id, 'completed', 'ok')
+    assert clean_db.renew_job_leases('worker-a') == 0
+    assert clean_db.recover_interrupted_jobs() == []
@@ -0,0 +1,23 @@
+# tests/test_metrics_exposure.py
+from config import config
+from api.agent_pool import api
+from utils.metrics import metrics
+from utils.metrics_server import start_metrics_server
+
+def test_metrics_server_is_off_and_local_by_default():
+    assert config.METRICS_PORT == 0
+    assert config.METRICS_HOST == '127.0.0.1'
+
+def test_agent_usernames_are_not_metric_labels():
+    rendered = metrics.render()
+    
+    assert f'agent="{api.primary.parent_id}"' in rendered
+    assert config.AGENT_USERNAME not in rendered
+
+def test_metrics_server_binds_locally():
+    server = start_metrics_server(0)
+    try:
+        assert server.server_address[0] == '127.0.0.1'
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,84 @@
+# tests/test_money_outbox.py
+from datetime import datetime, timedelta
+
+def test_open_is_idempotent(clean_db, user):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    again = clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert not again['is_new']
+    assert clean_db.get_available_balance(user) == 70
+
+def test_complete_settles_once(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert clean_db.complete_money_intent('deposit:1')
+    assert not clean_db.complete_money_intent('deposit:1')
+    assert not clean_db.compensate_money_intent('deposit:1', local_refund=True)
+    assert intent_status('deposit:1') == ('completed', 'captured')
+    assert clean_db.get_user_balance(user) == 70
+    assert clean_db.get_available_balance(user) == 70
+
+def test_compensate_settles_once(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert clean_db.compensate_money_intent('deposit:1', error_message='rejected')
+    assert not clean_db.complete_money_intent('deposit:1')
+    assert intent_status('deposit:1') == ('failed', 'released')
+    assert clean_db.get_available_balance(user) == 100
+
+def test_compensate_with_local_refund(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert clean_db.compensate_money_intent('deposit:1', local_refund=True)
+    assert intent_status('deposit:1') == ('compensated', 'released')
+
+def test_complete_withdraw_credits_the_user(clean_db, user):
+    clean_db.open_money_intent('withdraw:1', None, user, 'p1', 'withdraw', 25, balance_before=40)
+    
+    assert clean_db.complete_money_intent('withdraw:1', local_credit=True)
+    assert not clean_db.complete_money_intent('withdraw:1', local_credit=True)
+    assert clean_db.get_user_balance(user) == 125
+
+def test_upstream_applied_can_still_be_completed(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert clean_db.mark_money_intent('deposit:1', 'upstream_applied')
+    assert clean_db.complete_money_intent('deposit:1')
+    assert intent_status('deposit:1') == ('completed', 'captured')
+
+def test_needs_review_is_not_settled(clean_db, user, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert clean_db.mark_money_intent('deposit:1', 'needs_review')
+    assert not clean_db.complete_money_intent('deposit:1')
+    assert not clean_db.compensate_money_intent('deposit:1')
+    assert not clean_db.mark_money_intent('deposit:1', 'upstream_applied')
+    assert intent_status('deposit:1') == ('needs_review', 'captured')
+
+def test_unknown_intent_is_not_settled(clean_db):
+    assert not clean_db.complete_money_intent('missing')
+    assert not clean_db.compensate_money_intent('missing')
+
+def test_pending_intents_respect_grace_period_and_live_jobs(clean_db, user):
+    clean_db.open_money_intent('fresh', None, user, 'p1', 'deposit', 10, reserve=True)
+    clean_db.open_money_intent('applied', None, user, 'p1', 'withdraw', 10)
+    clean_db.mark_money_intent('applied', 'upstream_applied')
+    
+    # المعلقة تنتظر مهلة السماح، والمؤكدة على Ichancy تُحسم فوراً
+    assert [e['idempotency_key'] for e in clean_db.get_pending_money_intents(600)] == ['applied']
+    assert [e['idempotency_key'] for e in clean_db.get_pending_money_intents(0)] == ['fresh', 'applied']
+
+def test_pending_intents_skip_jobs_with_live_leases(clean_db, user):
+    job_id = clean_db.enqueue_job('deposit', user, {})
+    clean_db.claim_next_job('worker-a')
+    clean_db.open_money_intent('job', job_id, user, 'p1', 'deposit', 10, reserve=True)
+    
+    assert clean_db.get_pending_money_intents(0) == []
+    
+    # منفذ توقف عن تجديد حجزه
+    with clean_db.get_connection() as conn:
+        with clean_db.get_cursor(conn) as cursor:
+            cursor.execute("UPDATE jobs SET lease_expires_at = ? WHERE id = ?",
+                           (datetime.now() - timedelta(seconds=1), job_id))
+    
+    assert [e['idempotency_key'] for e in clean_db.get_pending_money_intents(0)] == ['job']
@@ -0,0 +1,116 @@
+# tests/test_outbox_recovery.py
+import pytest
+from workers import outbox_recovery
+from workers.outbox_recovery import MoneyOutboxRecovery
+
+@pytest.fixture
+def recovery():
+    recovery = MoneyOutboxRecovery()
+    recovery.grace_period = 0
+    return recovery
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """نتيجة التحقق من الرصيد على Ichancy (True طُبقت، False لم تُطبق، None تعذر الحكم) مع تسجيل الاستدعاءات"""
+    calls = []
+    
+    def write_applied(player_id, balance_before, change):
+        calls.append((player_id, balance_before, change))
+        return upstream.applied
+    
+    upstream.applied = None
+    upstream.calls = calls
+    monkeypatch.setattr(outbox_recovery.api, 'write_applied', write_applied)
+    return upstream
+
+def _intent(db, key):
+    with db.get_connection() as conn:
+        with db.get_cursor(conn) as cursor:
+            return db._get_money_intent(cursor, key)
+
+def test_upstream_applied_withdraw_is_completed_with_credit(clean_db, user, recovery):
+    clean_db.open_money_intent('withdraw:1', None, user, 'p1', 'withdraw', 25)
+    clean_db.mark_money_intent('withdraw:1', 'upstream_applied')
+    
+    assert recovery.recover_pending() == {'completed': 1}
+    assert _intent(clean_db, 'withdraw:1')['status'] == 'completed'
+    assert clean_db.get_user_balance(user) == 125
+
+def test_upstream_applied_deposit_captures_the_hold(clean_db, user, recovery):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    clean_db.mark_money_intent('deposit:1', 'upstream_applied')
+    
+    assert recovery.recover_pending() == {'completed': 1}
+    assert clean_db.get_user_balance(user) == 70
+
+def test_intent_without_balance_before_goes_to_review(clean_db, user, recovery, upstream):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert recovery.recover_pending() == {'needs_review': 1}
+    assert upstream.calls == []
+    assert _intent(clean_db, 'deposit:1')['status'] == 'needs_review'
+    assert clean_db.get_available_balance(user) == 70
+    
+    # لا يُعاد حسمها في الجولة التالية
+    assert recovery.recover_pending() == {}
+
+def test_recent_pending_intents_wait_for_grace_period(clean_db, user, recovery):
+    recovery.grace_period = 600
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    
+    assert recovery.recover_pending() == {}
+    assert _intent(clean_db, 'deposit:1')['status'] == 'pending'
+
+def test_intent_settled_meanwhile_is_left_alone(clean_db, user, recovery):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, reserve=True)
+    entry = _intent(clean_db, 'deposit:1')
+    clean_db.complete_money_intent('deposit:1')
+    
+    assert recovery.resolve(entry) == 'pending'
+    assert _intent(clean_db, 'deposit:1')['status'] == 'completed'
+
+def test_unchanged_balance_compensates_a_deposit(clean_db, user, recovery, upstream, intent_status):
+    upstream.applied = False
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, balance_before=5, reserve=True)
+    
+    assert recovery.recover_pending() == {'compensated': 1}
+    assert upstream.calls == [('p1', 5.0, 30.0)]
+    assert intent_status('deposit:1') == ('compensated', 'released')
+    assert clean_db.get_available_balance(user) == 100
+
+def test_matching_balance_completes_a_deposit(clean_db, user, recovery, upstream, intent_status):
+    upstream.applied = True
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, balance_before=5, reserve=True)
+    
+    assert recovery.recover_pending() == {'completed': 1}
+    assert intent_status('deposit:1') == ('completed', 'captured')
+    assert clean_db.get_user_balance(user) == 70
+
+def test_withdraw_is_checked_against_a_lower_balance(clean_db, user, recovery, upstream):
+    upstream.applied = True
+    clean_db.open_money_intent('withdraw:1', None, user, 'p1', 'withdraw', 25, balance_before=40)
+    
+    assert recovery.recover_pending() == {'completed': 1}
+    assert upstream.calls == [('p1', 40.0, -25.0)]
+    assert clean_db.get_user_balance(user) == 125
+
+def test_unchanged_balance_fails_a_withdraw(clean_db, user, recovery, upstream):
+    upstream.applied = False
+    clean_db.open_money_intent('withdraw:1', None, user, 'p1', 'withdraw', 25, balance_before=40)
+    
+    assert recovery.recover_pending() == {'failed': 1}
+    assert clean_db.get_user_balance(user) == 100
+
+def test_undecided_balance_goes_to_review(clean_db, user, recovery, upstream, intent_status):
+    clean_db.open_money_intent('deposit:1', None, user, 'p1', 'deposit', 30, balance_before=5, reserve=True)
+    
+    assert recovery.recover_pending() == {'needs_review': 1}
+    assert intent_status('deposit:1') == ('needs_review', 'captured')
+    assert [e['idempotency_key'] for e in clean_db.get_money_intents_for_review()] == ['deposit:1']
+
+@pytest.mark.parametrize('balance, applied', [(5, False), (35, True), (50, None), (None, None)])
+def test_write_applied_compares_a_fresh_balance(monkeypatch, balance, applied):
+    agent = outbox_recovery.api.primary
+    monkeypatch.setattr(agent, '_fresh_balance', lambda player_id: balance)
+    
+    assert agent.write_applied('p1', 5, 30) is applied
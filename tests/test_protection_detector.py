@@ -0,0 +1,36 @@
+# tests/test_protection_detector.py
+import pytest
+import requests
+from api.protection_detector import ProtectionDetector
+from api.ichancy_api import CLEARABLE_PROTECTIONS
+
+CHALLENGE_PAGE = b'<html><head><title>Just a moment...</title></head><body><div id="challenge-form">cloudflare</div></body></html>'
+BLOCK_PAGE = b'<html><body><h1>Access denied</h1><p>Error 1020 - cloudflare</p></body></html>'
+
+def _response(status_code, body, content_type='text/html', **headers):
+    """رد مبني محلياً (محمل كاملاً كما في الطلب دون stream)"""
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    response.headers.update({'Content-Type': content_type, 'cf-ray': '8a1b2c3d4e5f-FRA', **headers})
+    return response
+
+@pytest.mark.parametrize('response, protection_type', [
+    (_response(403, CHALLENGE_PAGE), 'cloudflare'),
+    (_response(403, b'', 'text/plain', **{'cf-mitigated': 'challenge'}), 'cloudflare'),
+    (_response(403, BLOCK_PAGE), 'access_denied'),
+    (_response(403, b'{"error": "Invalid session"}', 'application/json'), 'access_denied'),
+    (_response(403, b'{"error": "security verification failed"}', 'application/json'), 'access_denied'),
+    (_response(429, b'{"error": "too many requests"}', 'application/json'), 'rate_limit'),
+    (_response(503, b'{"error": "maintenance"}', 'application/json'), 'unknown'),
+])
+def test_only_challenges_are_clearable(response, protection_type):
+    signal = ProtectionDetector().inspect(response)
+    
+    assert signal.type == protection_type
+    assert (signal.type in CLEARABLE_PROTECTIONS) == (protection_type == 'cloudflare')
+
+def test_html_is_recognized_without_content_type():
+    response = _response(403, b'\n  ' + CHALLENGE_PAGE, '')
+    
+    assert ProtectionDetector().inspect(response).type == 'cloudflare'
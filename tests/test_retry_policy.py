@@ -0,0 +1,80 @@
+# tests/test_retry_policy.py
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+from api.retry_policy import RetryPolicy, RetryBudget, request_not_sent, policy_for, RETRY, VERIFY, STOP
+
+def _not_sent_error():
+    """فشل فتح الاتصال: الطلب لم يصل إلى الخادم"""
+    return requests.exceptions.ConnectionError(MaxRetryError(None, '/', NewConnectionError(None, 'refused')))
+
+READ = RetryPolicy(max_attempts=3)
+WRITE = RetryPolicy(max_attempts=3, idempotent=False)
+
+@pytest.mark.parametrize('policy, status_code, error, decision', [
+    (READ, 200, None, STOP),
+    (READ, 404, None, STOP),
+    (READ, 429, None, RETRY),
+    (READ, 500, None, RETRY),
+    (READ, 503, None, RETRY),
+    (READ, None, requests.exceptions.ReadTimeout(), RETRY),
+    (WRITE, 200, None, STOP),
+    (WRITE, 400, None, STOP),
+    (WRITE, 429, None, RETRY),
+    (WRITE, 502, None, VERIFY),
+    (WRITE, None, requests.exceptions.ReadTimeout(), VERIFY),
+    (WRITE, None, requests.exceptions.ConnectionError('reset'), VERIFY),
+    (WRITE, None, requests.exceptions.ConnectTimeout(), RETRY),
+    (WRITE, None, _not_sent_error(), RETRY),
+])
+def test_decision_table(policy, status_code, error, decision):
+    assert policy.decide(1, status_code, error) == decision
+
+def test_last_attempt_stops():
+    assert READ.decide(3, 503) == STOP
+    assert WRITE.decide(3, None, requests.exceptions.ConnectTimeout()) == STOP
+
+def test_money_writes_are_not_idempotent():
+    assert not policy_for('deposit').idempotent
+    assert not policy_for('withdraw').idempotent
+    assert not policy_for('unknown').idempotent
+    assert policy_for('balance').idempotent
+
+def test_request_not_sent():
+    assert request_not_sent(requests.exceptions.ConnectTimeout())
+    assert request_not_sent(_not_sent_error())
+    assert not request_not_sent(requests.exceptions.ReadTimeout())
+    assert not request_not_sent(requests.exceptions.ConnectionError('reset'))
+
+def test_backoff_is_capped():
+    policy = RetryPolicy(backoff_base=1, backoff_max=2)
+    assert all(0 <= policy.backoff(attempt) <= 2 for attempt in range(1, 10))
+
+def test_budget_is_exhausted_then_refilled_by_requests():
+    budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+    
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    assert budget.exhausted == 1
+    
+    budget.record_request()
+    assert not budget.try_spend()
+    budget.record_request()
+    assert budget.try_spend()
+
+def test_budget_refills_over_time():
+    budget = RetryBudget(ratio=0, min_per_second=1, max_tokens=1)
+    
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    
+    budget.updated_at -= 1
+    assert budget.try_spend()
+
+def test_budget_is_capped():
+    budget = RetryBudget(ratio=1, min_per_second=0, max_tokens=2)
+    
+    for _ in range(10):
+        budget.record_request()
+    
+    assert budget.tokens == 2
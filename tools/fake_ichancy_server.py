@@ -0,0 +1,415 @@
+# tools/fake_ichancy_server.py
+"""
+خادم محلي يحاكي واجهة وكيل Ichancy لاختبارات التحميل والتكامل
+
+التشغيل:
+    python -m tools.fake_ichancy_server --port 8765 --latency uniform:0.05,0.2 --error-rate 0.01
+
+ثم توجيه البوت إليه:
+    ICHANCY_ORIGIN=http://127.0.0.1:8765 HUMAN_DELAY_MIN=0 HUMAN_DELAY_MAX=0 python main.py
+"""
+
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class LatencyModel:
+    """توزيع زمن الاستجابة: fixed:S أو uniform:A,B أو lognormal:MU,SIGMA"""
+    
+    def __init__(self, spec: str = "fixed:0"):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",") if value]
+        
+        if kind == "fixed":
+            self._sample = lambda: values[0] if values else 0.0
+        elif kind == "uniform":
+            self._sample = lambda: random.uniform(values[0], values[1])
+        elif kind == "lognormal":
+            self._sample = lambda: random.lognormvariate(values[0], values[1])
+        else:
+            raise ValueError(f"توزيع غير معروف: {spec}")
+    
+    def sample(self) -> float:
+        """زمن استجابة عشوائي بالثواني"""
+        return max(0.0, self._sample())
+
+class FakeServerSettings:
+    """إعدادات سلوك الخادم المحلي"""
+    
+    def __init__(self, latency: str = "fixed:0", error_rate: float = 0.0,
+                 session_ttl: float = 0, rate_limit: float = 0, burst_size: int = 0,
+                 burst_every: float = 0, burst_duration: float = 0,
+                 agent_username: str = "", agent_password: str = "",
+                 echo_player_id: bool = False, initial_player_balance: float = 0,
+                 clearance_ttl: float = 0):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate                  # نسبة أخطاء 500 العشوائية
+        self.session_ttl = session_ttl                # عمر الجلسة قبل 401 (0 = بلا انتهاء)
+        self.rate_limit = rate_limit                  # طلبات/ثانية قبل 429 (0 = بلا حد)
+        self.burst_size = burst_size or max(1, int(rate_limit))
+        self.burst_every = burst_every                # فترة نوبات 429 القسرية
+        self.burst_duration = burst_duration          # مدة كل نوبة 429
+        self.agent_username = agent_username          # فارغ = قبول أي بيانات
+        self.agent_password = agent_password
+        self.echo_player_id = echo_player_id          # إرجاع playerId في رد التسجيل
+        self.initial_player_balance = initial_player_balance
+        self.clearance_ttl = clearance_ttl            # صفحة تحدٍّ بدون كوكي cf_clearance صالح (0 = بلا حماية)
+
+class FakeIchancyState:
+    """الحالة في الذاكرة: اللاعبون والجلسات والعدادات"""
+    
+    def __init__(self, settings: FakeServerSettings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.players: Dict[str, Dict] = {}
+        self.player_ids_by_login: Dict[str, str] = {}
+        self.sessions: Dict[str, float] = {}
+        self.clearances: Dict[str, Tuple[float, Optional[str]]] = {}
+        self.next_player_id = 100000
+        self.started_at = time.time()
+        self.tokens = float(settings.burst_size)
+        self.tokens_updated_at = time.time()
+        self.stats = {'requests': {}, 'status_codes': {}}
+    
+    def reset(self):
+        """مسح جميع البيانات والعدادات"""
+        with self.lock:
+            self.players.clear()
+            self.player_ids_by_login.clear()
+            self.sessions.clear()
+            self.clearances.clear()
+            self.stats = {'requests': {}, 'status_codes': {}}
+    
+    def record(self, endpoint: str, status: int):
+        """تسجيل طلب في العدادات"""
+        with self.lock:
+            requests_count = self.stats['requests']
+            status_count = self.stats['status_codes']
+            requests_count[endpoint] = requests_count.get(endpoint, 0) + 1
+            status_count[str(status)] = status_count.get(str(status), 0) + 1
+    
+    def rate_limited(self) -> bool:
+        """هل يجب رفض الطلب بـ 429 (حد المعدل أو نوبة قسرية)"""
+        settings = self.settings
+        now = time.time()
+        
+        if settings.burst_every and settings.burst_duration:
+            if (now - self.started_at) % settings.burst_every < settings.burst_duration:
+                return True
+        
+        if not settings.rate_limit:
+            return False
+        
+        with self.lock:
+            elapsed = now - self.tokens_updated_at
+            self.tokens = min(settings.burst_size, self.tokens + elapsed * settings.rate_limit)
+            self.tokens_updated_at = now
+            
+            if self.tokens < 1:
+                return True
+            
+            self.tokens -= 1
+            return False
+    
+    def open_session(self) -> str:
+        """إنشاء جلسة جديدة وإرجاع رمزها"""
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[token] = time.time()
+        return token
+    
+    def session_valid(self, token: Optional[str]) -> bool:
+        """التحقق من صلاحية رمز الجلسة"""
+        with self.lock:
+            created_at = self.sessions.get(token) if token else None
+        
+        if created_at is None:
+            return False
+        
+        ttl = self.settings.session_ttl
+        return not ttl or time.time() - created_at < ttl
+    
+    def open_clearance(self, egress: Optional[str] = None) -> str:
+        """إصدار كوكي تصريح بعد "اجتياز" صفحة التحدي (مرتبط بالمخرج كما يرتبط Cloudflare بالعنوان)"""
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.clearances[token] = (time.time(), egress)
+        return token
+    
+    def clearance_valid(self, token: Optional[str], egress: Optional[str] = None) -> bool:
+        """هل الطلب يحمل تصريحاً صالحاً صدر لنفس المخرج (دائماً صحيح عند تعطيل الحماية)"""
+        ttl = self.settings.clearance_ttl
+        if not ttl:
+            return True
+        
+        with self.lock:
+            issued = self.clearances.get(token) if token else None
+        
+        return issued is not None and issued[1] == egress and time.time() - issued[0] < ttl
+
+# صفحة تحدٍّ مبسطة بعلامات Cloudflare المعتادة
+CHALLENGE_PAGE = (
+    "<!DOCTYPE html><html><head><title>Just a moment...</title></head>"
+    "<body><div id=\"challenge-form\">Checking your browser before accessing. "
+    "Performance &amp; security by Cloudflare</div></body></html>"
+)
+
+class FakeIchancyHandler(BaseHTTPRequestHandler):
+    """معالج طلبات واجهة الوكيل المحاكاة"""
+    
+    protocol_version = "HTTP/1.1"
+    state: FakeIchancyState = None
+    
+    ROUTES = {
+        "/global/api/User/signIn": "signin",
+        "/global/api/Player/registerPlayer": "create_player",
+        "/global/api/Statistics/getPlayersStatisticsPro": "statistics",
+        "/global/api/Player/depositToPlayer": "deposit",
+        "/global/api/Player/withdrawFromPlayer": "withdraw",
+        "/global/api/Player/getPlayerBalanceById": "balance",
+    }
+    
+    def log_message(self, format, *args):
+        logger.debug("🧪 " + format % args)
+    
+    def do_GET(self):
+        if self.path == "/__stats":
+            with self.state.lock:
+                body = dict(self.state.stats, players=len(self.state.players))
+            self._send(200, body)
+        elif self.path == "/" and self.state.settings.clearance_ttl:
+            # الصفحة الرئيسية تمنح التصريح مباشرة (بديل عن حل التحدي)
+            token = self.state.open_clearance(self._egress())
+            self.state.record("clearance", 200)
+            self._send_html(200, "<html><body>ok</body></html>",
+                            f"cf_clearance={token}; Max-Age={int(self.state.settings.clearance_ttl)}; Path=/")
+        else:
+            self._send(404, {"error": "not found"})
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        
+        if self.path == "/__reset":
+            self.state.reset()
+            self._send(200, {"result": True})
+            return
+        
+        endpoint = self.ROUTES.get(self.path)
+        if endpoint is None:
+            self._send(404, {"error": "not found"})
+            return
+        
+        try:
+            payload = json.loads(raw or b"{}")
+        except ValueError:
+            payload = {}
+        
+        time.sleep(self.state.settings.latency.sample())
+        
+        if not self.state.clearance_valid(self._cookie("cf_clearance"), self._egress()):
+            self.state.record(endpoint, 403)
+            self._send_html(403, CHALLENGE_PAGE)
+            return
+        
+        status, body, cookie = self._dispatch(endpoint, payload)
+        self.state.record(endpoint, status)
+        self._send(status, body, cookie)
+    
+    def _dispatch(self, endpoint: str, payload: Dict) -> Tuple[int, Dict, Optional[str]]:
+        """توجيه الطلب بعد تطبيق حد المعدل والأخطاء والجلسة"""
+        state = self.state
+        
+        if state.rate_limited():
+            return 429, {"error": "Too Many Requests"}, None
+        
+        if random.random() < state.settings.error_rate:
+            return 500, {"error": "Internal Server Error"}, None
+        
+        if endpoint == "signin":
+            return self._sign_in(payload)
+        
+        if not state.session_valid(self._session_token()):
+            return 401, {"error": "Unauthorized"}, None
+        
+        handler = getattr(self, f"_{endpoint}")
+        status, body = handler(payload)
+        return status, body, None
+    
+    def _session_token(self) -> Optional[str]:
+        return self._cookie("token")
+    
+    def _egress(self) -> Optional[str]:
+        # البروكسي المحلي (tools/stand_in_proxy.py) يعرّف نفسه برأس Via بدلاً من عنوان مختلف
+        return self.headers.get("Via")
+    
+    def _cookie(self, name: str) -> Optional[str]:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        morsel = cookie.get(name)
+        return morsel.value if morsel else None
+    
+    def _sign_in(self, payload: Dict):
+        settings = self.state.settings
+        if settings.agent_username and (
+            payload.get("username") != settings.agent_username
+            or payload.get("password") != settings.agent_password
+        ):
+            return 200, {"result": False, "error": "Invalid login or password"}, None
+        
+        token = self.state.open_session()
+        max_age = f"; Max-Age={int(settings.session_ttl)}" if settings.session_ttl else ""
+        return 200, {"result": True}, f"token={token}; Path=/{max_age}"
+    
+    def _create_player(self, payload: Dict):
+        player = payload.get("player") or {}
+        login = player.get("login")
+        if not login:
+            return 200, {"result": False, "error": "invalid player data"}
+        
+        with self.state.lock:
+            if login in self.state.player_ids_by_login:
+                return 200, {"result": False, "error": "Player already exists"}
+            
+            self.state.next_player_id += 1
+            player_id = str(self.state.next_player_id)
+            self.state.player_ids_by_login[login] = player_id
+            self.state.players[player_id] = {
+                "login": login,
+                "email": player.get("email"),
+                "balance": float(self.state.settings.initial_player_balance)
+            }
+        
+        if self.state.settings.echo_player_id:
+            return 200, {"result": {"playerId": player_id}}
+        return 200, {"result": True}
+    
+    def _statistics(self, payload: Dict):
+        login = (payload.get("filter") or {}).get("login")
+        page_size = int(payload.get("pageSize") or 20)
+        
+        with self.state.lock:
+            records = [
+                {"username": data["login"], "playerId": player_id, "balance": data["balance"]}
+                for player_id, data in self.state.players.items()
+                if not login or data["login"] == login
+            ]
+        
+        return 200, {"result": {"records": records[:page_size], "totalCount": len(records)}}
+    
+    def _deposit(self, payload: Dict):
+        return self._move_money(payload.get("playerId"), float(payload.get("amount") or 0))
+    
+    def _withdraw(self, payload: Dict):
+        # السحب يصل بمبلغ سالب
+        return self._move_money(payload.get("playerId"), -abs(float(payload.get("amount") or 0)))
+    
+    def _move_money(self, player_id: Optional[str], delta: float):
+        with self.state.lock:
+            player = self.state.players.get(str(player_id))
+            if player is None:
+                return 200, {"result": False, "error": "Player not found"}
+            
+            if player["balance"] + delta < 0:
+                return 200, {"result": False, "error": "insufficient balance"}
+            
+            player["balance"] = round(player["balance"] + delta, 2)
+        
+        return 200, {"result": True}
+    
+    def _balance(self, payload: Dict):
+        with self.state.lock:
+            player = self.state.players.get(str(payload.get("playerId")))
+            if player is None:
+                return 200, {"result": False, "error": "Player not found"}
+            balance = player["balance"]
+        
+        return 200, {"result": [{"balance": balance}]}
+    
+    def _send(self, status: int, body: Dict, cookie: Optional[str] = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _send_html(self, status: int, html: str, cookie: Optional[str] = None):
+        data = html.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("CF-RAY", uuid.uuid4().hex[:16] + "-FRA")
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_fake_server(host: str = "127.0.0.1", port: int = 0,
+                      settings: FakeServerSettings = None) -> Tuple[ThreadingHTTPServer, FakeIchancyState]:
+    """تشغيل الخادم في خيط خلفي (للاستخدام داخل نفس العملية)"""
+    state = FakeIchancyState(settings or FakeServerSettings())
+    handler = type("BoundFakeIchancyHandler", (FakeIchancyHandler,), {"state": state})
+    
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    logger.info(f"🧪 خادم Ichancy المحلي يعمل على http://{host}:{server.server_address[1]}")
+    return server, state
+
+def main():
+    parser = argparse.ArgumentParser(description="خادم Ichancy محلي للاختبار")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:A,B | lognormal:MU,SIGMA")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--session-ttl", type=float, default=0)
+    parser.add_argument("--rate-limit", type=float, default=0)
+    parser.add_argument("--burst-size", type=int, default=0)
+    parser.add_argument("--burst-every", type=float, default=0)
+    parser.add_argument("--burst-duration", type=float, default=0)
+    parser.add_argument("--agent-username", default="")
+    parser.add_argument("--agent-password", default="")
+    parser.add_argument("--echo-player-id", action="store_true")
+    parser.add_argument("--clearance-ttl", type=float, default=0, help="طلب كوكي cf_clearance صالحاً لهذه المدة")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    
+    settings = FakeServerSettings(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        session_ttl=args.session_ttl,
+        rate_limit=args.rate_limit,
+        burst_size=args.burst_size,
+        burst_every=args.burst_every,
+        burst_duration=args.burst_duration,
+        agent_username=args.agent_username,
+        agent_password=args.agent_password,
+        echo_player_id=args.echo_player_id,
+        clearance_ttl=args.clearance_ttl
+    )
+    
+    server, _ = start_fake_server(args.host, args.port, settings)
+    
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        logger.info("🛑 تم إيقاف الخادم المحلي")
+
+if __name__ == "__main__":
+    main()
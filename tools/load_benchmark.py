@@ -0,0 +1,425 @@
+# tools/load_benchmark.py
+"""
+قياس أداء البوت تحت حمل مستخدمين متزامنين عبر سلسلة المعالجات الحقيقية
+
+التشغيل:
+    python -m tools.load_benchmark --users 50 --latency uniform:0.05,0.2
+
+يرسل تحديثات Telegram اصطناعية إلى نفس المعالجات التي يستخدمها البوت، مع خادم
+Ichancy المحلي وقاعدة SQLite مؤقتة (أو DATABASE_URL إن وُجد)، ثم يحفظ النتائج
+في benchmarks/results ويقارنها بآخر تشغيل سابق.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from tools.fake_ichancy_server import FakeServerSettings, start_fake_server
+
+logger = logging.getLogger(__name__)
+
+FLOWS = ['create_account', 'deposit', 'withdraw', 'stats']
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = f"bench{user_id}"
+        self.first_name = f"Bench {user_id}"
+
+class FakeChat:
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+
+class FakeMessage:
+    def __init__(self, bot, chat: FakeChat, message_id: int, text: str = ""):
+        self.bot = bot
+        self.chat = chat
+        self.message_id = message_id
+        self.text = text
+    
+    async def reply_text(self, text, **kwargs):
+        return await self.bot.send_message(chat_id=self.chat.id, text=text, **kwargs)
+
+class FakeCallbackQuery:
+    def __init__(self, bot, user: FakeUser, message: FakeMessage, data: str):
+        self.bot = bot
+        self.from_user = user
+        self.message = message
+        self.data = data
+    
+    async def answer(self, *args, **kwargs):
+        return True
+    
+    async def edit_message_text(self, text, **kwargs):
+        # تعديل المعالج نفسه للرسالة، لا يُعد نتيجة مهمة خلفية
+        self.message.text = text
+        return self.message
+
+class FakeUpdate:
+    def __init__(self, user: FakeUser, chat: FakeChat, message: FakeMessage = None,
+                 callback_query: FakeCallbackQuery = None):
+        self.effective_user = user
+        self.effective_chat = chat
+        self.message = message
+        self.callback_query = callback_query
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.user_data = {}
+        self.chat_data = {}
+
+class FakeBot:
+    """بوت وهمي يحفظ الرسائل في الذاكرة ويُبلغ بنتائج المهام الخلفية"""
+    
+    def __init__(self):
+        self.next_message_id = 1
+        self.last_messages: Dict[int, FakeMessage] = {}
+        self.waiters: Dict[tuple, asyncio.Future] = {}
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        message = FakeMessage(self, FakeChat(chat_id), self.next_message_id, text)
+        self.next_message_id += 1
+        self.last_messages[chat_id] = message
+        self._resolve(chat_id, message.message_id, text)
+        return message
+    
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        # يُستدعى من منفذ المهام الخلفية عند انتهاء الإيداع أو السحب
+        self._resolve(chat_id, message_id, text)
+        return True
+    
+    def expect_result(self, chat_id: int, message_id: int) -> asyncio.Future:
+        """انتظار نتيجة مهمة خلفية مرتبطة برسالة معينة"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[(str(chat_id), int(message_id))] = future
+        return future
+    
+    def _resolve(self, chat_id, message_id, text):
+        # معرّف المحادثة يُحفظ نصاً في طابور المهام
+        future = self.waiters.pop((str(chat_id), int(message_id)), None)
+        if future is not None and not future.done():
+            future.set_result(text)
+
+class LoopLagMonitor:
+    """قياس تأخر حلقة الأحداث بمقارنة زمن النوم الفعلي بالمطلوب"""
+    
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task = None
+    
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+class SimulatedUser:
+    """مستخدم اصطناعي ينفذ سيناريو كامل عبر المعالجات الحقيقية"""
+    
+    def __init__(self, bench, index: int):
+        self.bench = bench
+        self.user = FakeUser(900000000 + index)
+        self.chat = FakeChat(self.user.id)
+        self.user_id = str(self.user.id)
+        self.index = index
+    
+    async def send_text(self, text: str):
+        message = FakeMessage(self.bench.bot, self.chat, self.bench.bot.next_message_id, text)
+        self.bench.bot.next_message_id += 1
+        update = FakeUpdate(self.user, self.chat, message=message)
+        
+        if text.startswith("/"):
+            await self.bench.commands[text.split()[0][1:]](update, self.bench.context)
+        else:
+            await self.bench.handle_text_input(update, self.bench.context)
+    
+    async def press(self, data: str) -> FakeMessage:
+        message = self.bench.bot.last_messages.get(self.chat.id)
+        query = FakeCallbackQuery(self.bench.bot, self.user, message, data)
+        update = FakeUpdate(self.user, self.chat, callback_query=query)
+        await self.bench.handle_callback(update, self.bench.context)
+        return message
+    
+    def last_text(self) -> str:
+        message = self.bench.bot.last_messages.get(self.chat.id)
+        return message.text if message else ""
+    
+    async def create_account(self) -> bool:
+        await self.send_text("/create_account")
+        await self.send_text(f"bench{self.index}x{self.bench.run_tag}")
+        await self.send_text("Bench@2024")
+        await self.send_text(str(self.bench.args.create_amount))
+        await self.press('confirm_creation')
+        return self.bench.db.get_ichancy_account(self.user_id) is not None
+    
+    async def run_job_flow(self, command: str, amount: float, confirm: str) -> bool:
+        await self.send_text(command)
+        await self.send_text(str(amount))
+        
+        message = self.bench.bot.last_messages.get(self.chat.id)
+        result = self.bench.bot.expect_result(self.chat.id, message.message_id)
+        await self.press(confirm)
+        
+        text = await asyncio.wait_for(result, timeout=self.bench.args.job_timeout)
+        return _is_success(text)
+    
+    async def stats(self) -> bool:
+        await self.send_text("/stats")
+        return _is_success(self.last_text())
+    
+    async def run(self):
+        if self.bench.args.ramp:
+            await asyncio.sleep(self.bench.args.ramp * self.index / max(1, self.bench.args.users))
+        
+        # رصيد محلي كافٍ لإنشاء الحساب والإيداعات
+        funds = self.bench.args.create_amount + self.bench.args.deposit_amount * self.bench.args.rounds
+        self.bench.db.add_user(self.user_id, self.user.username)
+        self.bench.db.update_user_balance(self.user_id, funds, 'add')
+        
+        if not await self.bench.measure('create_account', self.create_account()):
+            return
+        
+        for _ in range(self.bench.args.rounds):
+            await self.bench.measure('deposit', self.run_job_flow(
+                "/deposit", self.bench.args.deposit_amount, 'confirm_deposit'))
+            await self.bench.measure('withdraw', self.run_job_flow(
+                "/withdraw", self.bench.args.withdraw_amount, 'confirm_withdraw'))
+            await self.bench.measure('stats', self.stats())
+
+class LoadBenchmark:
+    """تشغيل المستخدمين الاصطناعيين وتجميع النتائج"""
+    
+    def __init__(self, args, server_state):
+        self.args = args
+        self.server_state = server_state
+        self.run_tag = datetime.now().strftime('%H%M%S')
+        self.samples: Dict[str, List[float]] = {flow: [] for flow in FLOWS}
+        self.failures: Dict[str, int] = {flow: 0 for flow in FLOWS}
+        self.errors: List[str] = []
+        
+        # الاستيراد بعد ضبط متغيرات البيئة ومجلد العمل
+        import main
+        from database import db
+        from handlers import start_handler, account_handler, deposit_handler, withdraw_handler, callback_handler
+        from workers.job_worker import job_worker
+        
+        logging.getLogger('ichancy_bot').setLevel(logging.WARNING)
+        
+        self.db = db
+        self.job_worker = job_worker
+        self.bot = FakeBot()
+        self.context = FakeContext(self.bot)
+        self.handle_text_input = main.handle_text_input
+        self.handle_callback = callback_handler.handle_callback
+        self.commands = {
+            'start': start_handler.start_handler,
+            'stats': start_handler.stats_handler,
+            'create_account': account_handler.create_account_handler,
+            'deposit': deposit_handler.deposit_handler,
+            'withdraw': withdraw_handler.withdraw_handler
+        }
+    
+    async def measure(self, flow: str, coroutine) -> bool:
+        started = time.perf_counter()
+        try:
+            success = await coroutine
+        except Exception as e:
+            success = False
+            self.errors.append(f"{flow}: {type(e).__name__}: {str(e)}")
+        
+        if success:
+            self.samples[flow].append(time.perf_counter() - started)
+        else:
+            self.failures[flow] += 1
+        
+        return success
+    
+    async def run(self) -> Dict:
+        await self.job_worker.start(self.bot)
+        monitor = LoopLagMonitor()
+        monitor.start()
+        
+        started = time.perf_counter()
+        users = [SimulatedUser(self, index) for index in range(self.args.users)]
+        await asyncio.gather(*(user.run() for user in users))
+        elapsed = time.perf_counter() - started
+        
+        await monitor.stop()
+        await self.job_worker.stop()
+        
+        return self.report(elapsed, monitor.samples)
+    
+    def report(self, elapsed: float, lag_samples: List[float]) -> Dict:
+        flows = {}
+        for flow in FLOWS:
+            samples = self.samples[flow]
+            flows[flow] = {
+                'count': len(samples),
+                'failures': self.failures[flow],
+                'throughput': len(samples) / elapsed if elapsed else 0,
+                'p50': _percentile(samples, 50),
+                'p95': _percentile(samples, 95),
+                'p99': _percentile(samples, 99),
+                'max': max(samples) if samples else None
+            }
+        
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'revision': _git_revision(),
+            'config': {
+                'users': self.args.users,
+                'rounds': self.args.rounds,
+                'ramp': self.args.ramp,
+                'latency': self.args.latency,
+                'error_rate': self.args.error_rate,
+                'rate_limit': self.args.rate_limit,
+                'database': self.db.db_type,
+                'job_workers': self.job_worker.concurrency
+            },
+            'elapsed': elapsed,
+            'flows': flows,
+            'event_loop_lag': {
+                'p50': _percentile(lag_samples, 50),
+                'p99': _percentile(lag_samples, 99),
+                'max': max(lag_samples) if lag_samples else None
+            },
+            'upstream': self.server_state.stats,
+            'errors': self.errors[:20]
+        }
+
+def _is_success(text: str) -> bool:
+    return bool(text) and not text.lstrip().startswith(("❌", "⚠️"))
+
+def _percentile(samples: List[float], percent: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+def _load_previous(results_dir: str) -> Optional[Dict]:
+    if not os.path.isdir(results_dir):
+        return None
+    files = sorted(name for name in os.listdir(results_dir) if name.endswith(".json"))
+    if not files:
+        return None
+    with open(os.path.join(results_dir, files[-1]), encoding="utf-8") as f:
+        return json.load(f)
+
+def _format_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}ms"
+
+def _print_report(result: Dict, previous: Optional[Dict]):
+    print(f"\n📊 {result['config']['users']} مستخدم × {result['config']['rounds']} جولة "
+          f"خلال {result['elapsed']:.1f} ثانية (المراجعة {result['revision']})")
+    print(f"{'العملية':<16}{'العدد':>7}{'فشل':>6}{'عملية/ث':>10}{'p50':>9}{'p95':>9}{'p99':>9}")
+    
+    for flow, data in result['flows'].items():
+        print(f"{flow:<16}{data['count']:>7}{data['failures']:>6}{data['throughput']:>10.2f}"
+              f"{_format_ms(data['p50']):>9}{_format_ms(data['p95']):>9}{_format_ms(data['p99']):>9}")
+    
+    lag = result['event_loop_lag']
+    print(f"⏱️ تأخر حلقة الأحداث: p50 {_format_ms(lag['p50'])}، p99 {_format_ms(lag['p99'])}، "
+          f"الأقصى {_format_ms(lag['max'])}")
+    
+    if result['errors']:
+        print(f"⚠️ أول الأخطاء: {result['errors'][:3]}")
+    
+    if not previous:
+        return
+    
+    print(f"\n🔁 مقارنة مع التشغيل السابق ({previous.get('revision')} - {previous.get('timestamp')}):")
+    if previous.get('config') != result['config']:
+        print("⚠️ إعدادات التشغيل السابق مختلفة، المقارنة تقريبية فقط")
+    for flow, data in result['flows'].items():
+        old = previous.get('flows', {}).get(flow)
+        if not old or not data['p95'] or not old.get('p95'):
+            continue
+        change = (data['p95'] - old['p95']) / old['p95'] * 100
+        marker = "🔴" if change > 10 else "🟢" if change < -10 else "⚪"
+        print(f"{marker} {flow}: p95 {_format_ms(old['p95'])} → {_format_ms(data['p95'])} ({change:+.1f}%)، "
+              f"الإنتاجية {old['throughput']:.2f} → {data['throughput']:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء البوت تحت حمل مستخدمين متزامنين")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=1, help="عدد جولات الإيداع/السحب/الإحصائيات لكل مستخدم")
+    parser.add_argument("--ramp", type=float, default=0, help="ثوانٍ لتوزيع بدء المستخدمين")
+    parser.add_argument("--latency", default="uniform:0.02,0.08", help="زمن استجابة خادم Ichancy المحلي")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0, help="طلبات/ثانية يقبلها الخادم المحلي قبل 429")
+    parser.add_argument("--create-amount", type=float, default=100)
+    parser.add_argument("--deposit-amount", type=float, default=50)
+    parser.add_argument("--withdraw-amount", type=float, default=20)
+    parser.add_argument("--job-timeout", type=float, default=120)
+    parser.add_argument("--results-dir", default=os.path.join(REPO_ROOT, "benchmarks", "results"))
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    
+    settings = FakeServerSettings(latency=args.latency, error_rate=args.error_rate,
+                                  rate_limit=args.rate_limit, echo_player_id=True)
+    server, state = start_fake_server(settings=settings)
+    
+    os.environ["ICHANCY_ORIGIN"] = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["HUMAN_DELAY_MIN"] = "0"
+    os.environ["HUMAN_DELAY_MAX"] = "0"
+    os.environ.setdefault("BOT_TOKEN", "benchmark")
+    os.environ.setdefault("AGENT_USERNAME", "bench_agent")
+    os.environ.setdefault("AGENT_PASSWORD", "bench_password")
+    os.environ.setdefault("PARENT_ID", "1")
+    
+    # قاعدة SQLite والسجلات في مجلد مؤقت حتى لا تتأثر بيانات البوت
+    os.chdir(tempfile.mkdtemp(prefix="ichancy_bench_"))
+    
+    try:
+        result = asyncio.run(LoadBenchmark(args, state).run())
+    finally:
+        server.shutdown()
+    
+    previous = _load_previous(args.results_dir)
+    _print_report(result, previous)
+    
+    if not args.no_save:
+        os.makedirs(args.results_dir, exist_ok=True)
+        path = os.path.join(args.results_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 تم حفظ النتائج في {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# tools/stand_in_proxy.py
+"""
+بروكسي HTTP محلي يقوم مقام مخرج اتصال لاختبار مجموعة المخارج دون بروكسيات حقيقية
+
+التشغيل (بروكسيان، الثاني محجوب):
+    python -m tools.stand_in_proxy --port 8801 --name proxy-a
+    python -m tools.stand_in_proxy --port 8802 --name proxy-b --blocked
+
+ثم توجيه البوت إليهما مع الخادم المحلي:
+    EGRESS_PROXIES=http://127.0.0.1:8801,http://127.0.0.1:8802 ICHANCY_ORIGIN=http://127.0.0.1:8765 python main.py
+
+يمرر طلبات HTTP العادية فقط (بدون CONNECT)، ويضيف رأس Via باسمه ليربط الخادم المحلي
+تصريح الحماية بالمخرج كما يربطه Cloudflare بعنوان IP.
+"""
+
+import time
+import uuid
+import logging
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from tools.fake_ichancy_server import LatencyModel
+
+logger = logging.getLogger(__name__)
+
+# رؤوس خاصة بالاتصال الواحد لا تُمرر إلى الطرف الآخر
+HOP_BY_HOP = {
+    'connection', 'keep-alive', 'proxy-connection', 'proxy-authorization', 'proxy-authenticate',
+    'te', 'trailers', 'transfer-encoding', 'upgrade'
+}
+
+# صفحة حجب Cloudflare لعنوان محظور (لا يتخطاها أي تصريح)
+BLOCKED_PAGE = (
+    "<!DOCTYPE html><html><head><title>Access denied | Cloudflare</title></head>"
+    "<body><h1>Error 1020</h1><p>Access denied. This website is using a security service "
+    "to protect itself from online attacks.</p><p>Performance &amp; security by Cloudflare</p></body></html>"
+)
+
+class StandInProxyState:
+    """سلوك البروكسي (قابل للتغيير أثناء الاختبار) وعداداته"""
+    
+    def __init__(self, name: str, latency: str = "fixed:0", blocked: bool = False, down: bool = False):
+        self.name = name
+        self.latency = LatencyModel(latency)
+        self.blocked = blocked        # رد صفحة الحجب على كل طلب
+        self.down = down              # رد 502 كأن البروكسي لا يصل إلى الوجهة
+        self.lock = threading.Lock()
+        self.stats = {'forwarded': 0, 'blocked': 0, 'failed': 0}
+    
+    def record(self, kind: str):
+        """تسجيل طلب في العدادات"""
+        with self.lock:
+            self.stats[kind] += 1
+
+class StandInProxyHandler(BaseHTTPRequestHandler):
+    """تمرير الطلب إلى الوجهة المذكورة في سطر الطلب (صيغة البروكسي)"""
+    
+    protocol_version = "HTTP/1.1"
+    state: StandInProxyState = None
+    
+    def log_message(self, format, *args):
+        logger.debug(f"🧦 [{self.state.name}] " + format % args)
+    
+    def do_GET(self):
+        self._forward()
+    
+    def do_POST(self):
+        self._forward()
+    
+    def do_CONNECT(self):
+        self._reply(501, "text/plain", b"CONNECT tunnelling is not supported")
+    
+    def _forward(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        
+        time.sleep(self.state.latency.sample())
+        
+        if self.state.down:
+            self.state.record('failed')
+            self._reply(502, "text/plain", b"Bad Gateway")
+            return
+        
+        if self.state.blocked:
+            self.state.record('blocked')
+            self._reply(403, "text/html; charset=utf-8", BLOCKED_PAGE.encode("utf-8"),
+                        {"CF-RAY": uuid.uuid4().hex[:16] + "-FRA"})
+            return
+        
+        target = urlsplit(self.path)
+        if not target.hostname:
+            self._reply(400, "text/plain", b"absolute URI required")
+            return
+        
+        headers = {
+            name: value for name, value in self.headers.items()
+            if name.lower() not in HOP_BY_HOP
+        }
+        headers["Via"] = self.state.name
+        
+        try:
+            connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+            path = target.path or "/"
+            connection.request(self.command, path + (f"?{target.query}" if target.query else ""), body, headers)
+            response = connection.getresponse()
+            data = response.read()
+            response_headers = response.getheaders()
+            connection.close()
+        except OSError as e:
+            self.state.record('failed')
+            self._reply(502, "text/plain", f"Bad Gateway: {e}".encode("utf-8"))
+            return
+        
+        self.state.record('forwarded')
+        self.send_response(response.status)
+        for name, value in response_headers:
+            if name.lower() not in HOP_BY_HOP and name.lower() != 'content-length':
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _reply(self, status: int, content_type: str, data: bytes, extra_headers: Dict[str, str] = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_stand_in_proxy(host: str = "127.0.0.1", port: int = 0,
+                         state: StandInProxyState = None) -> Tuple[ThreadingHTTPServer, StandInProxyState]:
+    """تشغيل البروكسي في خيط خلفي (للاستخدام داخل نفس العملية)"""
+    state = state or StandInProxyState(f"stand-in-{port}")
+    handler = type("BoundStandInProxyHandler", (StandInProxyHandler,), {"state": state})
+    
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    logger.info(f"🧦 البروكسي المحلي {state.name} يعمل على http://{host}:{server.server_address[1]}")
+    return server, state
+
+def main():
+    parser = argparse.ArgumentParser(description="بروكسي HTTP محلي لاختبار مخارج الاتصال")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8801)
+    parser.add_argument("--name", default=None, help="اسم البروكسي في رأس Via")
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:A,B | lognormal:MU,SIGMA")
+    parser.add_argument("--blocked", action="store_true", help="رد صفحة حجب Cloudflare على كل طلب")
+    parser.add_argument("--down", action="store_true", help="رد 502 على كل طلب")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    
+    state = StandInProxyState(args.name or f"stand-in-{args.port}", args.latency, args.blocked, args.down)
+    server, _ = start_stand_in_proxy(args.host, args.port, state)
+    
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        logger.info("🛑 تم إيقاف البروكسي المحلي")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+# utils/cache.py
+"""
+ذاكرة مؤقتة بطبقتين لقراءات قاعدة البيانات وIchancy
+
+الطبقة الأولى LRU داخل العملية بصلاحية قصيرة، والثانية Redis المشترك بين النسخ.
+التحميلات المتزامنة لنفس المفتاح تُدمج في تحميل واحد، والنتيجة None تُحفظ لمدة أقصر،
+وإبطال مساحة كاملة يتم برفع رقم جيلها في Redis دون البحث عن مفاتيحها.
+إبطال مفتاح يغير إصداره في Redis، والقيمة المحفوظة بإصدار سابق (تحميل بدأ قبل الإبطال في نسخة
+أخرى) لا تُقرأ.
+"""
+
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from config import config
+from utils.metrics import metrics
+from utils.redis_manager import redis_manager
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('cache_requests_total', 'قراءات الذاكرة المؤقتة حسب المساحة والنتيجة (local أو redis أو miss)')
+metrics.describe('cache_invalidations_total', 'إبطالات الذاكرة المؤقتة حسب المساحة')
+
+class Cache:
+    """مساحة أسماء في الذاكرة المؤقتة: LRU محلية بصلاحية ثم Redis ثم دالة التحميل"""
+    
+    def __init__(self, namespace: str, ttl: float, local_ttl: float = 30, negative_ttl: float = 30,
+                 max_entries: int = 1024):
+        self.namespace = namespace
+        self.ttl = ttl                      # صلاحية القيمة في Redis
+        self.local_ttl = min(local_ttl, ttl)  # أقصى تأخر لنسخة عن إبطال تم في نسخة أخرى
+        self.negative_ttl = negative_ttl    # صلاحية النتيجة None (غير موجود)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[str, float]]" = OrderedDict()    # JSON حتى لا يعدل مستدعٍ نسخة غيره
+        self._epochs: Dict[Hashable, int] = {}      # إبطالات المفاتيح الجاري تحميلها فقط
+        self._loading: Dict[Hashable, list] = {}    # قفل التحميل لكل مفتاح مع عدد منتظريه
+        self._lock = threading.Lock()
+    
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """القيمة من الذاكرة المحلية أو Redis، وإلا من دالة التحميل (مرة واحدة للطلبات المتزامنة)"""
+        found, value = self._get_local(key)
+        if found:
+            metrics.inc('cache_requests_total', cache=self.namespace, result='local')
+            return value
+        
+        # تحميل واحد لكل مفتاح: المنتظرون يجدون القيمة محلياً بعد انتهاء الأول
+        with self._lock:
+            loading = self._loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+        
+        try:
+            with loading[0]:
+                return self._load(key, loader)
+        finally:
+            with self._lock:
+                loading[1] -= 1
+                if loading[1] == 0:
+                    self._loading.pop(key, None)
+                    self._epochs.pop(key, None)
+    
+    def invalidate(self, key: Hashable):
+        """إبطال مفتاح في هذه النسخة وفي Redis"""
+        with self._lock:
+            self._entries.pop(key, None)
+            if key in self._loading:
+                self._epochs[key] = self._epochs.get(key, 0) + 1
+        
+        metrics.inc('cache_invalidations_total', cache=self.namespace)
+        
+        if redis_manager.configured:
+            try:
+                # إصدار جديد لا يتكرر: ما تحفظه نسخة حملت قبل الإبطال يُرفض عند القراءة،
+                # ويبقى الإصدار أطول من صلاحية أي قيمة حُفظت بالإصدار السابق
+                redis_manager.execute_many([
+                    ('delete', self._redis_key(key)),
+                    ('setex', self._version_key(key), int(2 * max(self.ttl, self.negative_ttl)), uuid.uuid4().hex)
+                ])
+            except Exception as e:
+                logger.error(f"❌ فشل إبطال {self.namespace}:{key} في Redis: {str(e)}")
+    
+    def invalidate_all(self):
+        """إبطال المساحة كاملة (النسخ الأخرى تلتزم بذلك عند انتهاء صلاحيتها المحلية)"""
+        with self._lock:
+            for key in self._loading:
+                self._epochs[key] = self._epochs.get(key, 0) + 1
+            self._entries.clear()
+        
+        metrics.inc('cache_invalidations_total', cache=self.namespace)
+        
+        if redis_manager.configured:
+            try:
+                redis_manager.incr(self._generation_key())
+            except Exception as e:
+                logger.error(f"❌ فشل إبطال مساحة {self.namespace} في Redis: {str(e)}")
+        
+        logger.info(f"🧹 تم إبطال الذاكرة المؤقتة {self.namespace}")
+    
+    def size(self) -> int:
+        """عدد القيم المحفوظة محلياً"""
+        return len(self._entries)
+    
+    def _load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        # ربما أكمل تحميل سابق لنفس المفتاح أثناء الانتظار
+        found, value = self._get_local(key)
+        if found:
+            metrics.inc('cache_requests_total', cache=self.namespace, result='local')
+            return value
+        
+        with self._lock:
+            epoch = self._epochs.get(key, 0)
+        
+        generation = version = None
+        if redis_manager.available:
+            try:
+                generation, version, data = redis_manager.execute_many([
+                    ('get', self._generation_key()),
+                    ('get', self._version_key(key)),
+                    ('get', self._redis_key(key))
+                ])
+                if data:
+                    entry = json.loads(data)
+                    if entry['generation'] == (generation or '0') and entry.get('version') == (version or '0'):
+                        metrics.inc('cache_requests_total', cache=self.namespace, result='redis')
+                        self._set_local(key, json.dumps(entry['value']), epoch)
+                        return entry['value']
+            except Exception as e:
+                logger.error(f"❌ فشل القراءة من ذاكرة {self.namespace} في Redis: {str(e)}")
+        
+        metrics.inc('cache_requests_total', cache=self.namespace, result='miss')
+        # نفس الأنواع في جميع الطبقات: الأرقام العشرية أرقام والتواريخ نصوص
+        data = json.dumps(loader(), default=_json_default)
+        value = json.loads(data)
+        
+        # إبطال أثناء التحميل يعني أن القيمة المحملة قد تكون قديمة، فلا تُحفظ
+        if not self._set_local(key, data, epoch):
+            return value
+        
+        if redis_manager.available:
+            try:
+                # بالإصدار المقروء قبل التحميل: إبطال في نسخة أخرى أثناءه يجعلها غير صالحة
+                entry = {'generation': generation or '0', 'version': version or '0', 'value': value}
+                redis_manager.setex(
+                    self._redis_key(key),
+                    self.ttl if value is not None else self.negative_ttl,
+                    json.dumps(entry)
+                )
+            except Exception as e:
+                logger.error(f"❌ فشل الحفظ في ذاكرة {self.namespace} في Redis: {str(e)}")
+        
+        return value
+    
+    def _get_local(self, key: Hashable) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            
+            data, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return False, None
+            
+            self._entries.move_to_end(key)
+        
+        return True, json.loads(data)
+    
+    def _set_local(self, key: Hashable, data: str, epoch: int) -> bool:
+        ttl = self.local_ttl if data != 'null' else min(self.local_ttl, self.negative_ttl)
+        
+        with self._lock:
+            if self._epochs.get(key, 0) != epoch:
+                return False
+            
+            self._entries[key] = (data, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+    
+    def _redis_key(self, key: Hashable) -> str:
+        return f"ichancy:cache:{self.namespace}:{key}"
+    
+    def _version_key(self, key: Hashable) -> str:
+        return f"ichancy:cache:{self.namespace}:version:{key}"
+    
+    def _generation_key(self) -> str:
+        return f"ichancy:cache:{self.namespace}:generation"
+
+def _json_default(value: Any) -> Any:
+    """قيم قاعدة البيانات غير القابلة لـ JSON: الأرقام العشرية كأرقام والتواريخ كنص"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=' ') if isinstance(value, datetime) else value.isoformat()
+    return str(value)
+
+_caches: Dict[str, Cache] = {}
+_caches_lock = threading.Lock()
+
+def cache_for(namespace: str, ttl: Optional[float] = None) -> Cache:
+    """مساحة الذاكرة المؤقتة بالاسم (تُنشأ عند أول استخدام بإعدادات APP_CONFIG)"""
+    with _caches_lock:
+        cache = _caches.get(namespace)
+        
+        if cache is None:
+            cache = _caches[namespace] = Cache(
+                namespace,
+                ttl=ttl or config.APP_CONFIG["cache_ttl"],
+                local_ttl=config.APP_CONFIG["cache_local_ttl"],
+                negative_ttl=config.APP_CONFIG["cache_negative_ttl"],
+                max_entries=config.APP_CONFIG["cache_max_entries"]
+            )
+        
+        return cache
+
+metrics.describe('cache_entries', 'القيم المحفوظة في الذاكرة المحلية حسب المساحة')
+metrics.gauge('cache_entries', lambda: {
+    (('cache', namespace),): cache.size() for namespace, cache in list(_caches.items())
+})
@@ -0,0 +1,201 @@
+# utils/metrics.py
+"""
+قياسات أداء الطلبات الصادرة - عدادات ومدرجات زمن الاستجابة لكل نقطة نهاية
+"""
+
+import time
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# حدود فئات زمن الاستجابة بالثواني (الفئة الأخيرة لما يتجاوز 60 ثانية)
+LATENCY_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75,
+    1, 1.5, 2, 3, 5, 7.5, 10, 15, 20, 30, 60
+]
+
+class LatencyHistogram:
+    """مدرج زمن استجابة بنافذتين متعاقبتين حتى يتبع التغيرات الحديثة"""
+    
+    def __init__(self, window: float = 300, buckets: List[float] = None):
+        self.window = window
+        self.buckets = buckets or LATENCY_BUCKETS
+        self._current = [0] * (len(self.buckets) + 1)
+        self._previous = [0] * (len(self.buckets) + 1)
+        self._totals = [0] * (len(self.buckets) + 1)
+        self._rotated_at = time.time()
+        self.total_count = 0
+        self.total_sum = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, seconds: float):
+        """تسجيل زمن استجابة واحد"""
+        index = bisect.bisect_left(self.buckets, seconds)
+        
+        with self._lock:
+            self._rotate()
+            self._current[index] += 1
+            self._totals[index] += 1
+            self.total_count += 1
+            self.total_sum += seconds
+    
+    def percentile(self, percent: float, min_samples: int = 1) -> Optional[float]:
+        """تقدير النسبة المئوية (الحد الأعلى للفئة) من النافذتين الأخيرتين"""
+        with self._lock:
+            self._rotate()
+            counts = [current + previous for current, previous in zip(self._current, self._previous)]
+        
+        total = sum(counts)
+        if total < max(1, min_samples):
+            return None
+        
+        threshold = total * percent / 100
+        cumulative = 0
+        for index, count in enumerate(counts):
+            cumulative += count
+            if cumulative >= threshold:
+                return self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+        
+        return self.buckets[-1]
+    
+    def snapshot(self) -> Dict:
+        """ملخص المدرج للعرض"""
+        return {
+            'count': self.total_count,
+            'sum': self.total_sum,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99)
+        }
+    
+    def cumulative_counts(self) -> List[int]:
+        """العدد التراكمي لكل فئة منذ بدء التشغيل (لصيغة Prometheus)"""
+        with self._lock:
+            totals = list(self._totals)
+        
+        cumulative = []
+        running = 0
+        for count in totals:
+            running += count
+            cumulative.append(running)
+        return cumulative
+    
+    def _rotate(self):
+        now = time.time()
+        if now - self._rotated_at < self.window:
+            return
+        
+        # نافذة كاملة أو أكثر مرت دون تسجيل: البيانات القديمة لم تعد ممثلة
+        if now - self._rotated_at >= 2 * self.window:
+            self._previous = [0] * len(self._current)
+        else:
+            self._previous = self._current
+        self._current = [0] * len(self._previous)
+        self._rotated_at = now
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels_key(labels: Dict) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class MetricsRegistry:
+    """سجل مركزي للعدادات والمدرجات والقيم اللحظية، يقرؤه /metrics وشاشة حالة API"""
+    
+    def __init__(self):
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, LatencyHistogram]] = {}
+        self.gauges: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+        self.descriptions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+    
+    def describe(self, name: str, description: str):
+        """وصف المقياس في مخرجات /metrics"""
+        self.descriptions[name] = description
+    
+    def inc(self, name: str, value: float = 1, **labels):
+        """زيادة عداد"""
+        key = _labels_key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+    
+    def histogram(self, name: str, **labels) -> LatencyHistogram:
+        """الحصول على مدرج (إنشاؤه عند أول استخدام)"""
+        key = _labels_key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = LatencyHistogram()
+            return histogram
+    
+    def observe(self, name: str, seconds: float, **labels):
+        """تسجيل زمن في مدرج"""
+        self.histogram(name, **labels).observe(seconds)
+    
+    def gauge(self, name: str, func: Callable[[], Dict[Labels, float]]):
+        """تسجيل قيمة لحظية تُحسب عند القراءة (دالة تعيد {التسميات: القيمة})"""
+        self.gauges[name] = func
+    
+    def counter_values(self, name: str) -> Dict[Labels, float]:
+        """قيم عداد حسب التسميات"""
+        with self._lock:
+            return dict(self.counters.get(name, {}))
+    
+    def histogram_series(self, name: str) -> Dict[Labels, LatencyHistogram]:
+        """مدرجات مقياس حسب التسميات"""
+        with self._lock:
+            return dict(self.histograms.get(name, {}))
+    
+    def render(self) -> str:
+        """جميع المقاييس بصيغة Prometheus النصية"""
+        with self._lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {name: dict(series) for name, series in self.histograms.items()}
+        
+        lines = []
+        
+        for name, series in sorted(counters.items()):
+            self._render_header(lines, name, 'counter')
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        
+        for name, series in sorted(histograms.items()):
+            self._render_header(lines, name, 'histogram')
+            for labels, histogram in sorted(series.items()):
+                cumulative = histogram.cumulative_counts()
+                for bound, count in zip(histogram.buckets, cumulative):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', repr(float(bound))),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {cumulative[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {repr(histogram.total_sum)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.total_count}")
+        
+        for name, func in sorted(self.gauges.items()):
+            try:
+                series = func()
+            except Exception:
+                continue
+            self._render_header(lines, name, 'gauge')
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        
+        return "\n".join(lines) + "\n"
+    
+    def _render_header(self, lines: List[str], name: str, kind: str):
+        description = self.descriptions.get(name)
+        if description:
+            lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+# إنشاء نسخة وحيدة من سجل المقاييس
+metrics = MetricsRegistry()
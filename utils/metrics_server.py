@@ -0,0 +1,44 @@
+# utils/metrics_server.py
+"""
+خادم HTTP بسيط يعرض سجل المقاييس على /metrics بصيغة Prometheus
+"""
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """معالج طلبات المقاييس"""
+    
+    def log_message(self, format, *args):
+        logger.debug("📈 " + format % args)
+    
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """تشغيل خادم المقاييس في خيط خلفي (None إذا تعذر حجز المنفذ)"""
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        logger.error(f"❌ تعذر تشغيل خادم المقاييس على المنفذ {port}: {str(e)}")
+        return None
+    
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    
+    logger.info(f"📈 المقاييس متاحة على http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,146 @@
+# utils/protection_telemetry.py
+"""
+تجميع محاولات تخطي الحماية في الذاكرة وكتابتها دورياً إلى error_logs
+
+بدلاً من صف مع تفريغ كامل للرؤوس لكل محاولة: عدادات لكل نوع حماية في كل نافذة،
+مع أول N محاولات مفصلة فقط في كل نافذة لكل نوع.
+"""
+
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+from config import config
+from database import db
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('protection_attempts_total', 'محاولات تخطي الحماية حسب نوع الحماية والنتيجة')
+
+class ProtectionTelemetry:
+    """عدادات محاولات تخطي الحماية لكل نافذة زمنية مع عينة مفصلة محدودة"""
+    
+    def __init__(self, window: float = 60, sample_limit: int = 3, flush_interval: float = 60):
+        self.window = window                  # طول نافذة التجميع بالثواني
+        self.sample_limit = sample_limit      # محاولات مفصلة تُكتب لكل نوع في كل نافذة
+        self.flush_interval = flush_interval
+        self._counts: Dict[Tuple[float, str, str], Dict[str, int]] = {}
+        self._samples: List[Dict] = []
+        self._sampled: Dict[Tuple[float, str], int] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+    
+    def record(self, protection_type: str, success: bool, url: str, row: Dict) -> bool:
+        """احتساب محاولة، والاحتفاظ بصفها المفصل إذا بقي مكان في عينة النافذة (True إذا احتُفظ به)"""
+        outcome = 'success' if success else 'failure'
+        window_start = time.time() // self.window * self.window
+        metrics.inc('protection_attempts_total', protection_type=protection_type, outcome=outcome)
+        
+        with self._lock:
+            counts = self._counts.setdefault((window_start, protection_type, url), {'success': 0, 'failure': 0})
+            counts[outcome] += 1
+            
+            sampled = self._sampled.get((window_start, protection_type), 0)
+            if sampled >= self.sample_limit:
+                return False
+            
+            self._sampled[(window_start, protection_type)] = sampled + 1
+            self._samples.append(row)
+            return True
+    
+    def flush(self, include_current: bool = False) -> int:
+        """كتابة النوافذ المنتهية (وعيناتها) في معاملة واحدة، ويعيد عدد الصفوف المكتوبة"""
+        current_window = time.time() // self.window * self.window
+        
+        with self._lock:
+            finished = [
+                key for key in self._counts
+                if include_current or key[0] < current_window
+            ]
+            counts = {key: self._counts.pop(key) for key in finished}
+            samples, self._samples = self._samples, []
+            self._sampled = {
+                key: value for key, value in self._sampled.items()
+                if not include_current and key[0] >= current_window
+            }
+        
+        rows = samples + [self._summary_row(key, value) for key, value in counts.items()]
+        
+        if rows:
+            db.log_errors(rows)
+            logger.debug(f"📝 تم تسجيل {len(counts)} ملخص و{len(samples)} عينة لمحاولات تخطي الحماية")
+        
+        return len(rows)
+    
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """محاولات النوافذ التي لم تُكتب بعد حسب نوع الحماية"""
+        totals: Dict[str, Dict[str, int]] = {}
+        with self._lock:
+            for (_, protection_type, _), counts in self._counts.items():
+                total = totals.setdefault(protection_type, {'success': 0, 'failure': 0})
+                total['success'] += counts['success']
+                total['failure'] += counts['failure']
+        return totals
+    
+    async def start(self):
+        """بدء الكتابة الدورية في الخلفية"""
+        if self._running:
+            return
+        
+        self._running = True
+        self._task = asyncio.create_task(self._flush_loop())
+        logger.info(f"✅ تم تشغيل تجميع محاولات تخطي الحماية (كل {self.flush_interval} ثانية)")
+    
+    async def stop(self):
+        """إيقاف الكتابة الدورية مع كتابة ما تبقى"""
+        self._running = False
+        
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        
+        await asyncio.get_running_loop().run_in_executor(None, self.flush, True)
+        logger.info("🛑 تم إيقاف تجميع محاولات تخطي الحماية")
+    
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        
+        while self._running:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await loop.run_in_executor(None, self.flush)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ خطأ في كتابة محاولات تخطي الحماية: {str(e)}")
+    
+    def _summary_row(self, key: Tuple[float, str, str], counts: Dict[str, int]) -> Dict:
+        window_start, protection_type, url = key
+        return {
+            'user_id': 'captcha_solver',
+            'error_type': f'captcha_{protection_type}_summary',
+            'error_message': (
+                f'محاولات تخطي {protection_type} خلال {int(self.window)} ثانية: '
+                f'{counts["success"]} نجاح، {counts["failure"]} فشل'
+            ),
+            'api_endpoint': url,
+            'request_data': json.dumps({
+                'protection_type': protection_type,
+                'window_start': window_start,
+                'window_seconds': self.window,
+                'success': counts['success'],
+                'failure': counts['failure']
+            }, ensure_ascii=False)
+        }
+
+# إنشاء نسخة وحيدة مشتركة
+protection_telemetry = ProtectionTelemetry(
+    window=config.APP_CONFIG["protection_telemetry_window"],
+    sample_limit=config.APP_CONFIG["protection_telemetry_samples"],
+    flush_interval=config.APP_CONFIG["protection_telemetry_flush_interval"]
+)
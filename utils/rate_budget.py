@@ -0,0 +1,115 @@
+# utils/rate_budget.py
+"""
+ميزانيات المحاولات في نوافذ منزلقة - مشتركة بين جميع النسخ عبر Redis، أو محلية بدونه
+"""
+
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from config import config
+from utils.redis_manager import redis_manager, UNREACHABLE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# فحص الحد وتسجيل المحاولة في خطوة واحدة حتى لا تتجاوز نسختان الحد معاً
+# (الوقت من خادم Redis حتى لا تختلف النوافذ باختلاف ساعات النسخ)
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+
+if redis.call('ZCARD', KEYS[1]) >= limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {0, tostring(tonumber(oldest[2]) + window - now)}
+end
+
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('EXPIRE', KEYS[1], math.ceil(window))
+return {1, '0'}
+"""
+
+class AttemptBudget:
+    """عدد محدود من المحاولات في نافذة منزلقة، ثم انتظار حتى تخرج أقدم محاولة منها"""
+    
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.key = f"ichancy:budget:{name}"
+        self._script = redis_manager.register_script(_ACQUIRE_SCRIPT)
+        self._attempts = deque()
+        self._blocked_for = 0.0
+        self._lock = threading.Lock()
+    
+    def try_acquire(self) -> bool:
+        """تسجيل محاولة إذا سمحت الميزانية"""
+        # أثناء انقطاع Redis تحسب كل نسخة محاولاتها محلياً
+        if self._script is not None and redis_manager.available:
+            try:
+                allowed, retry_in = self._script(keys=[self.key], args=[self.window, self.limit, uuid.uuid4().hex])
+                self._blocked_for = 0.0 if int(allowed) else float(retry_in)
+                return bool(int(allowed))
+            except UNREACHABLE_ERRORS as e:
+                redis_manager.degrade(e)
+            except Exception as e:
+                logger.error(f"❌ تعذر استخدام ميزانية {self.name} المشتركة، الاعتماد على العداد المحلي: {str(e)}")
+        
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            
+            if len(self._attempts) >= self.limit:
+                self._blocked_for = self._attempts[0] + self.window - now
+                return False
+            
+            self._attempts.append(now)
+            self._blocked_for = 0.0
+            return True
+    
+    def reset(self):
+        """مسح المحاولات بعد نجاح (الحد للمحاولات الفاشلة المتتالية)"""
+        with self._lock:
+            self._attempts.clear()
+            self._blocked_for = 0.0
+        
+        try:
+            redis_manager.delete(self.key)
+        except Exception as e:
+            logger.error(f"❌ فشل مسح ميزانية {self.name} المشتركة: {str(e)}")
+    
+    def retry_in(self) -> float:
+        """الثواني المتبقية حتى تُسمح محاولة جديدة (حسب آخر رفض)"""
+        return max(0.0, self._blocked_for)
+    
+    def _expire(self, now: float):
+        while self._attempts and self._attempts[0] <= now - self.window:
+            self._attempts.popleft()
+
+# محاولات تخطي الحماية المشتركة بين جميع النسخ
+captcha_budget = AttemptBudget(
+    'captcha',
+    limit=config.APP_CONFIG["captcha_attempt_limit"],
+    window=config.APP_CONFIG["captcha_attempt_window"]
+)
+
+_login_budgets = {}
+_login_budgets_lock = threading.Lock()
+
+def login_budget_for(username: str) -> AttemptBudget:
+    """محاولات تسجيل الدخول لحساب وكيل، مشتركة بين جميع النسخ"""
+    with _login_budgets_lock:
+        budget = _login_budgets.get(username)
+        
+        if budget is None:
+            budget = _login_budgets[username] = AttemptBudget(
+                f'login:{username}',
+                limit=config.APP_CONFIG["login_attempt_limit"],
+                window=config.APP_CONFIG["login_attempt_window"]
+            )
+        
+        return budget
@@ -0,0 +1,274 @@
+# utils/redis_manager.py
+"""
+مدير Redis مركزي: مجمع اتصالات واحد مشترك، عميل غير متزامن، تنفيذ عدة أوامر في رحلة واحدة،
+ووضع متدهور يخزن في الذاكرة تلقائياً عندما لا يمكن الوصول إلى Redis
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import redis
+import redis.asyncio
+from config import config
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# أخطاء الوصول إلى Redis التي تحول المدير إلى الذاكرة (أخطاء الأوامر نفسها تُرفع كما هي)
+UNREACHABLE_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+class MemoryStore:
+    """بديل محلي لأوامر Redis المستخدمة في البوت (قيم نصية مع مدة صلاحية)"""
+    
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key)
+    
+    def set(self, key: str, value: Any, ex: Optional[float] = None) -> bool:
+        with self._lock:
+            self._values[key] = (str(value), time.time() + ex if ex else None)
+        return True
+    
+    def setex(self, key: str, seconds: float, value: Any) -> bool:
+        return self.set(key, value, ex=seconds)
+    
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._values.pop(key, None) is not None)
+    
+    def ttl(self, key: str) -> int:
+        """الثواني المتبقية كما يعيدها Redis (-1 بلا انتهاء، -2 غير موجود)"""
+        with self._lock:
+            if self._live(key) is None:
+                return -2
+            expires_at = self._values[key][1]
+            return -1 if expires_at is None else max(0, int(expires_at - time.time()))
+    
+    def exists(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._live(key) is not None)
+    
+    def incr(self, key: str) -> int:
+        with self._lock:
+            current = self._live(key)
+            expires_at = self._values[key][1] if current is not None else None
+            value = int(current or 0) + 1
+            self._values[key] = (str(value), expires_at)
+            return value
+    
+    def ping(self) -> bool:
+        return True
+    
+    def size(self) -> int:
+        """عدد المفاتيح المحفوظة (بما فيها المنتهية التي لم تُقرأ بعد)"""
+        return len(self._values)
+    
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._values[key]
+            return None
+        return value
+
+class RedisManager:
+    """اتصال مشترك بـ Redis لجميع المكونات مع تحويل تلقائي إلى الذاكرة عند انقطاعه"""
+    
+    def __init__(self, url: str, max_connections: int = 20, socket_timeout: float = 2,
+                 connect_timeout: float = 2, health_check_interval: float = 30, retry_interval: float = 15):
+        self.url = url
+        self.max_connections = max_connections
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout
+        self.health_check_interval = health_check_interval    # فحص الاتصال الخامل قبل إعادة استخدامه
+        self.retry_interval = retry_interval                  # مدة البقاء في الذاكرة قبل تجربة Redis من جديد
+        self.fallback = MemoryStore()
+        self._client: Optional[redis.Redis] = None
+        self._async_client: Optional[redis.asyncio.Redis] = None
+        self._degraded_until = 0.0
+        self._last_error: Optional[str] = None
+        self._lock = threading.Lock()
+    
+    @property
+    def configured(self) -> bool:
+        """هل تم تحديد REDIS_URL (بدونه كل شيء في الذاكرة)"""
+        return bool(self.url)
+    
+    @property
+    def available(self) -> bool:
+        """هل تذهب الأوامر إلى Redis الآن (وليس إلى الذاكرة)"""
+        return self.configured and time.time() >= self._degraded_until
+    
+    @property
+    def client(self) -> Optional[redis.Redis]:
+        """عميل Redis المتزامن على المجمع المشترك (None بدون REDIS_URL)"""
+        if not self.configured:
+            return None
+        
+        with self._lock:
+            if self._client is None:
+                pool = redis.BlockingConnectionPool.from_url(self.url, timeout=self.socket_timeout, **self._pool_options())
+                self._client = redis.Redis(connection_pool=pool)
+            return self._client
+    
+    @property
+    def async_client(self) -> Optional[redis.asyncio.Redis]:
+        """عميل Redis غير المتزامن بنفس حدود المجمع (None بدون REDIS_URL)"""
+        if not self.configured:
+            return None
+        
+        with self._lock:
+            if self._async_client is None:
+                pool = redis.asyncio.BlockingConnectionPool.from_url(
+                    self.url, timeout=self.socket_timeout, **self._pool_options()
+                )
+                self._async_client = redis.asyncio.Redis(connection_pool=pool)
+            return self._async_client
+    
+    def get(self, key: str) -> Optional[str]:
+        return self._execute('get', key)
+    
+    def set(self, key: str, value: Any, ex: Optional[float] = None) -> bool:
+        return self._execute('set', key, value, ex=ex)
+    
+    def setex(self, key: str, seconds: float, value: Any) -> bool:
+        return self._execute('setex', key, int(seconds), value)
+    
+    def delete(self, *keys: str) -> int:
+        return self._execute('delete', *keys)
+    
+    def ttl(self, key: str) -> int:
+        return self._execute('ttl', key)
+    
+    def exists(self, *keys: str) -> int:
+        return self._execute('exists', *keys)
+    
+    def incr(self, key: str) -> int:
+        return self._execute('incr', key)
+    
+    def execute_many(self, commands: Sequence[Tuple]) -> List[Any]:
+        """تنفيذ عدة أوامر (اسم الأمر ثم معاملاته) في رحلة واحدة إلى Redis، أو بالتتابع في الذاكرة"""
+        if self.available:
+            try:
+                pipeline = self.client.pipeline(transaction=False)
+                for command, *args in commands:
+                    getattr(pipeline, command)(*args)
+                return pipeline.execute()
+            except UNREACHABLE_ERRORS as e:
+                self.degrade(e)
+        
+        return [getattr(self.fallback, command)(*args) for command, *args in commands]
+    
+    def register_script(self, script: str):
+        """سكربت Lua على العميل المشترك (None بدون REDIS_URL، والمستدعي يفحص available قبل تشغيله)"""
+        client = self.client
+        return client.register_script(script) if client is not None else None
+    
+    def ping(self) -> bool:
+        """فحص Redis مباشرة (يرفع الخطأ)، وإنهاء الوضع المتدهور إذا نجح"""
+        if not self.configured:
+            return self.fallback.ping()
+        
+        try:
+            self.client.ping()
+        except UNREACHABLE_ERRORS as e:
+            self.degrade(e)
+            raise
+        
+        self._recover()
+        return True
+    
+    def snapshot(self) -> Dict:
+        """حالة الاتصال للعرض"""
+        return {
+            'configured': self.configured,
+            'available': self.available,
+            'degraded_for': max(0.0, self._degraded_until - time.time()),
+            'last_error': self._last_error,
+            'fallback_keys': self.fallback.size()
+        }
+    
+    def close(self):
+        """إغلاق اتصالات المجمع المتزامن"""
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+            client.connection_pool.disconnect()
+    
+    async def aclose(self):
+        """إغلاق العميل غير المتزامن ثم المتزامن"""
+        with self._lock:
+            client, self._async_client = self._async_client, None
+        if client is not None:
+            await client.aclose(close_connection_pool=True)
+        self.close()
+    
+    def _execute(self, command: str, *args, **kwargs):
+        if self.available:
+            try:
+                result = getattr(self.client, command)(*args, **kwargs)
+                self._recover()
+                return result
+            except UNREACHABLE_ERRORS as e:
+                self.degrade(e)
+        
+        return getattr(self.fallback, command)(*args, **kwargs)
+    
+    def degrade(self, error: Exception):
+        """التحول إلى الذاكرة بعد تعذر الوصول إلى Redis حتى موعد المحاولة التالية"""
+        metrics.inc('redis_unreachable_total')
+        with self._lock:
+            already_degraded = self._last_error is not None
+            self._degraded_until = time.time() + self.retry_interval
+            self._last_error = str(error)
+        
+        if not already_degraded:
+            logger.warning(
+                f"⚠️ تعذر الوصول إلى Redis ({error})، التخزين في الذاكرة مع إعادة المحاولة كل "
+                f"{int(self.retry_interval)} ثانية"
+            )
+    
+    def _recover(self):
+        if self._last_error is None:
+            return
+        
+        with self._lock:
+            recovered, self._last_error = self._last_error is not None, None
+            self._degraded_until = 0.0
+        
+        if recovered:
+            logger.info("✅ عاد الاتصال بـ Redis")
+    
+    def _pool_options(self) -> Dict:
+        return {
+            'max_connections': self.max_connections,
+            'socket_timeout': self.socket_timeout,
+            'socket_connect_timeout': self.connect_timeout,
+            'health_check_interval': self.health_check_interval,
+            'decode_responses': True
+        }
+
+# إنشاء نسخة وحيدة يتشارك مجمعها جميع المكونات
+redis_manager = RedisManager(
+    config.REDIS_URL,
+    max_connections=config.APP_CONFIG["redis_max_connections"],
+    socket_timeout=config.APP_CONFIG["redis_socket_timeout"],
+    connect_timeout=config.APP_CONFIG["redis_connect_timeout"],
+    health_check_interval=config.APP_CONFIG["redis_health_check_interval"],
+    retry_interval=config.APP_CONFIG["redis_retry_interval"]
+)
+
+metrics.describe('redis_unreachable_total', 'أوامر Redis التي فشلت لانقطاع الاتصال وتحولت إلى الذاكرة')
+metrics.describe('redis_degraded', 'هل يعمل التخزين في الذاكرة بدلاً من Redis (1 أثناء الانقطاع)')
+metrics.gauge('redis_degraded', lambda: {
+    (): 1 if redis_manager.configured and not redis_manager.available else 0
+})
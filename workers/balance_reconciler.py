@@ -0,0 +1,57 @@
+# workers/balance_reconciler.py
+import logging
+from typing import Dict, Optional
+from database import db
+from api.agent_pool import api
+from api.priority import RequestPriority
+from workers.job_worker import job_worker
+
+logger = logging.getLogger(__name__)
+
+# هامش الفرق المقبول بين الرصيد المشتق والرصيد الفعلي
+BALANCE_TOLERANCE = 0.01
+
+def schedule_balance_reconcile(user_id: str, player_id: str, expected_balance: float) -> Optional[int]:
+    """جدولة مطابقة الرصيد المشتق مع رصيد Ichancy الفعلي في الخلفية"""
+    return job_worker.enqueue('reconcile_balance', user_id, {
+        'player_id': player_id,
+        'expected_balance': expected_balance
+    })
+
+def run_reconcile_balance_job(job: Dict) -> Dict:
+    """جلب الرصيد الفعلي وتحديث القيمة المحفوظة"""
+    player_id = job['payload']['player_id']
+    expected_balance = float(job['payload']['expected_balance'])
+    
+    balance_result = api.get_balance(player_id)
+    
+    if not balance_result.get('success'):
+        error_msg = balance_result.get('error', 'فشل جلب الرصيد')
+        logger.warning(f"⚠️ تعذر مطابقة رصيد اللاعب {player_id}: {error_msg}")
+        return {'status': 'failed', 'error': error_msg}
+    
+    actual_balance = float(balance_result.get('balance', 0))
+    drift = actual_balance - expected_balance
+    
+    db.update_account_balance(player_id, actual_balance)
+    
+    if abs(drift) > BALANCE_TOLERANCE:
+        # فرق طبيعي إذا لعب المستخدم بين العمليتين، نسجله للمراجعة فقط
+        logger.warning(
+            f"⚠️ فرق في رصيد اللاعب {player_id}: المتوقع {expected_balance:.2f}، "
+            f"الفعلي {actual_balance:.2f} (الفرق {drift:+.2f})"
+        )
+    else:
+        logger.debug(f"✅ رصيد اللاعب {player_id} مطابق: {actual_balance:.2f} NSP")
+    
+    return {
+        'status': 'done',
+        'summary': {
+            'expected_balance': expected_balance,
+            'actual_balance': actual_balance,
+            'drift': drift
+        }
+    }
+
+# تسجيل منفذ مطابقة الرصيد في طابور المهام
+job_worker.register('reconcile_balance', run_reconcile_balance_job, priority=RequestPriority.BACKGROUND)
@@ -0,0 +1,150 @@
+# workers/health_monitor.py
+import time
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+from config import config
+from database import db
+from api.agent_pool import api
+from api.circuit_breaker import circuit_breakers, CircuitBreaker
+from api.priority import RequestPriority, run_with_priority
+from utils.metrics import metrics
+from utils.redis_manager import redis_manager
+
+logger = logging.getLogger(__name__)
+
+class HealthMonitor:
+    """فحص دوري لقاعدة البيانات وRedis وIchancy مع الاحتفاظ بآخر نتيجة لكل خدمة"""
+    
+    SERVICES = ('database', 'redis', 'ichancy')
+    
+    def __init__(self):
+        self.interval = config.APP_CONFIG["health_check_interval"]
+        self._services: Dict[str, Dict] = {
+            name: {'ok': None, 'latency': None, 'checked_at': None, 'error': None, 'enabled': True}
+            for name in self.SERVICES
+        }
+        
+        # Redis اختياري: بدونه لا يوجد ما يُفحص
+        self._services['redis']['enabled'] = redis_manager.configured
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+    
+    def snapshot(self) -> Dict[str, Dict]:
+        """آخر نتيجة فحص لكل خدمة (ok = None قبل الفحص الأول)"""
+        return {name: dict(result) for name, result in self._services.items()}
+    
+    def check_now(self) -> Dict[str, Dict]:
+        """فحص جميع الخدمات المفعلة فوراً (متزامن)"""
+        probes = {
+            'database': self._probe_database,
+            'redis': self._probe_redis,
+            'ichancy': self._probe_ichancy
+        }
+        
+        for name, probe in probes.items():
+            if self._services[name]['enabled']:
+                self._check(name, probe)
+        return self.snapshot()
+    
+    async def start(self):
+        """بدء الفحص الدوري في الخلفية"""
+        if self._running:
+            return
+        
+        self._running = True
+        self._task = asyncio.create_task(self._monitor_loop())
+        logger.info(f"✅ تم تشغيل مراقب حالة الخدمات (كل {self.interval} ثانية)")
+    
+    async def stop(self):
+        """إيقاف الفحص الدوري"""
+        self._running = False
+        
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        
+        logger.info("🛑 تم إيقاف مراقب حالة الخدمات")
+    
+    async def _monitor_loop(self):
+        loop = asyncio.get_running_loop()
+        
+        while self._running:
+            try:
+                await loop.run_in_executor(None, self.check_now)
+                await asyncio.sleep(self.interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ خطأ في مراقب حالة الخدمات: {str(e)}")
+                await asyncio.sleep(self.interval)
+    
+    def _check(self, name: str, probe: Callable[[], Optional[str]]):
+        """تشغيل فحص خدمة وتسجيل نتيجته وزمنه (الفحص يعيد رسالة خطأ أو None)"""
+        started = time.time()
+        
+        try:
+            error = probe()
+        except Exception as e:
+            error = str(e)[:200] or type(e).__name__
+        
+        previous = self._services[name]['ok']
+        ok = error is None
+        
+        # استبدال القاموس كاملاً حتى لا يقرأ المعالجون نتيجة نصف محدثة
+        self._services[name] = {
+            'ok': ok,
+            'latency': time.time() - started,
+            'checked_at': time.time(),
+            'error': error,
+            'enabled': True
+        }
+        
+        if previous is not None and previous != ok:
+            if ok:
+                logger.info(f"🟢 عادت خدمة {name} للعمل")
+            else:
+                logger.warning(f"🔴 خدمة {name} لا تستجيب: {error}")
+    
+    def _probe_database(self) -> Optional[str]:
+        db.ping()
+        return None
+    
+    def _probe_redis(self) -> Optional[str]:
+        # نجاح الفحص يعيد الأوامر إلى Redis دون انتظار نهاية فترة الذاكرة
+        redis_manager.ping()
+        return None
+    
+    def _probe_ichancy(self) -> Optional[str]:
+        # الدائرة المفتوحة تعني أن Ichancy لا يستجيب، ولا داعي لطلب إضافي
+        for endpoint, breaker in circuit_breakers.snapshot().items():
+            if breaker['state'] == CircuitBreaker.OPEN:
+                return f"دائرة {endpoint} مفتوحة: {breaker['last_error'] or 'إخفاقات متتالية'}"
+        
+        # ensure_login لا يرسل طلباً إذا نجح طلب آخر مؤخراً، ولا يسجل الدخول إلا عند انتهاء الجلسة
+        failed = [
+            agent.username for agent in api.agents
+            if not run_with_priority(RequestPriority.BACKGROUND, agent.ensure_login)
+        ]
+        
+        if failed:
+            return f"فشل تسجيل الدخول إلى Ichancy لحساب الوكيل: {', '.join(failed)}"
+        
+        return None
+
+# إنشاء نسخة وحيدة من مراقب الحالة
+health_monitor = HealthMonitor()
+
+metrics.describe('service_up', 'آخر نتيجة فحص للخدمة (1 تعمل، 0 لا تعمل)')
+metrics.gauge('service_up', lambda: {
+    (('service', name),): 1 if result['ok'] else 0
+    for name, result in health_monitor.snapshot().items()
+    if result['ok'] is not None
+})
+metrics.describe('service_check_seconds', 'زمن آخر فحص للخدمة')
+metrics.gauge('service_check_seconds', lambda: {
+    (('service', name),): result['latency']
+    for name, result in health_monitor.snapshot().items()
+    if result['latency'] is not None
+})
@@ -0,0 +1,250 @@
+# workers/job_worker.py
+import os
+import json
+import uuid
+import socket
+import asyncio
+import logging
+import traceback
+from functools import partial
+from typing import Dict, Callable, Optional
+from config import config
+from database import db
+from api.priority import RequestPriority, run_with_priority
+
+logger = logging.getLogger(__name__)
+
+class JobWorker:
+    """منفذ المهام الخلفية لعمليات الإيداع والسحب"""
+    
+    def __init__(self):
+        self.executors: Dict[str, Callable[[Dict], Dict]] = {}
+        self.priorities: Dict[str, int] = {}
+        self.concurrency = config.APP_CONFIG["job_workers"]
+        self.poll_interval = config.APP_CONFIG["job_poll_interval"]
+        self.lease_seconds = config.APP_CONFIG["job_lease_seconds"]
+        # معرف فريد لهذه النسخة من البوت يُسجل على المهام التي تحجزها
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.bot = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+        self._running = False
+    
+    def register(self, job_type: str, executor: Callable[[Dict], Dict],
+                 priority: int = RequestPriority.INTERACTIVE):
+        """تسجيل دالة تنفيذ لنوع مهمة معين مع أولوية طلباتها إلى Ichancy"""
+        self.executors[job_type] = executor
+        self.priorities[job_type] = priority
+        logger.debug(f"🧩 تم تسجيل منفذ المهام: {job_type}")
+    
+    def enqueue(self, job_type: str, user_id: str, payload: Dict,
+                chat_id=None, message_id=None) -> Optional[int]:
+        """إضافة مهمة إلى الطابور وإيقاظ المنفذين"""
+        job_id = db.enqueue_job(job_type, user_id, payload, chat_id, message_id)
+        
+        if job_id is not None:
+            self.notify()
+        
+        return job_id
+    
+    def notify(self):
+        """إيقاظ المنفذين فوراً بدلاً من انتظار دورة الفحص التالية"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+    
+    async def start(self, bot):
+        """بدء المنفذين الخلفيين"""
+        if self._running:
+            return
+        
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._running = True
+        
+        # معالجة المهام التي انقطعت بسبب توقف البوت
+        await self._handle_interrupted_jobs()
+        
+        for index in range(self.concurrency):
+            self._tasks.append(asyncio.create_task(self._worker_loop(index)))
+        self._tasks.append(asyncio.create_task(self._lease_loop()))
+        
+        logger.info(f"✅ تم تشغيل {self.concurrency} منفذ للمهام الخلفية")
+    
+    async def stop(self):
+        """إيقاف المنفذين الخلفيين"""
+        self._running = False
+        self.notify()
+        
+        for task in self._tasks:
+            task.cancel()
+        
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        
+        logger.info("🛑 تم إيقاف منفذي المهام الخلفية")
+    
+    async def _worker_loop(self, index: int):
+        """حلقة المنفذ: حجز المهام وتنفيذها واحدة تلو الأخرى"""
+        loop = asyncio.get_running_loop()
+        
+        while self._running:
+            try:
+                job = await loop.run_in_executor(None, db.claim_next_job, self.worker_id)
+                
+                if job is None:
+                    # لا توجد مهام، ننتظر الإشعار أو انتهاء مهلة الفحص
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                await self._run_job(job)
+            
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ خطأ في منفذ المهام {index}: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+    
+    async def _lease_loop(self):
+        """تجديد حجز المهام الجارية، وإنهاء مهام النسخ المتوقفة التي انتهت مهلة حجزها"""
+        loop = asyncio.get_running_loop()
+        
+        while self._running:
+            try:
+                await asyncio.sleep(self.lease_seconds / 3)
+                await loop.run_in_executor(None, db.renew_job_leases, self.worker_id)
+                await self._handle_interrupted_jobs()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ خطأ في تجديد حجز المهام: {str(e)}")
+    
+    async def _run_job(self, job: Dict):
+        """تنفيذ مهمة واحدة وإبلاغ المستخدم بالنتيجة"""
+        job_id = job['id']
+        job_type = job['job_type']
+        executor = self.executors.get(job_type)
+        loop = asyncio.get_running_loop()
+        
+        if executor is None:
+            logger.error(f"❌ لا يوجد منفذ لنوع المهمة: {job_type}")
+            await loop.run_in_executor(
+                None, partial(db.finish_job, job_id, 'failed', error_message=f'unknown job type: {job_type}')
+            )
+            return
+        
+        logger.info(f"⚙️ بدء تنفيذ المهمة {job_id} ({job_type}) للمستخدم {job['user_id']}")
+        
+        try:
+            # المنفذات متزامنة (طلبات HTTP)، لذا تعمل في خيط منفصل حتى لا تجمد البوت
+            result = await loop.run_in_executor(
+                None, partial(run_with_priority, self.priorities[job_type], executor, job)
+            )
+        except Exception as e:
+            error_msg = f"❌ فشل تنفيذ المهمة {job_id} ({job_type}): {str(e)}"
+            logger.error(error_msg)
+            
+            await loop.run_in_executor(None, partial(
+                db.log_error,
+                user_id=job['user_id'],
+                error_type='job_execution_failed',
+                error_message=error_msg,
+                stack_trace=traceback.format_exc(),
+                api_endpoint='workers.job_worker._run_job'
+            ))
+            
+            result = {
+                'status': 'failed',
+                'error': str(e),
+                'text': (
+                    f"❌ *حدث خطأ غير متوقع!*\n\n"
+                    f"⚠️ {str(e)}\n\n"
+                    f"📞 للدعم الفوري: @TSA_Support\n"
+                    f"🔧 كود الخطأ: `{str(job['user_id'])[:8]}_JOB_{job_id}_FAIL`"
+                )
+            }
+        
+        await loop.run_in_executor(None, partial(
+            db.finish_job,
+            job_id,
+            result.get('status', 'done'),
+            result=json.dumps(result.get('summary', {}), ensure_ascii=False, default=str),
+            error_message=result.get('error')
+        ))
+        
+        await self._deliver_result(job, result)
+        
+        logger.info(f"✅ انتهت المهمة {job_id} ({job_type}) بالحالة: {result.get('status', 'done')}")
+    
+    async def _deliver_result(self, job: Dict, result: Dict):
+        """تحديث رسالة المستخدم بنتيجة المهمة"""
+        if not self.bot or not job.get('chat_id') or not result.get('text'):
+            return
+        
+        try:
+            await self.bot.edit_message_text(
+                chat_id=job['chat_id'],
+                message_id=int(job['message_id']),
+                text=result['text'],
+                parse_mode='Markdown',
+                reply_markup=result.get('reply_markup')
+            )
+        except Exception as e:
+            # قد تكون الرسالة حُذفت أو لم تتغير، نرسل رسالة جديدة بدلاً منها
+            logger.warning(f"⚠️ تعذر تعديل رسالة المهمة {job['id']}: {str(e)}")
+            try:
+                await self.bot.send_message(
+                    chat_id=job['chat_id'],
+                    text=result['text'],
+                    parse_mode='Markdown',
+                    reply_markup=result.get('reply_markup')
+                )
+            except Exception as send_error:
+                logger.error(f"❌ فشل إبلاغ المستخدم بنتيجة المهمة {job['id']}: {str(send_error)}")
+    
+    async def _handle_interrupted_jobs(self):
+        """إبلاغ أصحاب المهام التي انقطع تنفيذها بسبب توقف نسختها (انتهت مهلة حجزها)"""
+        loop = asyncio.get_running_loop()
+        interrupted = await loop.run_in_executor(None, db.recover_interrupted_jobs)
+        
+        # نتائج حسم العمليات المالية لكل حالة نهائية
+        outcome_messages = {
+            'completed': "✅ تم التحقق من العملية وإكمالها تلقائياً.",
+            'compensated': "🔙 لم تكتمل العملية ولم يُخصم المبلغ من رصيدك.",
+            'failed': "💡 لم تكتمل العملية ولم يتم سحب أي مبلغ."
+        }
+        
+        for job in interrupted:
+            entry = await loop.run_in_executor(None, db.get_money_intent_for_job, job['id'])
+            outcome = outcome_messages.get(entry['status']) if entry else None
+            
+            if entry is None:
+                # انقطعت المهمة قبل تسجيل أي عملية مالية
+                outcome = "💡 لم يبدأ تنفيذ العملية ولم يتم تحريك أي مبلغ."
+            
+            await loop.run_in_executor(None, db.add_transaction, {
+                'user_id': job['user_id'],
+                'player_id': job['payload'].get('player_id'),
+                'type': f"{job['job_type']}_interrupted",
+                'amount': job['payload'].get('amount', 0),
+                'status': 'interrupted',
+                'details': f"انقطع تنفيذ المهمة {job['id']} بسبب توقف البوت - "
+                           f"{entry['status'] if entry else 'not_started'}"
+            })
+            
+            await self._deliver_result(job, {
+                'text': (
+                    f"⚠️ *تمت مقاطعة العملية!*\n\n"
+                    f"توقف النظام أثناء تنفيذ طلبك رقم `{job['id']}`.\n"
+                    f"💰 المبلغ: `{job['payload'].get('amount', 0)}` NSP\n\n"
+                    f"{outcome or '🔍 سيتم مراجعة العملية يدوياً.'}\n"
+                    f"📞 للدعم الفوري: @TSA_Support\n"
+                    f"🔧 كود الخطأ: `{str(job['user_id'])[:8]}_JOB_{job['id']}_INTERRUPTED`"
+                )
+            })
+
+# إنشاء نسخة وحيدة من منفذ المهام
+job_worker = JobWorker()
@@ -0,0 +1,123 @@
+# workers/outbox_recovery.py
+import asyncio
+import logging
+from typing import Dict, Optional
+from config import config
+from database import db
+from api.agent_pool import api
+
+logger = logging.getLogger(__name__)
+
+class MoneyOutboxRecovery:
+    """حسم العمليات المالية المعلقة دورياً بناءً على نتائج قاطعة فقط"""
+    
+    def __init__(self):
+        self.interval = config.APP_CONFIG["outbox_sweep_interval"]
+        self.grace_period = config.APP_CONFIG["outbox_grace_period"]
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+    
+    async def start(self):
+        """بدء جولات الحسم الدورية في الخلفية"""
+        if self._running:
+            return
+        
+        self._running = True
+        self._task = asyncio.create_task(self._sweep_loop())
+        logger.info(f"✅ تم تشغيل حسم العمليات المالية المعلقة (كل {self.interval} ثانية)")
+    
+    async def stop(self):
+        """إيقاف جولات الحسم الدورية"""
+        self._running = False
+        
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        
+        logger.info("🛑 تم إيقاف حسم العمليات المالية المعلقة")
+    
+    async def _sweep_loop(self):
+        loop = asyncio.get_running_loop()
+        
+        while self._running:
+            try:
+                await asyncio.sleep(self.interval)
+                await loop.run_in_executor(None, self.recover_pending)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ خطأ في حسم العمليات المالية المعلقة: {str(e)}")
+    
+    def resolve(self, entry: Dict) -> str:
+        """حسم عملية معلقة: إكمالها إذا ثبت تطبيقها على Ichancy، وإلغاؤها إذا ثبت عدمه، وإلا إحالتها للمراجعة"""
+        key = entry['idempotency_key']
+        operation = entry['operation']
+        
+        if entry['status'] == 'upstream_applied':
+            # Ichancy أكد العملية ولم تكتمل الخطوة المحلية (إضافة مبلغ السحب)
+            applied = True
+        else:
+            applied = self._applied_upstream(entry)
+        
+        if applied is True:
+            if not db.complete_money_intent(key, local_credit=(operation == 'withdraw')):
+                return entry['status']
+            status = 'completed'
+        elif applied is False:
+            if not db.compensate_money_intent(key, local_refund=(operation == 'deposit'),
+                                              error_message='لم تُطبق العملية على Ichancy'):
+                return entry['status']
+            status = 'compensated' if operation == 'deposit' else 'failed'
+        else:
+            # الرصيد لا يحسمها، فيحسمها مسؤول بأمر /settle
+            if not db.mark_money_intent(key, 'needs_review', 'نتيجة العملية على Ichancy غير معروفة'):
+                return entry['status']
+            status = 'needs_review'
+        
+        db.add_transaction({
+            'user_id': entry['user_id'],
+            'player_id': entry['player_id'],
+            'type': f'{operation}_recovered',
+            'amount': float(entry['amount']),
+            'status': status,
+            'details': f'حسم العملية {key}: {status}'
+        })
+        
+        logger.info(f"🔁 تم حسم العملية {key} بالحالة: {status}")
+        return status
+    
+    def _applied_upstream(self, entry: Dict) -> Optional[bool]:
+        """هل طُبقت العملية المعلقة حسب رصيد اللاعب الجديد مقارنة بالرصيد المسجل قبلها (None إذا تعذر الحكم)"""
+        if not entry['player_id'] or entry['balance_before'] is None:
+            return None
+        
+        # بعد مهلة السماح لم يعد الطلب الأصلي قيد التنفيذ، فرصيد لم يتغير يعني أنه لم يُطبق
+        amount = float(entry['amount'])
+        change = amount if entry['operation'] == 'deposit' else -amount
+        return api.write_applied(entry['player_id'], float(entry['balance_before']), change)
+    
+    def recover_pending(self) -> Dict[str, int]:
+        """حسم العمليات المعلقة منذ أكثر من مهلة السماح والتي لا تنفذها نسخة حية (متزامن)"""
+        entries = db.get_pending_money_intents(self.grace_period)
+        summary: Dict[str, int] = {}
+        
+        if not entries:
+            return summary
+        
+        logger.warning(f"⚠️ تم العثور على {len(entries)} عملية مالية غير مكتملة")
+        
+        for entry in entries:
+            try:
+                status = self.resolve(entry)
+            except Exception as e:
+                logger.error(f"❌ فشل حسم العملية {entry['idempotency_key']}: {str(e)}")
+                status = 'error'
+            
+            summary[status] = summary.get(status, 0) + 1
+        
+        logger.info(f"✅ نتيجة حسم العمليات المالية: {summary}")
+        return summary
+
+# إنشاء نسخة وحيدة من مسترد العمليات
+outbox_recovery = MoneyOutboxRecovery()
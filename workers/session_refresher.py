@@ -0,0 +1,92 @@
+# workers/session_refresher.py
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+from config import config
+from api.ichancy_api import IchancyAPI
+from api.agent_pool import api
+from api.clearance_store import clearance_store
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+metrics.describe('session_refresh_total', 'تجديدات جلسة الوكيل وتصريح الحماية في الخلفية حسب النتيجة')
+
+class SessionRefresher:
+    """تجديد تصريح الحماية وجلسة الوكيل قبل انتهائهما، في أوقات الخمول قدر الإمكان"""
+    
+    def __init__(self):
+        self.interval = config.APP_CONFIG["session_refresh_interval"]
+        self.margin = config.APP_CONFIG["session_refresh_margin"]
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+    
+    async def start(self):
+        """بدء التجديد الدوري في الخلفية"""
+        if self._running:
+            return
+        
+        self._running = True
+        self._task = asyncio.create_task(self._refresh_loop())
+        logger.info(f"✅ تم تشغيل مجدد الجلسة (قبل الانتهاء بـ {self.margin} ثانية)")
+    
+    async def stop(self):
+        """إيقاف التجديد الدوري"""
+        self._running = False
+        
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        
+        logger.info("🛑 تم إيقاف مجدد الجلسة")
+    
+    async def _refresh_loop(self):
+        while self._running:
+            try:
+                await asyncio.sleep(self.interval)
+                await self.refresh_due()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"❌ خطأ في مجدد الجلسة: {str(e)}")
+    
+    async def refresh_due(self) -> Dict[str, bool]:
+        """تجديد ما اقترب انتهاؤه لكل حساب وكيل، ويعيد نتيجة كل تجديد تم"""
+        loop = asyncio.get_running_loop()
+        results = {}
+        refreshed_egresses = set()
+        
+        for agent in api.agents:
+            # التصريح أولاً: تسجيل الدخول نفسه يمر عبر الحماية (وهو مشترك بين وكلاء نفس المخرج)
+            egress = agent.egress.name
+            clearance = await loop.run_in_executor(None, clearance_store.get, egress)
+            if egress not in refreshed_egresses and clearance and self._due(clearance['expires_at'], agent):
+                refreshed_egresses.add(egress)
+                results[f'clearance:{egress}'] = success = await agent.refresh_clearance_async()
+                metrics.inc('session_refresh_total', kind='clearance', outcome='renewed' if success else 'failed')
+            
+            if agent.is_logged_in and agent.session_expires_at and self._due(agent.session_expires_at, agent):
+                results[f'session:{agent.username}'] = success = await loop.run_in_executor(None, agent.refresh_session)
+                metrics.inc('session_refresh_total', kind='session', outcome='renewed' if success else 'failed')
+        
+        return results
+    
+    def _due(self, expires_at: float, agent: IchancyAPI) -> bool:
+        """هل حان وقت التجديد"""
+        remaining = expires_at - time.time()
+        
+        if remaining > self.margin:
+            return False
+        
+        # في الربع الأخير من المهلة نجدد حتى تحت الضغط، وقبله ننتظر لحظة خمول
+        return remaining <= self.margin / 4 or self._idle(agent)
+    
+    def _idle(self, agent: IchancyAPI) -> bool:
+        """لا طلبات جارية أو منتظرة إلى Ichancy عبر حساب الوكيل"""
+        snapshot = agent.limiter.snapshot()
+        return snapshot['in_flight'] == 0 and snapshot['waiting'] == 0
+
+# إنشاء نسخة وحيدة من مجدد الجلسة
+session_refresher = SessionRefresher()